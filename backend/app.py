@@ -2,14 +2,26 @@ import os
 import json
 import asyncio
 import aiohttp
+import time
 import requests
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
-from bs4 import BeautifulSoup
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory, stream_with_context
 from flask_cors import CORS
 import firebase_admin
 from firebase_admin import credentials, auth, firestore
-import google.generativeai as genai
+from utils.html_parser import extract_page_features
+from utils.cache import create_cache
+from utils.link_checker import link_cache
+from utils.async_runtime import run_coroutine, get_http_session
+from utils.llm_gateway import coalesced_async
+from utils.llm_cache import llm_cache, llm_cache_key, cached_generate_async, cached_stream
+from utils.gemini_client import generate_content_async, stream_generate_content, GeminiError
+from utils.rate_limiter import priority_lane, limiter_stats
+from utils.job_queue import JobQueue, QueueFullError
+from services.website_analysis import iter_website_analysis
+from services.pagespeed_analysis import pagespeed_cache, get_pagespeed_report, PAGESPEED_STRATEGIES
+from services.site_crawler import crawl_site, CRAWL_MAX_PAGES
+from services.bulk_analysis import iter_bulk_analysis, parse_url_list, BULK_CONCURRENCY, BULK_PER_DOMAIN, BULK_MAX_URLS
 
 # Suppress InsecureRequestWarning
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
@@ -29,41 +41,28 @@ except Exception as e:
     print(f"Error initializing Firebase: {e}. Firestore functionality will be disabled.")
     db = None
 
-# Gemini API Configuration
+# Gemini API Configuration (requests go through utils.gemini_client)
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
+GEMINI_MODEL = 'gemini-1.5-pro'
 if not GEMINI_API_KEY:
     print("Warning: GEMINI_API_KEY is not set.")
-    genai = None # Disable Gemini functionality
-else:
-    genai.configure(api_key=GEMINI_API_KEY)
 
 # Flask App Configuration
 app = Flask(__name__, static_folder='frontend/public/static', template_folder='frontend/public')
 CORS(app)
 
-# --- In-memory cache for API results ---
-results_cache = {}
-
-# --- Helper function to run async code in a new loop ---
-def run_async_in_new_loop(coro):
-    try:
-        loop = asyncio.get_running_loop()
-    except RuntimeError:
-        loop = None
-    if loop and loop.is_running():
-        # If a loop is already running, run the coroutine in a new one
-        new_loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(new_loop)
-        try:
-            return new_loop.run_until_complete(coro)
-        finally:
-            new_loop.close()
-            # Restore the previous event loop
-            if loop:
-                asyncio.set_event_loop(loop)
-    else:
-        # If no loop is running, create one
-        return asyncio.run(coro)
+# --- Bounded cache for API results ---
+# TTLs are per endpoint namespace, in seconds; None means the entry never expires.
+# Set RESULTS_CACHE_BACKEND=sqlite (or mmap / redis) to share the cache between gunicorn workers.
+results_cache = create_cache(
+    "RESULTS_CACHE",
+    ttls={
+        "rewrite": None,
+        "analyze_article": 24 * 3600,
+        "get_keywords": 6 * 3600,
+        "competitor_analysis": 6 * 3600,
+    }
+)
 
 # --- Routes for Serving Frontend Files ---
 @app.route('/')
@@ -103,18 +102,34 @@ def google_auth_handler():
     except Exception as e:
         return jsonify({"error": f"Failed to authenticate: {e}"}), 500
 
+# --- Cache statistics ---
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify({"results_cache": results_cache.stats(), "link_cache": link_cache.stats(), "llm_cache": llm_cache.stats(), "pagespeed_cache": pagespeed_cache.stats()})
+
+@app.route('/api/rate_limits', methods=['GET'])
+def rate_limit_stats():
+    """Queue depth and wait times per API key/model and priority lane, for sizing quotas."""
+    return jsonify(limiter_stats())
+
+@app.route('/api/jobs/stats', methods=['GET'])
+def job_stats():
+    return jsonify(job_queue.stats())
+
 # --- Asynchronous Helper Functions ---
-async def call_gemini_api_for_json_async(prompt_text):
-    if not genai:
+@coalesced_async
+async def call_gemini_api_for_json_async(prompt_text, use_cache=True):
+    if not GEMINI_API_KEY:
         raise ValueError("Gemini API key is not configured.")
-    
+    key = llm_cache_key(GEMINI_MODEL, prompt_text, {"response_format": "json"})
+    return await cached_generate_async(key, lambda: _generate_json_async(prompt_text), use_cache=use_cache)
+
+async def _generate_json_async(prompt_text):
     prompt = f"{prompt_text}\n\nReturn the response as a single, valid JSON object only."
     
     try:
-        model = genai.GenerativeModel('gemini-1.5-pro')
-        response = await model.generate_content_async(prompt)
-        
-        response_text = response.text.strip().strip('`').strip()
+        response_text = await generate_content_async(GEMINI_MODEL, prompt, api_key=GEMINI_API_KEY)
+        response_text = (response_text or "").strip().strip('`').strip()
         if response_text.startswith('json'):
             response_text = response_text[4:].strip()
         
@@ -124,8 +139,8 @@ async def call_gemini_api_for_json_async(prompt_text):
         except json.JSONDecodeError as e:
             print(f"Initial JSON parse failed: {e}. Trying to fix with a new prompt.")
             fix_prompt = f"The previous response was not a valid JSON. Please provide a valid JSON object based on the following task: '{prompt_text}'. The response must be a single, valid JSON object."
-            fix_response = await model.generate_content_async(fix_prompt)
-            fix_response_text = fix_response.text.strip('`').strip()
+            fix_response_text = await generate_content_async(GEMINI_MODEL, fix_prompt, api_key=GEMINI_API_KEY)
+            fix_response_text = (fix_response_text or "").strip('`').strip()
             if fix_response_text.startswith('json'):
                 fix_response_text = fix_response_text[4:].strip()
             return json.loads(fix_response_text)
@@ -133,30 +148,37 @@ async def call_gemini_api_for_json_async(prompt_text):
     except Exception as e:
         raise RuntimeError(f"Failed to get a valid response from Gemini API: {e}") from e
 
-async def call_gemini_api_for_text_async(prompt):
-    if not genai:
+@coalesced_async
+async def call_gemini_api_for_text_async(prompt, use_cache=True):
+    if not GEMINI_API_KEY:
         raise ValueError("Gemini API key is not configured.")
-    
+    key = llm_cache_key(GEMINI_MODEL, prompt)
+    return await cached_generate_async(key, lambda: _generate_text_async(prompt), use_cache=use_cache)
+
+async def _generate_text_async(prompt):
     try:
-        model = genai.GenerativeModel('gemini-1.5-pro')
-        response = await model.generate_content_async(prompt)
-        return response.text
+        response_text = await generate_content_async(GEMINI_MODEL, prompt, api_key=GEMINI_API_KEY)
+        if response_text is None:
+            raise ValueError("the model returned no text")
+        return response_text
     except Exception as e:
         raise RuntimeError(f"Failed to get a response from Gemini API: {e}") from e
 
 async def fetch_website_content_async(url):
     """Fetches website content asynchronously and handles common errors."""
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
-        }
-        async with aiohttp.ClientSession(headers=headers) as session:
-            async with session.get(url, timeout=10, ssl=False) as response:
-                response.raise_for_status()
-                return await response.text()
-    except aiohttp.ClientError as e:
+        # Shared keep-alive session of this worker; no new TCP/TLS handshake per request
+        session = await get_http_session()
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=10), ssl=False) as response:
+            response.raise_for_status()
+            return await response.text()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         raise RuntimeError(f"فشل في جلب عنوان URL: {e}") from e
 
+async def fetch_many_websites_async(*urls):
+    """Fetches several websites concurrently over the shared session."""
+    return await asyncio.gather(*(fetch_website_content_async(url) for url in urls))
+
 # --- 1. Article Rewriter ---
 @app.route('/api/rewrite', methods=['POST'])
 def rewrite_article():
@@ -166,19 +188,62 @@ def rewrite_article():
     if not text:
         return jsonify({"error": "Text to rewrite is required"}), 400
     
-    cache_key = f"rewrite:{text}"
-    if cache_key in results_cache:
-        return jsonify({"rewritten_text": results_cache[cache_key]})
+    cached = results_cache.get("rewrite", text)
+    if cached is not None:
+        return jsonify({"rewritten_text": cached})
 
-    prompt = f"أعد كتابة هذا المقال بأسلوب احترافي وجذاب مع الحفاظ على المعنى الأصلي:\n\n{text}"
-    
     try:
-        gemini_response = run_async_in_new_loop(call_gemini_api_for_text_async(prompt))
-        results_cache[cache_key] = gemini_response # Store in cache
+        gemini_response = run_coroutine(call_gemini_api_for_text_async(rewrite_prompt(text)))
+        results_cache.set("rewrite", text, gemini_response) # Store in cache
         return jsonify({"rewritten_text": gemini_response})
     except (ValueError, RuntimeError) as e:
         return jsonify({"error": str(e)}), 500
 
+def rewrite_prompt(text):
+    return f"أعد كتابة هذا المقال بأسلوب احترافي وجذاب مع الحفاظ على المعنى الأصلي:\n\n{text}"
+
+@app.route('/api/rewrite/stream', methods=['GET', 'POST'])
+def rewrite_article_stream():
+    """
+    Streams the rewritten article while it is generated: 'chunk' events carry the
+    new text, the final 'done' event the whole article. Same request, results cache
+    and LLM cache entry as /api/rewrite; Server-Sent Events, or NDJSON with format=ndjson.
+    """
+    data = (request.get_json(silent=True) or {}) if request.method == 'POST' else request.args
+    text = data.get('text')
+
+    if not text:
+        return jsonify({"error": "Text to rewrite is required"}), 400
+    if not GEMINI_API_KEY:
+        return jsonify({"error": "Gemini API key is not configured."}), 500
+
+    stream_format = data.get('format') or ('ndjson' if 'application/x-ndjson' in request.headers.get('Accept', '') else 'sse')
+    mimetype = 'application/x-ndjson' if stream_format == 'ndjson' else 'text/event-stream'
+
+    def generate():
+        cached = results_cache.get("rewrite", text)
+        if cached is not None:
+            yield format_stream_event("chunk", {"text": cached}, stream_format)
+            yield format_stream_event("done", {"rewritten_text": cached, "cached": True}, stream_format)
+            return
+        prompt = rewrite_prompt(text)
+        chunks = []
+        try:
+            for chunk in cached_stream(llm_cache_key(GEMINI_MODEL, prompt),
+                                       lambda: stream_generate_content(GEMINI_MODEL, prompt, api_key=GEMINI_API_KEY)):
+                chunks.append(chunk)
+                yield format_stream_event("chunk", {"text": chunk}, stream_format)
+        except GeminiError as e:
+            yield format_stream_event("error", {"error": f"Failed to get a response from Gemini API: {e}"}, stream_format)
+            return
+        rewritten_text = "".join(chunks)
+        # Only a complete answer is cached; a client that disconnects stops the generation
+        results_cache.set("rewrite", text, rewritten_text)
+        yield format_stream_event("done", {"rewritten_text": rewritten_text, "cached": False}, stream_format)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers=headers)
+
 # --- 2. Article Analysis ---
 @app.route('/api/analyze-article', methods=['POST'])
 def analyze_article_content():
@@ -188,9 +253,9 @@ def analyze_article_content():
     if not article_content:
         return jsonify({"error": "Article content is required"}), 400
     
-    cache_key = f"analyze_article:{article_content}"
-    if cache_key in results_cache:
-        return jsonify({"analysis_report": results_cache[cache_key]})
+    cached = results_cache.get("analyze_article", article_content)
+    if cached is not None:
+        return jsonify({"analysis_report": cached})
 
     prompt = f"""
     قم بتحليل المحتوى التالي من المقال وقدم تقريراً مفصلاً بتنسيق JSON. التقرير يجب أن يحتوي على الحقول التالية:
@@ -206,8 +271,8 @@ def analyze_article_content():
     """
     
     try:
-        gemini_response = run_async_in_new_loop(call_gemini_api_for_json_async(prompt))
-        results_cache[cache_key] = gemini_response # Store in cache
+        gemini_response = run_coroutine(call_gemini_api_for_json_async(prompt))
+        results_cache.set("analyze_article", article_content, gemini_response) # Store in cache
         return jsonify({"analysis_report": gemini_response})
     except (ValueError, RuntimeError, json.JSONDecodeError) as e:
         return jsonify({"error": f"فشل في تحليل المحتوى. {e}"}), 500
@@ -222,14 +287,13 @@ def get_website_keywords():
     if not url:
         return jsonify({"error": "URL is required"}), 400
 
-    cache_key = f"get_keywords:{url}"
-    if cache_key in results_cache:
-        return jsonify({"keywords_report": results_cache[cache_key]})
+    cached = results_cache.get("get_keywords", url)
+    if cached is not None:
+        return jsonify({"keywords_report": cached})
 
     try:
-        response_text = run_async_in_new_loop(fetch_website_content_async(url))
-        soup = BeautifulSoup(response_text, 'html.parser')
-        page_text = soup.get_text()
+        response_text = run_coroutine(fetch_website_content_async(url))
+        page_text = extract_page_features(response_text).text
 
         trimmed_text = page_text[:2000]
 
@@ -243,8 +307,8 @@ def get_website_keywords():
         {trimmed_text}
         """
         
-        gemini_response = run_async_in_new_loop(call_gemini_api_for_json_async(prompt))
-        results_cache[cache_key] = gemini_response # Store in cache
+        gemini_response = run_coroutine(call_gemini_api_for_json_async(prompt))
+        results_cache.set("get_keywords", url, gemini_response) # Store in cache
         return jsonify({"keywords_report": gemini_response})
 
     except RuntimeError as e:
@@ -264,21 +328,16 @@ def analyze_competitors():
     if not my_url or not competitor_url:
         return jsonify({"error": "Both URLs are required"}), 400
 
-    cache_key = f"competitor_analysis:{my_url}:{competitor_url}"
-    if cache_key in results_cache:
-        return jsonify({"comparison_report": results_cache[cache_key]})
+    cache_key = [my_url, competitor_url]
+    cached = results_cache.get("competitor_analysis", cache_key)
+    if cached is not None:
+        return jsonify({"comparison_report": cached})
 
     try:
-        my_response_text, competitor_response_text = run_async_in_new_loop(asyncio.gather(
-            fetch_website_content_async(my_url),
-            fetch_website_content_async(competitor_url)
-        ))
-
-        my_soup = BeautifulSoup(my_response_text, 'html.parser')
-        competitor_soup = BeautifulSoup(competitor_response_text, 'html.parser')
+        my_response_text, competitor_response_text = run_coroutine(fetch_many_websites_async(my_url, competitor_url))
 
-        my_text = my_soup.get_text()[:1500] 
-        competitor_text = competitor_soup.get_text()[:1500]
+        my_text = extract_page_features(my_response_text).text[:1500]
+        competitor_text = extract_page_features(competitor_response_text).text[:1500]
 
         prompt = f"""
         قارن بين النصين وقدم الإجابة ككائن JSON يحتوي على الحقول التالية:
@@ -292,8 +351,8 @@ def analyze_competitors():
         {competitor_text}
         """
         
-        gemini_response = run_async_in_new_loop(call_gemini_api_for_json_async(prompt))
-        results_cache[cache_key] = gemini_response # Store in cache
+        gemini_response = run_coroutine(call_gemini_api_for_json_async(prompt))
+        results_cache.set("competitor_analysis", cache_key, gemini_response) # Store in cache
         return jsonify({"comparison_report": gemini_response})
 
     except RuntimeError as e:
@@ -303,6 +362,160 @@ def analyze_competitors():
     except Exception as e:
         return jsonify({"error": "حدث خطأ غير متوقع. يرجى المحاولة مرة أخرى لاحقًا."}), 500
 
+# --- 5. Streaming Website Analysis ---
+def format_stream_event(event, data, stream_format):
+    """Encodes one event as a Server-Sent Event or as an NDJSON line."""
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    if stream_format == "ndjson":
+        return f'{{"event": {json.dumps(event)}, "data": {payload}}}\n'
+    return f"event: {event}\ndata: {payload}\n\n"
+
+@app.route('/api/analyze_website/stream', methods=['GET', 'POST'])
+def analyze_website_stream():
+    """
+    Streams the website analysis section by section as each one finishes.
+    GET (for EventSource) takes url/lang query parameters; POST takes a JSON body.
+    Responds with Server-Sent Events, or NDJSON when format=ndjson or the client
+    accepts application/x-ndjson. The last event is a 'summary'.
+    """
+    data = (request.get_json(silent=True) or {}) if request.method == 'POST' else request.args
+    url = data.get('url')
+    lang = data.get('lang', 'en')
+
+    if not url:
+        return jsonify({"error": "URL is required"}), 400
+
+    stream_format = data.get('format') or ('ndjson' if 'application/x-ndjson' in request.headers.get('Accept', '') else 'sse')
+    mimetype = 'application/x-ndjson' if stream_format == 'ndjson' else 'text/event-stream'
+
+    def generate():
+        started_at = time.monotonic()
+        sections = []
+        try:
+            for section, section_data in iter_website_analysis(url, lang):
+                sections.append(section)
+                yield format_stream_event(section, section_data, stream_format)
+            summary = {"url": url, "status": "complete", "sections": sections}
+        except Exception as e:
+            print(f"Error streaming website analysis for {url}: {e}")
+            summary = {"url": url, "status": "failed", "sections": sections, "error": str(e)}
+        summary["elapsed_seconds"] = round(time.monotonic() - started_at, 2)
+        yield format_stream_event("summary", summary, stream_format)
+
+    # Disable proxy buffering so each section reaches the client as soon as it is written
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers=headers)
+
+# --- 6. Background Jobs ---
+# Full reports run on a local worker pool; jobs are persisted in SQLite (JOB_QUEUE_PATH)
+# so a restart does not lose them. Clients submit, then poll for partial and final results.
+# Background jobs use the bulk lane of the API rate limiters, behind interactive requests
+def run_website_analysis_job(payload, report):
+    results = {}
+    with priority_lane("bulk"):
+        for section, section_data in iter_website_analysis(payload["url"], payload.get("lang", "en")):
+            results[section] = section_data
+            report(section, section_data)
+    return results
+
+def run_site_crawl_job(payload, report):
+    with priority_lane("bulk"):
+        return crawl_site(
+            payload["url"],
+            max_pages=payload.get("max_pages"),
+            progress=lambda pages: report("progress", {"pages_crawled": pages})
+        )
+
+job_queue = JobQueue()
+job_queue.register("website_analysis", run_website_analysis_job)
+job_queue.register("site_crawl", run_site_crawl_job)
+job_queue.start()
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    data = request.get_json(silent=True) or {}
+    url = data.get('url')
+    kind = data.get('kind', 'website_analysis')
+
+    if not url:
+        return jsonify({"error": "URL is required"}), 400
+
+    try:
+        payload = {"url": url, "lang": data.get('lang', 'en')}
+        if data.get('max_pages'):
+            payload["max_pages"] = min(int(data['max_pages']), CRAWL_MAX_PAGES)
+        job_id = job_queue.submit(kind, payload)
+    except QueueFullError as e:
+        return jsonify({"error": str(e)}), 429, {"Retry-After": "30"}
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"job_id": job_id, "status": "queued", "status_url": f"/api/jobs/{job_id}"}), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+# --- 7. Bulk Website Analysis ---
+@app.route('/api/bulk_analysis', methods=['POST'])
+def bulk_analysis():
+    """
+    Analyzes a batch of URLs and streams one NDJSON line per URL as it finishes,
+    then a summary line with throughput (URLs per minute).
+    Accepts JSON {"urls": [...]}, a text/CSV body, or a CSV upload in the 'file' field.
+    """
+    data = request.get_json(silent=True) or {}
+    if 'file' in request.files:
+        urls = parse_url_list(request.files['file'].read().decode('utf-8-sig', errors='replace'))
+    elif data.get('urls'):
+        urls = parse_url_list("\n".join(str(url) for url in data['urls']))
+    else:
+        urls = parse_url_list(request.get_data(as_text=True))
+    options = data or request.args
+
+    if not urls:
+        return jsonify({"error": "At least one URL is required"}), 400
+    if len(urls) > BULK_MAX_URLS:
+        return jsonify({"error": f"Too many URLs: {len(urls)} (maximum {BULK_MAX_URLS} per batch)"}), 413
+
+    lang = options.get('lang', 'en')
+    # Clients may lower the limits, never raise them
+    try:
+        concurrency = min(int(options.get('concurrency', BULK_CONCURRENCY)), BULK_CONCURRENCY)
+        per_domain = min(int(options.get('per_domain', BULK_PER_DOMAIN)), BULK_PER_DOMAIN)
+    except (TypeError, ValueError):
+        return jsonify({"error": "concurrency and per_domain must be integers"}), 400
+
+    def generate():
+        for record in iter_bulk_analysis(urls, lang, max(concurrency, 1), max(per_domain, 1)):
+            yield json.dumps(record, ensure_ascii=False, default=str) + "\n"
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson', headers=headers)
+
+# --- 8. PageSpeed Insights ---
+@app.route('/api/pagespeed', methods=['GET', 'POST'])
+def pagespeed_report():
+    """
+    Mobile and desktop PageSpeed Insights for a URL, run concurrently and merged
+    into one report. Optional: strategies ("mobile,desktop"), fresh=true to skip the cache.
+    """
+    data = (request.get_json(silent=True) or {}) if request.method == 'POST' else request.args
+    url = data.get('url')
+    if not url:
+        return jsonify({"error": "URL is required"}), 400
+
+    strategies = data.get('strategies') or PAGESPEED_STRATEGIES
+    if isinstance(strategies, str):
+        strategies = [strategy.strip() for strategy in strategies.split(',') if strategy.strip()]
+    if not strategies or any(strategy not in PAGESPEED_STRATEGIES for strategy in strategies):
+        return jsonify({"error": f"strategies must be among: {', '.join(PAGESPEED_STRATEGIES)}"}), 400
+
+    use_cache = str(data.get('fresh', '')).lower() not in ('1', 'true', 'yes')
+    return jsonify(get_pagespeed_report(url, os.environ.get("PAGESPEED_API_KEY"), strategies, use_cache=use_cache))
+
 if __name__ == '__main__':
     from sys import platform
     port = int(os.environ.get("PORT", 5000))
@@ -1,8 +1,13 @@
-import requests
 import json
 import os
+from utils.gemini_client import generate_content, GeminiError
+from utils.llm_gateway import coalesced, merged_request
+from utils.llm_cache import llm_cache_key, cached_generate
 
-def call_gemini_api(prompt, api_key, response_schema=None, lang="en"):
+GEMINI_MODEL = "gemini-2.0-flash"
+
+@coalesced
+def call_gemini_api(prompt, api_key, response_schema=None, lang="en", use_cache=True):
     """
     Calls the Gemini 2.0 Flash API to generate content.
     Args:
@@ -10,6 +15,7 @@ def call_gemini_api(prompt, api_key, response_schema=None, lang="en"):
         api_key (str): Your Gemini API key.
         response_schema (dict, optional): JSON schema for structured responses. Defaults to None.
         lang (str): Preferred language for the response (e.g., "en", "ar", "fr").
+        use_cache (bool): Serve and store the answer in the LLM response cache. Defaults to True.
     Returns:
         dict: Parsed JSON response from the API.
     Raises:
@@ -21,62 +27,45 @@ def call_gemini_api(prompt, api_key, response_schema=None, lang="en"):
     # Add language instruction to the prompt
     full_prompt = f"{prompt}\n\nRespond in {lang} language."
 
-    chat_history = []
-    # FIX: Changed .push to .append for Python lists
-    chat_history.append({ "role": "user", "parts": [{ "text": full_prompt }] })
-
-    payload = {
-        "contents": chat_history,
-        "generationConfig": {
-            "temperature": 0.7,
-            "topP": 0.95,
-            "topK": 40,
-        }
+    generation_config = {
+        "temperature": 0.7,
+        "topP": 0.95,
+        "topK": 40,
     }
     if response_schema:
-        payload["generationConfig"]["responseMimeType"] = "application/json"
-        payload["generationConfig"]["responseSchema"] = response_schema
+        generation_config["responseMimeType"] = "application/json"
+        generation_config["responseSchema"] = response_schema
     else:
-        payload["generationConfig"]["responseMimeType"] = "text/plain"
-
-    api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={api_key}"
-
+        generation_config["responseMimeType"] = "text/plain"
+
+    cache_key = llm_cache_key(GEMINI_MODEL, full_prompt, generation_config, response_schema, lang)
+    return cached_generate(
+        cache_key,
+        lambda: _generate_content(full_prompt, generation_config, api_key, response_schema),
+        use_cache=use_cache,
+        should_cache=lambda result: result != {"text": "N/A"}
+    )
+
+def _generate_content(prompt, generation_config, api_key, response_schema=None):
+    """Sends one generateContent request and parses the answer (see call_gemini_api)."""
     try:
-        response = requests.post(
-            api_url,
-            headers={'Content-Type': 'application/json'},
-            data=json.dumps(payload)
-        )
-        response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
-        result = response.json()
-
-        if result.get("candidates") and result["candidates"][0].get("content") and \
-           result["candidates"][0]["content"].get("parts") and \
-           result["candidates"][0]["content"]["parts"][0].get("text"):
-            
-            text_response = result["candidates"][0]["content"]["parts"][0]["text"]
-            
-            if response_schema:
-                try:
-                    # Gemini might return JSON as a string, need to parse it
-                    return json.loads(text_response)
-                except json.JSONDecodeError:
-                    print(f"Warning: Gemini returned non-JSON string for expected JSON schema: {text_response}")
-                    # Attempt to return raw text if JSON parsing fails, or raise error
-                    raise Exception(f"Failed to parse JSON response from Gemini: {text_response}")
-            else:
-                return {"text": text_response}
-        else:
-            # Handle cases where candidates, content, parts, or text are missing
-            print(f"Warning: Unexpected response structure from Gemini API: {result}")
-            return {"text": "N/A"} # Return N/A for text if structure is bad
-
-    except requests.exceptions.RequestException as e:
+        text_response = generate_content(GEMINI_MODEL, prompt, generation_config, api_key=api_key)
+    except GeminiError as e:
         print(f"Gemini API request failed: {e}")
         raise Exception(f"Gemini API request failed: {e}")
-    except Exception as e:
-        print(f"An error occurred during Gemini API call: {e}")
-        raise Exception(f"An error occurred during Gemini API call: {e}")
+
+    if text_response is None:
+        # Blocked or empty answer: no candidate text
+        print("Warning: Unexpected response structure from Gemini API (no candidate text).")
+        return {"text": "N/A"}
+    if response_schema:
+        try:
+            # Gemini returns the structured answer as a JSON string
+            return json.loads(text_response)
+        except json.JSONDecodeError:
+            print(f"Warning: Gemini returned non-JSON string for expected JSON schema: {text_response}")
+            raise Exception(f"Failed to parse JSON response from Gemini: {text_response}")
+    return {"text": text_response}
 
 
 def get_ai_suggestions(url, analysis_results, lang="en"):
@@ -130,29 +119,48 @@ def get_ai_suggestions(url, analysis_results, lang="en"):
     User Experience: {json.dumps(analysis_results.get('user_experience', 'N/A'))}
     """
 
+    prompts = {
+        "seo_improvement_suggestions": seo_prompt,
+        "content_originality_tone": content_prompt,
+        "summary": summary_prompt
+    }
+
+    # One structured request answers all three; the analysis data and text sample are sent once.
+    # Anything it fails to answer falls back to the separate prompts, run in parallel.
+    tasks = {
+        "seo_improvement_suggestions": {"instruction": "As an expert SEO analyst, 3-5 specific, actionable SEO improvement recommendations based on the SEO data."},
+        "content_originality_tone": {"instruction": "Insights on the originality, tone and readability of the text sample, considering the UX issues, with suggestions for improvement."},
+        "summary": {"instruction": "An overall summary of the website analysis: strengths, weaknesses and critical areas for improvement."}
+    }
+    context = f"""
+    Website: {url}
+    Domain Authority: {json.dumps(analysis_results.get('domain_authority', 'N/A'))}
+    Page Speed: {json.dumps(analysis_results.get('page_speed', 'N/A'))}
+    SEO Quality: {json.dumps(seo_quality)}
+    User Experience: {json.dumps(user_experience)}
+    Text Sample: "{extracted_text_sample}"
+    """
+
+    def call_single(name):
+        return call_gemini_api(prompts[name], api_key, lang=lang).get("text", "N/A")
+
+    answers = merged_request(
+        tasks,
+        call_json=lambda prompt, schema: call_gemini_api(prompt, api_key, schema, lang),
+        call_single=call_single,
+        context=context
+    )
+
     ai_suggestions = {
         "seo_improvement_suggestions": "N/A",
         "content_originality_tone": "N/A",
         "summary": "N/A"
     }
-
-    try:
-        seo_response = call_gemini_api(seo_prompt, api_key, lang=lang)
-        ai_suggestions["seo_improvement_suggestions"] = seo_response.get("text", "N/A")
-    except Exception as e:
-        print(f"Error getting AI SEO suggestions: {e}")
-
-    try:
-        content_response = call_gemini_api(content_prompt, api_key, lang=lang)
-        ai_suggestions["content_originality_tone"] = content_response.get("text", "N/A")
-    except Exception as e:
-        print(f"Error getting AI content insights: {e}")
-
-    try:
-        summary_response = call_gemini_api(summary_prompt, api_key, lang=lang)
-        ai_suggestions["summary"] = summary_response.get("text", "N/A")
-    except Exception as e:
-        print(f"Error getting AI overall summary: {e}")
+    for name, answer in answers.items():
+        if isinstance(answer, Exception):
+            print(f"Error getting AI {name}: {answer}")
+        else:
+            ai_suggestions[name] = answer
 
     return ai_suggestions
 
@@ -1,56 +1,30 @@
-import os
 import json
-import requests
+from utils.llm_gateway import coalesced, merged_request
+from utils.llm_cache import llm_cache_key, cached_generate
+from utils.gemini_client import generate_content, GeminiError
 
-def call_gemini_api(prompt, model_name="gemini-2.5-flash-preview-05-20"):
+@coalesced
+def call_gemini_api(prompt, model_name="gemini-2.5-flash-preview-05-20", response_schema=None, use_cache=True):
     """
     Calls the Gemini API to generate text based on a given prompt.
-    Handles exponential backoff for retries.
+    With response_schema, requests structured JSON output and returns the JSON text.
+    Answers are served from the LLM response cache unless use_cache=False.
+    Retries and deadlines are handled by utils.gemini_client.
     """
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        print("Error: GEMINI_API_KEY environment variable not set.")
-        return None
-
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={api_key}"
-    headers = {
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "contents": [{"role": "user", "parts": [{"text": prompt}]}]
-    }
-
-    retries = 0
-    max_retries = 5
-    base_delay = 1  # seconds
-
-    while retries < max_retries:
-        try:
-            response = requests.post(url, headers=headers, data=json.dumps(payload), timeout=60)
-            response.raise_for_status()  # Raise an HTTPError for bad responses (4xx or 5xx)
-            result = response.json()
-
-            if result and result.get("candidates") and len(result["candidates"]) > 0 and \
-               result["candidates"][0].get("content") and result["candidates"][0]["content"].get("parts") and \
-               len(result["candidates"][0]["content"]["parts"]) > 0:
-                return result["candidates"][0]["content"]["parts"][0]["text"]
-            else:
-                print(f"Gemini API returned an unexpected structure: {result}")
-                return None
-        except requests.exceptions.Timeout:
-            print(f"Request timed out. Retrying {retries + 1}/{max_retries}...")
-        except requests.exceptions.RequestException as e:
-            print(f"Request failed: {e}. Retrying {retries + 1}/{max_retries}...")
-        except json.JSONDecodeError:
-            print(f"Failed to decode JSON from response: {response.text}. Retrying {retries + 1}/{max_retries}...")
+    generation_config = None
+    if response_schema:
+        generation_config = {"responseMimeType": "application/json", "responseSchema": response_schema}
 
-        retries += 1
-        delay = base_delay * (2 ** retries)  # Exponential backoff
-        print(f"Waiting for {delay} seconds before retrying...")
-        time.sleep(delay)
+    cache_key = llm_cache_key(model_name, prompt, generation_config, response_schema)
+    return cached_generate(cache_key, lambda: _generate_content(model_name, prompt, generation_config), use_cache=use_cache)
 
-    print(f"Failed to get a successful response from Gemini API after {max_retries} retries.")
-    return None
+def _generate_content(model_name, prompt, generation_config=None):
+    """Sends one generateContent request through the shared client. Returns the text or None."""
+    try:
+        return generate_content(model_name, prompt, generation_config)
+    except GeminiError as e:
+        print(f"Failed to get a successful response from Gemini API: {e}")
+        return None
 
 def analyze_article_content(article_text, lang="en"):
     """
@@ -83,23 +57,38 @@ def analyze_article_content(article_text, lang="en"):
     # Select prompts based on language
     selected_prompts = prompts.get(lang, prompts["en"]) # Default to English if language not found
 
-    try:
-        # Generate suggested structure
-        structure_prompt = selected_prompts["structure"] + article_text
-        results["suggested_structure"] = call_gemini_api(structure_prompt) or "No suggestions available."
-
-        # Generate keyword suggestions
-        keywords_prompt = selected_prompts["keywords"] + article_text
-        results["keyword_suggestions"] = call_gemini_api(keywords_prompt) or "No suggestions available."
+    # The article is sent once: a single structured request answers the four questions.
+    # Anything it fails to answer falls back to the separate prompts, run in parallel.
+    article_label = "المقال:" if lang == "ar" else "Article:"
+    fields = {
+        "suggested_structure": ("structure", "No suggestions available."),
+        "keyword_suggestions": ("keywords", "No suggestions available."),
+        "content_health_assessment": ("health", "No assessment available."),
+        "originality_assessment": ("originality", "No assessment available.")
+    }
+    tasks = {
+        name: {"instruction": selected_prompts[key][:selected_prompts[key].rfind(article_label)].strip()}
+        for name, (key, _) in fields.items()
+    }
 
-        # Generate content health assessment
-        health_prompt = selected_prompts["health"] + article_text
-        results["content_health_assessment"] = call_gemini_api(health_prompt) or "No assessment available."
+    def call_json(prompt, schema):
+        response_text = call_gemini_api(prompt, response_schema=schema)
+        return json.loads(response_text) if response_text else None
 
-        # Generate originality assessment
-        originality_prompt = selected_prompts["originality"] + article_text
-        results["originality_assessment"] = call_gemini_api(originality_prompt) or "No assessment available."
+    def call_single(name):
+        return call_gemini_api(selected_prompts[fields[name][0]] + article_text)
 
+    try:
+        answers = merged_request(tasks, call_json, call_single, context=f"{article_label}\n{article_text}")
+        errors = []
+        for name, (_, default) in fields.items():
+            answer = answers.get(name)
+            if isinstance(answer, Exception):
+                errors.append(str(answer))
+                answer = None
+            results[name] = answer or default
+        if errors:
+            results["error"] = f"An error occurred during article analysis: {'; '.join(errors)}"
     except Exception as e:
         results["error"] = f"An error occurred during article analysis: {str(e)}"
         print(f"Error in analyze_article_content: {e}")
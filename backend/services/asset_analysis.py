@@ -0,0 +1,220 @@
+import asyncio
+import email.utils
+import os
+import re
+import time
+from urllib.parse import urlsplit
+import aiohttp
+from utils.async_runtime import run_coroutine, get_http_session
+from utils.link_checker import normalize_url
+
+ASSET_CONCURRENCY = int(os.environ.get("ASSET_CONCURRENCY", 8))
+ASSET_PER_HOST = int(os.environ.get("ASSET_PER_HOST", 4))
+ASSET_TIMEOUT = int(os.environ.get("ASSET_TIMEOUT", 10))
+ASSET_MAX = int(os.environ.get("ASSET_MAX", 150)) # assets probed per page
+ASSET_TOP_N = 10
+
+# Transfer size above which an asset is reported as heavy, per type
+HEAVY_ASSET_BYTES = {"image": 200 * 1024, "script": 150 * 1024, "stylesheet": 100 * 1024}
+# Text assets larger than this should be served compressed
+COMPRESSIBLE_MIN_BYTES = 1024
+# Static assets should be cacheable for at least a week
+LONG_CACHE_SECONDS = 7 * 24 * 3600
+
+# HEAD statuses that are worth a ranged GET: servers that mishandle or refuse HEAD
+HEAD_FALLBACK_STATUSES = {403, 404, 405, 501}
+
+ISSUE_MESSAGES = {
+    "en": {
+        "heavy": "Optimize {count} heavy {kind} file(s), e.g. {examples}.",
+        "uncompressed": "Serve {count} text asset(s) with gzip or Brotli compression, e.g. {examples}.",
+        "poorly_cached": "Set long cache lifetimes (Cache-Control max-age) on {count} static asset(s), e.g. {examples}.",
+        "failed": "{count} asset(s) failed to load, e.g. {examples}.",
+        "none": "No heavy, uncompressed or uncached assets found."
+    },
+    "ar": {
+        "heavy": "حسّن {count} من ملفات {kind} الثقيلة، مثل {examples}.",
+        "uncompressed": "قدّم {count} من الملفات النصية مضغوطة بـ gzip أو Brotli، مثل {examples}.",
+        "poorly_cached": "اضبط مدة تخزين مؤقت طويلة (Cache-Control max-age) لـ {count} من الملفات الثابتة، مثل {examples}.",
+        "failed": "فشل تحميل {count} من الملفات، مثل {examples}.",
+        "none": "لم يتم العثور على ملفات ثقيلة أو غير مضغوطة أو بدون تخزين مؤقت."
+    }
+}
+KIND_NAMES = {
+    "en": {"image": "image", "script": "JavaScript", "stylesheet": "CSS"},
+    "ar": {"image": "الصور", "script": "JavaScript", "stylesheet": "CSS"}
+}
+
+def collect_assets(features, page_url):
+    """Every <img>, <script src> and <link rel=stylesheet> of the page as [(url, type)], normalized and deduplicated."""
+    assets = {}
+    candidates = [(src, "image") for src, _ in features.images if src] + \
+                 [(src, "script") for src, _ in features.scripts] + \
+                 [(href, "stylesheet") for href, _ in features.stylesheets]
+    for src, kind in candidates:
+        asset_url = normalize_url(src, page_url) # data: URIs and other schemes are skipped
+        if asset_url and asset_url not in assets:
+            assets[asset_url] = kind
+    return list(assets.items())[:ASSET_MAX]
+
+def cache_lifetime(headers):
+    """Seconds the asset may be cached by the browser (0 when not cacheable), from Cache-Control / Expires."""
+    cache_control = (headers.get('Cache-Control') or '').lower()
+    if 'no-store' in cache_control or 'no-cache' in cache_control:
+        return 0
+    match = re.search(r'max-age=(\d+)', cache_control)
+    if match:
+        return int(match.group(1))
+    if 'immutable' in cache_control:
+        return LONG_CACHE_SECONDS
+    expires = headers.get('Expires')
+    if expires:
+        try:
+            return max(0, int(email.utils.parsedate_to_datetime(expires).timestamp() - time.time()))
+        except (TypeError, ValueError):
+            return 0 # Invalid dates such as '0' mean already expired
+    return 0
+
+def _is_text_asset(kind, content_type):
+    return kind in ("script", "stylesheet") or 'svg' in (content_type or '')
+
+def asset_result(url, kind, status=None, headers=None, size=None, error=None):
+    headers = headers or {}
+    content_type = headers.get('Content-Type')
+    content_encoding = headers.get('Content-Encoding')
+    return {
+        "url": url,
+        "type": kind,
+        "status": status,
+        "bytes": size,
+        "content_type": content_type,
+        "content_encoding": content_encoding,
+        "compressed": bool(content_encoding and content_encoding.lower() != 'identity'),
+        "compressible": _is_text_asset(kind, content_type),
+        "cache_control": headers.get('Cache-Control'),
+        "cache_seconds": cache_lifetime(headers),
+        "error": error
+    }
+
+def _size_from_headers(headers):
+    """Full size from Content-Range ('bytes 0-0/12345') or Content-Length, or None."""
+    content_range = headers.get('Content-Range') or ''
+    if '/' in content_range:
+        total = content_range.rsplit('/', 1)[1].strip()
+        if total.isdigit():
+            return int(total)
+    content_length = headers.get('Content-Length')
+    if content_length and content_length.isdigit():
+        return int(content_length)
+    return None
+
+async def probe_asset(session, url, kind):
+    """
+    Transfer size and caching/compression headers of one asset: HEAD first, then
+    a one-byte ranged GET (size from Content-Range) when HEAD fails, is refused,
+    or gives no length. The body is never downloaded.
+    """
+    timeout = aiohttp.ClientTimeout(total=ASSET_TIMEOUT)
+    # Same encodings a browser accepts, so the reported size is what it would transfer
+    headers = {'Accept-Encoding': 'gzip, deflate, br'}
+    head_status = None
+    try:
+        async with session.head(url, headers=headers, allow_redirects=True, timeout=timeout) as response:
+            head_status = response.status
+            size = _size_from_headers(response.headers)
+            if response.status < 400 and size is not None:
+                return asset_result(url, kind, response.status, response.headers, size)
+    except asyncio.TimeoutError:
+        return asset_result(url, kind, error="Timed out")
+    except aiohttp.ClientError:
+        pass # Retry with GET below
+
+    if head_status is not None and head_status >= 400 and head_status not in HEAD_FALLBACK_STATUSES:
+        return asset_result(url, kind, head_status, error=f"HTTP {head_status}")
+    try:
+        async with session.get(url, headers=dict(headers, Range='bytes=0-0'), allow_redirects=True, timeout=timeout) as response:
+            if response.status >= 400:
+                return asset_result(url, kind, response.status, response.headers, error=f"HTTP {response.status}")
+            return asset_result(url, kind, response.status, response.headers, _size_from_headers(response.headers))
+    except asyncio.TimeoutError:
+        return asset_result(url, kind, error="Timed out")
+    except aiohttp.ClientError as e:
+        return asset_result(url, kind, error=str(e) or e.__class__.__name__)
+
+async def probe_assets_async(assets, concurrency=None, per_host=None):
+    """Probes [(url, type)] over the shared connection pool, at most `concurrency` at a time and `per_host` per host."""
+    session = await get_http_session()
+    global_limit = asyncio.Semaphore(concurrency or ASSET_CONCURRENCY)
+    host_limits = {}
+
+    async def run(url, kind):
+        host_limit = host_limits.setdefault(urlsplit(url).netloc, asyncio.Semaphore(per_host or ASSET_PER_HOST))
+        async with host_limit, global_limit:
+            try:
+                return await probe_asset(session, url, kind)
+            except Exception as e:
+                return asset_result(url, kind, error=str(e) or e.__class__.__name__)
+
+    return await asyncio.gather(*(run(url, kind) for url, kind in assets))
+
+def _examples(results):
+    return ", ".join(result["url"] for result in results[:3])
+
+def analyze_assets(url, snapshot, lang="en", concurrency=None):
+    """
+    Resource weight report of a fetched page: total weight, weight per asset type,
+    the heaviest assets, and the assets that are too heavy, uncompressed or not
+    cacheable, with matching improvement tips.
+    """
+    messages = ISSUE_MESSAGES.get(lang, ISSUE_MESSAGES["en"])
+    kind_names = KIND_NAMES.get(lang, KIND_NAMES["en"])
+    report = {
+        "document_bytes": len(snapshot.content) if snapshot.ok else 0,
+        "total_bytes": 0,
+        "asset_count": 0,
+        "unknown_size_count": 0,
+        "by_type": {kind: {"count": 0, "bytes": 0} for kind in HEAVY_ASSET_BYTES},
+        "top_offenders": [],
+        "heavy_assets": [],
+        "uncompressed_assets": [],
+        "poorly_cached_assets": [],
+        "failed_assets": [],
+        "issues": []
+    }
+    if not snapshot.ok:
+        report["issues"].append(f"Could not analyze page assets: {snapshot.error or f'HTTP {snapshot.status_code}'}")
+        return report
+
+    assets = collect_assets(snapshot.features, snapshot.final_url)
+    results = run_coroutine(probe_assets_async(assets, concurrency)) if assets else []
+
+    loaded = [result for result in results if result["error"] is None]
+    sized = sorted((result for result in loaded if result["bytes"] is not None), key=lambda result: -result["bytes"])
+    for result in loaded:
+        by_type = report["by_type"][result["type"]]
+        by_type["count"] += 1
+        by_type["bytes"] += result["bytes"] or 0
+    report["asset_count"] = len(results)
+    report["unknown_size_count"] = len(loaded) - len(sized)
+    report["total_bytes"] = report["document_bytes"] + sum(result["bytes"] for result in sized)
+    report["top_offenders"] = sized[:ASSET_TOP_N]
+    report["heavy_assets"] = [result for result in sized if result["bytes"] > HEAVY_ASSET_BYTES[result["type"]]]
+    report["uncompressed_assets"] = [result for result in sized if result["compressible"] and not result["compressed"]
+                                     and result["bytes"] > COMPRESSIBLE_MIN_BYTES]
+    report["poorly_cached_assets"] = [result for result in loaded if result["cache_seconds"] < LONG_CACHE_SECONDS]
+    report["failed_assets"] = [result for result in results if result["error"] is not None]
+
+    issues = report["issues"]
+    for kind in HEAVY_ASSET_BYTES:
+        heavy = [result for result in report["heavy_assets"] if result["type"] == kind]
+        if heavy:
+            issues.append(messages["heavy"].format(count=len(heavy), kind=kind_names[kind], examples=_examples(heavy)))
+    if report["uncompressed_assets"]:
+        issues.append(messages["uncompressed"].format(count=len(report["uncompressed_assets"]), examples=_examples(report["uncompressed_assets"])))
+    if report["poorly_cached_assets"]:
+        issues.append(messages["poorly_cached"].format(count=len(report["poorly_cached_assets"]), examples=_examples(report["poorly_cached_assets"])))
+    if report["failed_assets"]:
+        issues.append(messages["failed"].format(count=len(report["failed_assets"]), examples=_examples(report["failed_assets"])))
+    if not issues:
+        issues.append(messages["none"])
+    return report
@@ -0,0 +1,172 @@
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
+from utils.url_validator import is_valid_url
+from utils.rate_limiter import priority_lane
+
+BULK_CONCURRENCY = int(os.environ.get("BULK_CONCURRENCY", 8))
+BULK_PER_DOMAIN = int(os.environ.get("BULK_PER_DOMAIN", 2))
+BULK_MAX_URLS = int(os.environ.get("BULK_MAX_URLS", 1000))
+
+def parse_url_list(text):
+    """
+    Reads URLs from plain text (one per line) or CSV. For CSV, a column named
+    'url' is used when present, otherwise the first column. Blank lines, '#'
+    comments and duplicates are skipped; a missing scheme defaults to https://.
+    """
+    rows = list(csv.reader(io.StringIO(text)))
+    column = 0
+    if rows and any(cell.strip().lower() == 'url' for cell in rows[0]):
+        column = [cell.strip().lower() for cell in rows[0]].index('url')
+        rows = rows[1:]
+    urls = []
+    for row in rows:
+        if len(row) <= column:
+            continue
+        url = row[column].strip()
+        if not url or url.startswith('#'):
+            continue
+        if '://' not in url:
+            url = f"https://{url}"
+        urls.append(url)
+    return list(dict.fromkeys(urls))
+
+class BulkStats:
+    """Progress and throughput counters of one bulk run."""
+    def __init__(self, total):
+        self.total = total
+        self.completed = 0
+        self.failed = 0
+        self.started_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, ok):
+        with self._lock:
+            self.completed += 1
+            if not ok:
+                self.failed += 1
+
+    def snapshot(self):
+        elapsed = time.monotonic() - self.started_at
+        with self._lock:
+            completed, failed = self.completed, self.failed
+        return {
+            "total": self.total,
+            "completed": completed,
+            "failed": failed,
+            "elapsed_seconds": round(elapsed, 2),
+            "urls_per_minute": round(completed * 60 / elapsed, 2) if elapsed > 0 else 0.0
+        }
+
+def _analyze_one(analyze, url, lang):
+    started_at = time.monotonic()
+    if not is_valid_url(url):
+        return {"url": url, "status": "failed", "error": "Invalid URL", "elapsed_seconds": 0.0}
+    try:
+        with priority_lane("bulk"): # API quota goes to interactive requests first
+            result = analyze(url, lang)
+        return {"url": url, "status": "done", "result": result, "elapsed_seconds": round(time.monotonic() - started_at, 2)}
+    except Exception as e:
+        print(f"Bulk analysis failed for {url}: {e}")
+        return {"url": url, "status": "failed", "error": str(e), "elapsed_seconds": round(time.monotonic() - started_at, 2)}
+
+def iter_bulk_analysis(urls, lang="en", concurrency=None, per_domain=None, analyze=None):
+    """
+    Analyzes many URLs and yields one record per URL as soon as it finishes,
+    followed by a final {"summary": ...} record with the throughput metrics.
+
+    At most `concurrency` analyses run at a time and at most `per_domain` against
+    the same host; URLs of a busy host wait while other hosts proceed. All runs
+    share this process's connection pools and caches.
+    """
+    if analyze is None:
+        from services.website_analysis import get_website_analysis
+        analyze = get_website_analysis
+    concurrency = concurrency or BULK_CONCURRENCY
+    per_domain = per_domain or BULK_PER_DOMAIN
+
+    urls = list(dict.fromkeys(urls))
+    stats = BulkStats(len(urls))
+    waiting = deque(urls)
+    in_flight = {}      # host -> running analyses
+    running = {}        # future -> host
+
+    def start_next(executor):
+        # Start the first waiting URLs whose host still has a free slot, keeping input order otherwise
+        skipped = deque()
+        while waiting and len(running) < concurrency:
+            url = waiting.popleft()
+            host = urlparse(url).netloc.lower()
+            if in_flight.get(host, 0) >= per_domain:
+                skipped.append(url)
+                continue
+            in_flight[host] = in_flight.get(host, 0) + 1
+            running[executor.submit(_analyze_one, analyze, url, lang)] = host
+        waiting.extendleft(reversed(skipped))
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        start_next(executor)
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                host = running.pop(future)
+                in_flight[host] -= 1
+                record = future.result()
+                stats.record(record["status"] == "done")
+                start_next(executor)
+                yield record
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    yield {"summary": stats.snapshot()}
+
+def write_jsonl(records, output):
+    """Writes each record as one JSON line, flushing so results are visible as they finish."""
+    for record in records:
+        output.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        output.flush()
+        yield record
+
+def main(argv=None):
+    # Usage (from backend/): python -m services.bulk_analysis urls.csv -o results.jsonl
+    parser = argparse.ArgumentParser(description="Analyze a list of websites and write one JSON line per URL.")
+    parser.add_argument("input", help="Text or CSV file with the URLs ('-' for stdin)")
+    parser.add_argument("-o", "--output", default="-", help="JSONL output file ('-' for stdout)")
+    parser.add_argument("--lang", default="en")
+    parser.add_argument("--concurrency", type=int, default=BULK_CONCURRENCY, help="Analyses running at the same time")
+    parser.add_argument("--per-domain", type=int, default=BULK_PER_DOMAIN, help="Analyses running at the same time per host")
+    args = parser.parse_args(argv)
+
+    if args.input == "-":
+        text = sys.stdin.read()
+    else:
+        with open(args.input, encoding="utf-8-sig") as f:
+            text = f.read()
+    urls = parse_url_list(text)
+    print(f"Analyzing {len(urls)} URLs (concurrency {args.concurrency}, {args.per_domain} per host)", file=sys.stderr)
+
+    output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        records = iter_bulk_analysis(urls, args.lang, args.concurrency, args.per_domain)
+        for record in write_jsonl(records, output):
+            if "summary" in record:
+                summary = record["summary"]
+                print(f"Done: {summary['completed']} URLs, {summary['failed']} failed, "
+                      f"{summary['urls_per_minute']} URLs/min in {summary['elapsed_seconds']}s", file=sys.stderr)
+            else:
+                print(f"[{record['status']}] {record['url']} ({record['elapsed_seconds']}s)", file=sys.stderr)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
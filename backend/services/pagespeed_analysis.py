@@ -1,8 +1,71 @@
 import requests
 import os
+import json
+import time
+import datetime
+import threading
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+from utils.cache import create_cache
+from utils.link_checker import normalize_url
+from utils.rate_limiter import get_limiter, priority_lane, current_lane, RateLimitTimeout
+from utils.async_runtime import run_coroutine, get_http_session
 
-def get_pagespeed_insights(url, api_key):
-    pagespeed_results = {
+PAGESPEED_API_URL = "https://www.googleapis.com/pagespeedonline/v5/runPagespeed"
+PAGESPEED_CATEGORIES = ['PERFORMANCE', 'ACCESSIBILITY', 'BEST_PRACTICES', 'SEO']
+CATEGORY_SCORE_KEYS = {
+    'PERFORMANCE': 'Performance Score',
+    'ACCESSIBILITY': 'Accessibility Score',
+    'BEST_PRACTICES': 'Best Practices Score',
+    'SEO': 'SEO Score'
+}
+PAGESPEED_STRATEGIES = ('mobile', 'desktop') # the first one is the report's headline
+PAGESPEED_TIMEOUT = int(os.environ.get("PAGESPEED_TIMEOUT", 120)) # Lighthouse runs are slow
+
+# Partial response: the API only sends the fields parse_lighthouse() reads, instead of
+# the full Lighthouse report (screenshots, treemaps, network details...). Empty disables it.
+PAGESPEED_FIELDS = os.environ.get(
+    "PAGESPEED_FIELDS",
+    "lighthouseResult/categories/*/score,"
+    "lighthouseResult/audits/*/title,"
+    "lighthouseResult/audits/*/description,"
+    "lighthouseResult/audits/*/score,"
+    "lighthouseResult/audits/*/displayValue"
+)
+
+# Keys dropped while decoding, in case the full report comes back anyway. The body is
+# still read whole; pruning only keeps these subtrees out of the decoded and cached result.
+_HEAVY_KEYS = frozenset([
+    'details', 'fullPageScreenshot', 'i18n', 'timing', 'stackPacks', 'entities',
+    'configSettings', 'environment', 'categoryGroups', 'auditRefs', 'runWarnings',
+    'loadingExperience', 'originLoadingExperience',
+    'screenshot-thumbnails', 'final-screenshot', 'full-page-screenshot', 'script-treemap-data'
+])
+
+# Lighthouse audits holding the Core Web Vitals (lab values). FID is not measured
+# in the lab; Max Potential FID is Lighthouse's estimate of it.
+CORE_WEB_VITAL_AUDITS = {
+    'largest-contentful-paint': 'Largest Contentful Paint (LCP)',
+    'cumulative-layout-shift': 'Cumulative Layout Shift (CLS)',
+    'max-potential-fid': 'First Input Delay (FID)'
+}
+
+# A result younger than PAGESPEED_FRESH_SECONDS is served as is; an older one is served
+# right away while a background refresh runs. Results are kept PAGESPEED_KEEP_SECONDS,
+# and the last good one is the fallback when the API quota is exceeded.
+PAGESPEED_FRESH_SECONDS = int(os.environ.get("PAGESPEED_FRESH_SECONDS", 6 * 3600))
+PAGESPEED_KEEP_SECONDS = int(os.environ.get("PAGESPEED_KEEP_SECONDS", 30 * 24 * 3600))
+PAGESPEED_REFRESH_WORKERS = int(os.environ.get("PAGESPEED_REFRESH_WORKERS", 2))
+
+pagespeed_cache = create_cache("PAGESPEED_CACHE", default_ttl=PAGESPEED_KEEP_SECONDS, max_bytes=32 * 1024 * 1024, backend="sqlite")
+
+_refresh_executor = ThreadPoolExecutor(max_workers=PAGESPEED_REFRESH_WORKERS, thread_name_prefix="pagespeed-refresh")
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+def _empty_results(url):
+    return {
         "scores": {
             "Performance Score": "N/A",
             "Accessibility Score": "N/A",
@@ -18,78 +81,248 @@ def get_pagespeed_insights(url, api_key):
         "pagespeed_report_link": f"https://developers.google.com/speed/pagespeed/insights/?url={url}"
     }
 
+def pagespeed_cache_key(url, strategy, categories):
+    """Cache key of a Lighthouse run: normalized URL, strategy and category set."""
+    return {
+        "url": normalize_url(url, url) or url,
+        "strategy": strategy,
+        "categories": sorted(set(categories))
+    }
+
+def _with_cache_info(entry, status):
+    results = dict(entry["results"])
+    results["cache"] = {
+        "status": status,
+        "fetched_at": datetime.datetime.fromtimestamp(entry["fetched_at"], datetime.timezone.utc).isoformat(),
+        "age_seconds": int(time.time() - entry["fetched_at"])
+    }
+    return results
+
+def _store(key, results):
+    pagespeed_cache.set("pagespeed", key, {"fetched_at": time.time(), "results": results})
+
+def _refresh(url, api_key, strategy, categories, key):
+    try:
+        with priority_lane("bulk"): # a refresh must not take quota from interactive requests
+            results, status = _run_pagespeed(url, api_key, strategy, categories)
+        if status == "ok":
+            _store(key, results)
+    except Exception as e:
+        print(f"Background PageSpeed refresh failed for {url}: {e}")
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(repr(key))
+
+def _refresh_in_background(url, api_key, strategy, categories, key):
+    """Schedules one refresh per key at a time."""
+    with _refreshing_lock:
+        if repr(key) in _refreshing:
+            return
+        _refreshing.add(repr(key))
+    _refresh_executor.submit(_refresh, url, api_key, strategy, categories, key)
+
+def get_pagespeed_insights(url, api_key, strategy='desktop', categories=None, use_cache=True):
+    """
+    Lighthouse scores, Core Web Vitals and issues of a URL from the PageSpeed Insights API.
+    Results are cached per (normalized URL, strategy, categories): fresh results are
+    returned directly, stale ones immediately while a background refresh runs, and
+    when the quota is exceeded the last good result is returned instead of N/A.
+    The 'cache' key of the result tells which one it is. use_cache=False forces a new run.
+    """
+    categories = list(categories or PAGESPEED_CATEGORIES)
+
+    if not api_key:
+        print("PAGESPEED_API_KEY environment variable not set. PageSpeed Insights will be N/A.")
+        return _empty_results(url)
+
+    key, entry, cached = _lookup(url, api_key, strategy, categories, use_cache)
+    if cached is not None:
+        return cached
+    results, status = _run_pagespeed(url, api_key, strategy, categories)
+    return _settle(key, entry, results, status)
+
+def get_pagespeed_report(url, api_key, strategies=PAGESPEED_STRATEGIES, categories=None, use_cache=True):
+    """
+    Runs PageSpeed Insights for several strategies (mobile and desktop by default)
+    concurrently and merges them: 'strategies' holds each strategy's scores, Core
+    Web Vitals and issues; the top-level scores and vitals are the first strategy's,
+    and 'issues' lists the issues of all strategies once.
+    Same caching as get_pagespeed_insights(), per strategy.
+    """
+    categories = list(categories or PAGESPEED_CATEGORIES)
+    strategies = list(dict.fromkeys(strategies))
+
     if not api_key:
         print("PAGESPEED_API_KEY environment variable not set. PageSpeed Insights will be N/A.")
-        return pagespeed_results
-
-    pagespeed_url = "https://www.googleapis.com/pagespeedonline/v5/runPagespeed"
-    params = {
-        'url': url,
-        'key': api_key,
-        'strategy': 'desktop', # يمكن تغييرها إلى 'mobile' أو تركها ديناميكية
-        'category': ['PERFORMANCE', 'ACCESSIBILITY', 'BEST_PRACTICES', 'SEO']
+        per_strategy = {strategy: _empty_results(url) for strategy in strategies}
+        return merge_strategy_reports(url, per_strategy)
+
+    per_strategy = {}
+    pending = {}
+    for strategy in strategies:
+        key, entry, cached = _lookup(url, api_key, strategy, categories, use_cache)
+        if cached is not None:
+            per_strategy[strategy] = cached
+        else:
+            pending[strategy] = (key, entry)
+
+    if pending:
+        # Concurrent runs: the wall time stays close to the slowest single run
+        # The runs execute on the async runtime's loop, so the caller's lane is passed along
+        runs = run_coroutine(_run_strategies_async(url, api_key, list(pending), categories, current_lane()))
+        for (strategy, (key, entry)), (results, status) in zip(pending.items(), runs):
+            per_strategy[strategy] = _settle(key, entry, results, status)
+
+    return merge_strategy_reports(url, {strategy: per_strategy[strategy] for strategy in strategies})
+
+def merge_strategy_reports(url, per_strategy):
+    """Merges per-strategy results into one report (see get_pagespeed_report)."""
+    primary = next(iter(per_strategy.values()), None) or _empty_results(url)
+    issues = list(dict.fromkeys(issue for results in per_strategy.values() for issue in results.get("issues", [])))
+    return {
+        "primary_strategy": next(iter(per_strategy), None),
+        "scores": primary["scores"],
+        "core_web_vitals": primary["core_web_vitals"],
+        "issues": issues,
+        "strategies": per_strategy,
+        "pagespeed_report_link": f"https://developers.google.com/speed/pagespeed/insights/?url={url}"
     }
 
+def _lookup(url, api_key, strategy, categories, use_cache):
+    """Returns (cache key, cached entry, results to serve or None when a run is needed)."""
+    key = pagespeed_cache_key(url, strategy, categories)
+    entry = pagespeed_cache.get("pagespeed", key)
+    if use_cache and entry is not None:
+        if time.time() - entry["fetched_at"] < PAGESPEED_FRESH_SECONDS:
+            return key, entry, _with_cache_info(entry, "fresh")
+        _refresh_in_background(url, api_key, strategy, categories, key)
+        return key, entry, _with_cache_info(entry, "stale")
+    return key, entry, None
+
+def _settle(key, entry, results, status):
+    """Caches a good run; falls back to the last good result when the quota is exceeded."""
+    if status == "ok":
+        _store(key, results)
+    elif status == "quota" and entry is not None:
+        results = _with_cache_info(entry, "last_good")
+        results["issues"] = results["issues"] + ["PageSpeed Insights API quota exceeded; showing the last successful result."]
+    return results
+
+def _request_params(url, api_key, strategy, categories):
+    params = [('url', url), ('key', api_key), ('strategy', strategy)] + [('category', category) for category in categories]
+    if PAGESPEED_FIELDS:
+        params.append(('fields', PAGESPEED_FIELDS))
+    return params
+
+def _lean_object(pairs):
+    return {key: value for key, value in pairs if key not in _HEAVY_KEYS}
+
+def decode_lighthouse(body):
+    """
+    Decodes a PageSpeed API response body (bytes), pruning the heavy parts of the
+    report. This makes the retained and cached object smaller, not the download:
+    the whole body is in memory while it is decoded.
+    """
+    return json.loads(body, object_pairs_hook=_lean_object)
+
+def parse_lighthouse(data, pagespeed_results, categories):
+    """Fills scores, Core Web Vitals and issues from a PageSpeed API response."""
+    lighthouse = data.get('lighthouseResult', {})
+    audits = lighthouse.get('audits', {})
+    lighthouse_categories = lighthouse.get('categories', {})
+
+    # تحديث النقاط
+    # Lighthouse names categories in lower case with hyphens ('best-practices')
+    for category in categories:
+        score_key = CATEGORY_SCORE_KEYS.get(category, f"{category.replace('_', ' ').title()} Score")
+        score = lighthouse_categories.get(category.lower().replace('_', '-'), {}).get('score')
+        if score is not None:
+            pagespeed_results['scores'][score_key] = int(round(score * 100))
+
+    # Core Web Vitals
+    for audit_id, vital in CORE_WEB_VITAL_AUDITS.items():
+        display_value = audits.get(audit_id, {}).get('displayValue')
+        if display_value:
+            pagespeed_results['core_web_vitals'][vital] = display_value
+
+    # Performance Issues (مثال: استخدام 'diagnostics' أو 'details' من التدقيقات)
+    # للحصول على قائمة بالمشاكل، ننظر إلى التدقيقات التي لديها 'score' أقل من 1
+    # ونستخرج منها معلومات ذات صلة.
+    issues = []
+    seen = set() # تجنب التكرار
+    for audit_key, audit_value in audits.items():
+        if audit_value.get('score') is not None and audit_value.get('score') < 1:
+            # محاولة استخراج عنوان المشكلة أو وصفها
+            title = audit_value.get('title')
+            description = audit_value.get('description')
+            if title and "Learn more" in title: # إزالة "Learn more"
+                title = title.split("Learn more")[0].strip()
+
+            issue = title if title and title not in seen else description
+            if issue and issue not in seen:
+                seen.add(issue)
+                issues.append(issue)
+    pagespeed_results['issues'] = issues
+
+    # إذا لم يتم العثور على مشاكل محددة
+    if not pagespeed_results['issues']:
+        pagespeed_results['issues'].append("No critical performance issues detected by PageSpeed Insights.")
+    return pagespeed_results
+
+def _quota_exceeded(pagespeed_results, limiter):
+    print("PageSpeed Insights API quota exceeded. Please wait or check your Google Cloud Console.")
+    limiter.pause(60) # Hold the other callers of this key for a quota window
+    pagespeed_results['issues'].append("PageSpeed Insights API quota exceeded. Scores and issues are N/A.")
+    return pagespeed_results, "quota"
+
+def _run_pagespeed(url, api_key, strategy, categories):
+    """One PageSpeed Insights API call. Returns (results, status), status being 'ok', 'quota' or 'error'."""
+    pagespeed_results = _empty_results(url)
+    limiter = get_limiter("pagespeed", api_key)
     try:
-        # زيادة المهلة لطلب HTTPX لـ PageSpeed API
-        response = requests.get(pagespeed_url, params=params, timeout=120) # زيادة المهلة إلى 120 ثانية
-        response.raise_for_status() # رفع استثناء لأخطاء HTTP (4xx أو 5xx)
-        data = response.json()
-
-        lighthouse = data.get('lighthouseResult', {})
-        audits = lighthouse.get('audits', {})
-        categories = lighthouse.get('categories', {})
-
-        # تحديث النقاط
-        for category in params['category']:
-            score_key = f"{category.replace('_', ' ').title()} Score"
-            score = categories.get(category, {}).get('score')
-            if score is not None:
-                pagespeed_results['scores'][score_key] = int(score * 100)
-
-        # Core Web Vitals
-        metrics = lighthouse.get('audits', {}).get('metrics', {}).get('details', {}).get('items', [])
-        for metric in metrics:
-            if metric.get('id') == 'largest-contentful-paint':
-                pagespeed_results['core_web_vitals']['Largest Contentful Paint (LCP)'] = metric.get('displayValue', 'N/A')
-            elif metric.get('id') == 'cumulative-layout-shift':
-                pagespeed_results['core_web_vitals']['Cumulative Layout Shift (CLS)'] = metric.get('displayValue', 'N/A')
-            elif metric.get('id') == 'first-input-delay':
-                pagespeed_results['core_web_vitals']['First Input Delay (FID)'] = metric.get('displayValue', 'N/A')
-
-        # Performance Issues (مثال: استخدام 'diagnostics' أو 'details' من التدقيقات)
-        # هذا الجزء قد يحتاج لتعديل بناءً على بنية استجابة PageSpeed الفعلية
-        # للحصول على قائمة بالمشاكل، عادة ما ننظر إلى التدقيقات التي لديها 'score' أقل من 1
-        # ونستخرج منها معلومات ذات صلة.
-        pagespeed_results['issues'] = []
-        for audit_key, audit_value in audits.items():
-            if audit_value.get('score') is not None and audit_value.get('score') < 1:
-                # محاولة استخراج عنوان المشكلة أو وصفها
-                title = audit_value.get('title')
-                description = audit_value.get('description')
-                if title and "Learn more" in title: # إزالة "Learn more"
-                    title = title.split("Learn more")[0].strip()
-                
-                if title and title not in pagespeed_results['issues']: # تجنب التكرار
-                    pagespeed_results['issues'].append(title)
-                elif description and description not in pagespeed_results['issues']:
-                    pagespeed_results['issues'].append(description)
-        
-        # إذا لم يتم العثور على مشاكل محددة
-        if not pagespeed_results['issues']:
-            pagespeed_results['issues'].append("No critical performance issues detected by PageSpeed Insights.")
-
-        return pagespeed_results
+        limiter.acquire() # Waits for a quota slot instead of running into 429s
+    except RateLimitTimeout as e:
+        print(f"PageSpeed Insights quota queue is full: {e}")
+        pagespeed_results['issues'].append("PageSpeed Insights API quota exceeded. Scores and issues are N/A.")
+        return pagespeed_results, "quota"
 
+    try:
+        response = requests.get(PAGESPEED_API_URL, params=_request_params(url, api_key, strategy, categories), timeout=PAGESPEED_TIMEOUT)
+        response.raise_for_status() # رفع استثناء لأخطاء HTTP (4xx أو 5xx)
+        return parse_lighthouse(decode_lighthouse(response.content), pagespeed_results, categories), "ok"
     except requests.exceptions.RequestException as e:
-        print(f"Error fetching PageSpeed Insights: {e}")
-        # إذا كان الخطأ 429، نطبع رسالة خاصة
+        print(f"Error fetching PageSpeed Insights ({strategy}): {e}")
         if isinstance(e, requests.exceptions.HTTPError) and e.response.status_code == 429:
-            print("PageSpeed Insights API quota exceeded. Please wait or check your Google Cloud Console.")
-            pagespeed_results['issues'].append("PageSpeed Insights API quota exceeded. Scores and issues are N/A.")
-        else:
-            pagespeed_results['issues'].append(f"Failed to fetch PageSpeed Insights: {e}. Scores and issues are N/A.")
-        
-        # نرجع النتائج مع القيم الافتراضية "N/A"
-        return pagespeed_results
+            return _quota_exceeded(pagespeed_results, limiter)
+        pagespeed_results['issues'].append(f"Failed to fetch PageSpeed Insights: {e}. Scores and issues are N/A.")
+        return pagespeed_results, "error"
+
+async def _run_strategies_async(url, api_key, strategies, categories, lane=None):
+    return await asyncio.gather(*(
+        _run_pagespeed_async(url, api_key, strategy, categories, lane) for strategy in strategies
+    ))
 
+async def _run_pagespeed_async(url, api_key, strategy, categories, lane=None):
+    """Async version of _run_pagespeed() over the pooled aiohttp session (runs on the async runtime)."""
+    pagespeed_results = _empty_results(url)
+    limiter = get_limiter("pagespeed", api_key)
+    try:
+        await limiter.acquire_async(lane=lane)
+    except RateLimitTimeout as e:
+        print(f"PageSpeed Insights quota queue is full: {e}")
+        pagespeed_results['issues'].append("PageSpeed Insights API quota exceeded. Scores and issues are N/A.")
+        return pagespeed_results, "quota"
+
+    try:
+        session = await get_http_session()
+        async with session.get(PAGESPEED_API_URL, params=_request_params(url, api_key, strategy, categories),
+                               timeout=aiohttp.ClientTimeout(total=PAGESPEED_TIMEOUT)) as response:
+            if response.status == 429:
+                return _quota_exceeded(pagespeed_results, limiter)
+            response.raise_for_status()
+            data = decode_lighthouse(await response.read())
+        return parse_lighthouse(data, pagespeed_results, categories), "ok"
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        print(f"Error fetching PageSpeed Insights ({strategy}): {e}")
+        pagespeed_results['issues'].append(f"Failed to fetch PageSpeed Insights: {e}. Scores and issues are N/A.")
+        return pagespeed_results, "error"
@@ -0,0 +1,304 @@
+import http.client
+import os
+import socket
+import ssl
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from urllib.parse import urljoin, urlsplit
+from utils.html_parser import extract_page_features
+
+PROBE_TIMEOUT = float(os.environ.get("PROBE_TIMEOUT", 15))          # per connection step and per read
+PROBE_MAX_ASSETS = int(os.environ.get("PROBE_MAX_ASSETS", 20))      # critical assets timed per page
+PROBE_CONCURRENCY = int(os.environ.get("PROBE_CONCURRENCY", 6))     # browsers open ~6 connections per host
+PROBE_MAX_REDIRECTS = 5
+PROBE_MAX_BODY_BYTES = int(os.environ.get("PROBE_MAX_BODY_BYTES", 10 * 1024 * 1024))
+PROBE_VERIFY_TLS = os.environ.get("PROBE_VERIFY_TLS", "1") != "0"
+PROBE_RESOLVER_WORKERS = int(os.environ.get("PROBE_RESOLVER_WORKERS", 8))
+PROBE_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+# Scoring: each metric scores 1 at or below `good`, 0 at or above `poor`, linearly in
+# between; the weighted sum is the 0-100 performance score. Thresholds follow the
+# web.dev guidance for TTFB/FCP and Lighthouse's page weight audit.
+SCORE_METRICS = {
+    "ttfb_ms": {"good": 800, "poor": 1800, "weight": 0.30},
+    "first_paint_ms": {"good": 1800, "poor": 3000, "weight": 0.35},
+    "total_bytes": {"good": 1600 * 1024, "poor": 4000 * 1024, "weight": 0.20},
+    "render_blocking_count": {"good": 0, "poor": 6, "weight": 0.15},
+}
+
+ISSUE_MESSAGES = {
+    "en": {
+        "unreachable": "The page could not be loaded: {error}",
+        "slow_ttfb": "Reduce server response time (TTFB is {ttfb} ms; aim for under 800 ms).",
+        "render_blocking": "Eliminate {count} render-blocking resources, e.g. {examples}.",
+        "heavy_page": "Reduce total page weight ({size} KB transferred by the page and its critical assets).",
+        "uncompressed": "Enable gzip or Brotli compression for the HTML document.",
+        "redirects": "Avoid redirects: the page went through {count} redirect(s) ({ms} ms).",
+        "failed_assets": "{count} critical asset(s) failed to load, e.g. {examples}.",
+        "none": "No critical performance issues detected."
+    },
+    "ar": {
+        "unreachable": "تعذر تحميل الصفحة: {error}",
+        "slow_ttfb": "قلل زمن استجابة الخادم (زمن أول بايت {ttfb} مللي ثانية؛ الهدف أقل من 800).",
+        "render_blocking": "أزل {count} من الموارد التي تعيق العرض، مثل {examples}.",
+        "heavy_page": "قلل الحجم الكلي للصفحة ({size} كيلوبايت للصفحة ومواردها الأساسية).",
+        "uncompressed": "فعّل ضغط gzip أو Brotli لمستند HTML.",
+        "redirects": "تجنب عمليات إعادة التوجيه: مرت الصفحة بـ {count} إعادة توجيه ({ms} مللي ثانية).",
+        "failed_assets": "فشل تحميل {count} من الموارد الأساسية، مثل {examples}.",
+        "none": "لم يتم اكتشاف مشكلات أداء حرجة."
+    }
+}
+
+# getaddrinfo has no timeout of its own, so lookups run here and the caller stops waiting after the timeout
+_resolver = ThreadPoolExecutor(max_workers=PROBE_RESOLVER_WORKERS, thread_name_prefix="probe-dns")
+
+def _ms(seconds):
+    return round(seconds * 1000, 1)
+
+def resolve(host, port, timeout):
+    """First address of host:port, raising socket.timeout when the lookup takes longer than timeout."""
+    future = _resolver.submit(socket.getaddrinfo, host, port, type=socket.SOCK_STREAM)
+    try:
+        info = future.result(timeout)
+    except FutureTimeout:
+        future.cancel()
+        raise socket.timeout(f"DNS lookup of {host} timed out after {timeout} s")
+    return info[0][4][:2]
+
+def _decode_body(body, encoding, max_length=None):
+    """
+    Decompresses a gzip/deflate body into at most max_length bytes (default
+    PROBE_MAX_BODY_BYTES). A truncated or partly corrupt body decodes to the
+    prefix that could be read, so a long page still gets analyzed.
+    """
+    max_length = max_length or PROBE_MAX_BODY_BYTES
+    encoding = (encoding or '').lower()
+    if encoding == 'gzip':
+        wbits_options = (16 + zlib.MAX_WBITS,)
+    elif encoding == 'deflate':
+        wbits_options = (zlib.MAX_WBITS, -zlib.MAX_WBITS) # zlib-wrapped, then raw deflate
+    else:
+        return body[:max_length]
+    for wbits in wbits_options:
+        decompressor = zlib.decompressobj(wbits)
+        output = bytearray()
+        try:
+            for i in range(0, len(body), 65536):
+                output += decompressor.decompress(body[i:i + 65536], max_length - len(output))
+                if len(output) >= max_length:
+                    break
+        except zlib.error:
+            if not output:
+                continue
+        return bytes(output)
+    return b""
+
+def time_request(url, timeout=None, dns_cache=None, keep_body=False):
+    """
+    Fetches one URL over a fresh connection and times each phase, in ms:
+    dns, connect, tls, ttfb (request sent -> status line and headers) and download.
+    `bytes` is the size on the wire (compressed); reads stop at PROBE_MAX_BODY_BYTES,
+    in which case `truncated` is set and Content-Length is used when the server
+    sent it. dns_cache ({(host, port): address})
+    lets later requests to the same host skip the lookup, as a browser would.
+    """
+    timeout = timeout or PROBE_TIMEOUT
+    parts = urlsplit(url)
+    secure = parts.scheme == 'https'
+    host = parts.hostname
+    port = parts.port or (443 if secure else 80)
+    path = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+    timing = {"url": url, "status": None, "dns_ms": 0.0, "connect_ms": 0.0, "tls_ms": 0.0,
+              "ttfb_ms": 0.0, "download_ms": 0.0, "total_ms": 0.0, "bytes": 0, "truncated": False,
+              "content_type": None, "content_encoding": None, "location": None, "error": None}
+    started_at = time.perf_counter()
+    sock = None
+    try:
+        step = time.perf_counter()
+        address = dns_cache.get((host, port)) if dns_cache is not None else None
+        if address is None:
+            address = resolve(host, port, timeout)
+            if dns_cache is not None:
+                dns_cache[(host, port)] = address
+            timing["dns_ms"] = _ms(time.perf_counter() - step)
+
+        step = time.perf_counter()
+        sock = socket.create_connection(address, timeout=timeout)
+        timing["connect_ms"] = _ms(time.perf_counter() - step)
+
+        if secure:
+            step = time.perf_counter()
+            context = ssl.create_default_context()
+            if not PROBE_VERIFY_TLS:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            sock = context.wrap_socket(sock, server_hostname=host)
+            timing["tls_ms"] = _ms(time.perf_counter() - step)
+
+        # http.client on the already connected socket, so connect/TLS are not repeated
+        connection = http.client.HTTPConnection(host, port, timeout=timeout)
+        connection.sock = sock
+        step = time.perf_counter()
+        connection.request('GET', path, headers={
+            'Host': parts.netloc.split('@')[-1],
+            'User-Agent': PROBE_USER_AGENT,
+            'Accept': '*/*',
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'close'
+        })
+        response = connection.getresponse()
+        timing["ttfb_ms"] = _ms(time.perf_counter() - step)
+        timing["status"] = response.status
+        timing["content_type"] = response.getheader('Content-Type')
+        timing["content_encoding"] = response.getheader('Content-Encoding')
+        timing["location"] = response.getheader('Location')
+
+        step = time.perf_counter()
+        chunks = []
+        size = 0
+        while size < PROBE_MAX_BODY_BYTES:
+            chunk = response.read(65536)
+            if not chunk:
+                break
+            size += len(chunk)
+            if keep_body:
+                chunks.append(chunk)
+        timing["download_ms"] = _ms(time.perf_counter() - step)
+        timing["bytes"] = size
+        if size >= PROBE_MAX_BODY_BYTES and response.read(1):
+            timing["truncated"] = True
+            content_length = response.getheader('Content-Length') or ''
+            if content_length.isdigit():
+                timing["bytes"] = max(size, int(content_length))
+        if keep_body:
+            timing["body"] = _decode_body(b''.join(chunks), timing["content_encoding"])
+    except (OSError, http.client.HTTPException) as e:
+        timing["error"] = str(e) or e.__class__.__name__
+    finally:
+        if sock is not None:
+            sock.close()
+        timing["total_ms"] = _ms(time.perf_counter() - started_at)
+    return timing
+
+def critical_assets(features, page_url):
+    """Render-blocking stylesheets and scripts of the page, resolved to absolute URLs."""
+    assets = []
+    for kind, items in (("stylesheet", features.stylesheets), ("script", features.scripts)):
+        for src, blocking in items:
+            asset_url = urljoin(page_url, src.strip())
+            if blocking and urlsplit(asset_url).scheme in ('http', 'https'):
+                assets.append({"url": asset_url, "type": kind})
+    return list({asset["url"]: asset for asset in assets}.values())[:PROBE_MAX_ASSETS]
+
+def _metric_score(value, good, poor):
+    if value <= good:
+        return 1.0
+    if value >= poor:
+        return 0.0
+    return (poor - value) / (poor - good)
+
+def performance_score(metrics):
+    """Deterministic 0-100 score from the probe metrics (see SCORE_METRICS)."""
+    total = sum(config["weight"] * _metric_score(metrics[name], config["good"], config["poor"])
+                for name, config in SCORE_METRICS.items())
+    return int(round(100 * total))
+
+def _rating(value, good, poor):
+    if value <= good:
+        return "Good"
+    return "Needs Improvement" if value < poor else "Poor"
+
+def probe_page(url, timeout=None):
+    """
+    Loads the page and its render-blocking assets the way a first visit would and
+    returns the raw measurements: the document's timings, the redirect chain, each
+    asset's timings, and the derived metrics.
+    """
+    dns_cache = {}
+    redirects = []
+    document = time_request(url, timeout, dns_cache, keep_body=True)
+    while document["status"] in (301, 302, 303, 307, 308) and document["location"] and len(redirects) < PROBE_MAX_REDIRECTS:
+        document.pop("body", None)
+        redirects.append(document)
+        document = time_request(urljoin(document["url"], document["location"]), timeout, dns_cache, keep_body=True)
+    if document["status"] in (301, 302, 303, 307, 308) and document["location"] and document["error"] is None:
+        # Still redirecting at the limit: there is no final page to measure
+        document["error"] = f"Too many redirects (more than {PROBE_MAX_REDIRECTS})"
+
+    body = document.pop("body", b"")
+    assets = []
+    if document["error"] is None and document["status"] == 200:
+        features = extract_page_features(body.decode('utf-8', errors='replace'))
+        targets = critical_assets(features, document["url"])
+        if targets:
+            with ThreadPoolExecutor(max_workers=min(PROBE_CONCURRENCY, len(targets))) as executor:
+                timings = list(executor.map(lambda asset: time_request(asset["url"], timeout, dns_cache), targets))
+            for asset, timing in zip(targets, timings):
+                timing["type"] = asset["type"]
+                assets.append(timing)
+
+    redirect_ms = sum(hop["total_ms"] for hop in redirects)
+    # Blocking assets load in parallel once the HTML arrived; the slowest one gates the first paint
+    render_blocking_ms = max((asset["total_ms"] for asset in assets), default=0.0)
+    document_ms = document["total_ms"]
+    metrics = {
+        "ttfb_ms": round(redirect_ms + document["dns_ms"] + document["connect_ms"] + document["tls_ms"] + document["ttfb_ms"], 1),
+        "document_ms": round(redirect_ms + document_ms, 1),
+        "first_paint_ms": round(redirect_ms + document_ms + render_blocking_ms, 1),
+        "total_bytes": document["bytes"] + sum(hop["bytes"] for hop in redirects) + sum(asset["bytes"] for asset in assets),
+        "request_count": 1 + len(redirects) + len(assets),
+        "render_blocking_count": len(assets),
+        "redirect_count": len(redirects),
+        "redirect_ms": round(redirect_ms, 1)
+    }
+    return {"document": document, "redirects": redirects, "assets": assets, "metrics": metrics}
+
+def get_performance_report(url, lang="en", timeout=None):
+    """
+    Measured replacement for a PageSpeed-style report: performance score, timing
+    metrics with ratings, and issues, in the page_speed section format. The same
+    measurements always give the same score.
+    """
+    messages = ISSUE_MESSAGES.get(lang, ISSUE_MESSAGES["en"])
+    report = {
+        "scores": {"Performance Score": "N/A"},
+        "core_web_vitals": {},
+        "issues": [],
+        "pagespeed_report_link": f"https://developers.google.com/speed/pagespeed/insights/?url={url}"
+    }
+
+    probe = probe_page(url, timeout)
+    document, metrics = probe["document"], probe["metrics"]
+    report["probe"] = probe
+    if document["error"] is not None or document["status"] is None or document["status"] >= 400:
+        report["issues"].append(messages["unreachable"].format(error=document["error"] or f"HTTP {document['status']}"))
+        return report
+
+    report["scores"]["Performance Score"] = performance_score(metrics)
+    ttfb, first_paint = SCORE_METRICS["ttfb_ms"], SCORE_METRICS["first_paint_ms"]
+    report["core_web_vitals"] = {
+        "Time to First Byte (TTFB)": f"{int(metrics['ttfb_ms'])} ms ({_rating(metrics['ttfb_ms'], ttfb['good'], ttfb['poor'])})",
+        "First Paint (estimated)": f"{int(metrics['first_paint_ms'])} ms ({_rating(metrics['first_paint_ms'], first_paint['good'], first_paint['poor'])})",
+        "Page Weight": f"{metrics['total_bytes'] // 1024} KB",
+        "Requests": str(metrics["request_count"])
+    }
+
+    issues = report["issues"]
+    if metrics["ttfb_ms"] > ttfb["good"]:
+        issues.append(messages["slow_ttfb"].format(ttfb=int(metrics["ttfb_ms"])))
+    if probe["assets"]:
+        examples = ", ".join(asset["url"] for asset in sorted(probe["assets"], key=lambda a: -a["total_ms"])[:3])
+        issues.append(messages["render_blocking"].format(count=len(probe["assets"]), examples=examples))
+    if metrics["total_bytes"] > SCORE_METRICS["total_bytes"]["good"]:
+        issues.append(messages["heavy_page"].format(size=metrics["total_bytes"] // 1024))
+    if not document["content_encoding"] and document["bytes"] > 1024:
+        issues.append(messages["uncompressed"])
+    if metrics["redirect_count"]:
+        issues.append(messages["redirects"].format(count=metrics["redirect_count"], ms=int(metrics["redirect_ms"])))
+    failed = [asset["url"] for asset in probe["assets"] if asset["error"] or (asset["status"] or 0) >= 400]
+    if failed:
+        issues.append(messages["failed_assets"].format(count=len(failed), examples=", ".join(failed[:3])))
+    if not issues:
+        issues.append(messages["none"])
+    return report
@@ -1,12 +1,15 @@
 import requests
-from bs4 import BeautifulSoup
 from collections import Counter
 import re
 from urllib.parse import urljoin, urlparse
+from utils.page_fetcher import fetch_page
+from utils.html_parser import HEADING_TAGS
+from utils.link_checker import normalize_url, check_links, is_broken
 
-def perform_seo_analysis(url):
+def perform_seo_analysis(url, snapshot=None):
     """
     Performs a comprehensive SEO analysis of the given URL.
+    An already fetched PageSnapshot can be passed in to avoid downloading the page again.
     """
     results = {
         "score": 0, # Overall SEO score
@@ -26,17 +29,14 @@ def perform_seo_analysis(url):
     }
 
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-        soup = BeautifulSoup(response.text, 'html.parser')
+        if snapshot is None:
+            snapshot = fetch_page(url, conditional=True)
+        snapshot.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+        features = snapshot.features
 
         # 1. Title Tag
-        title_tag = soup.find('title')
-        if title_tag:
-            results["elements"]["title"] = title_tag.get_text(strip=True)
+        if features.title is not None:
+            results["elements"]["title"] = features.title
             if 10 <= len(results["elements"]["title"]) <= 70:
                 results["score"] += 15
             else:
@@ -45,9 +45,9 @@ def perform_seo_analysis(url):
             results["improvement_tips"].append("Add a title tag to your page.")
 
         # 2. Meta Description
-        meta_description = soup.find('meta', attrs={'name': 'description'})
-        if meta_description and meta_description.get('content'):
-            results["elements"]["meta_description"] = meta_description['content'].strip()
+        meta_description = features.meta.get('description')
+        if meta_description:
+            results["elements"]["meta_description"] = meta_description.strip()
             if 120 <= len(results["elements"]["meta_description"]) <= 160:
                 results["score"] += 15
             else:
@@ -56,11 +56,7 @@ def perform_seo_analysis(url):
             results["improvement_tips"].append("Add a meta description to your page.")
 
         # 3. H Tags (H1-H6)
-        h_tags = {}
-        for i in range(1, 7):
-            tags = soup.find_all(f'h{i}')
-            if tags:
-                h_tags[f'h{i}'] = [tag.get_text(strip=True) for tag in tags]
+        h_tags = {tag: features.headings[tag] for tag in HEADING_TAGS if tag in features.headings}
         results["elements"]["h_tags"] = h_tags
         if 'h1' in h_tags and len(h_tags['h1']) == 1:
             results["score"] += 10
@@ -73,7 +69,7 @@ def perform_seo_analysis(url):
              results["score"] += 5 # Give some score for using hierarchy
 
         # 4. Keyword Density
-        page_text = soup.get_text(separator=' ', strip=True)
+        page_text = features.text
         results["elements"]["page_text"] = page_text # Store page text for other analyses
         words = re.findall(r'\b\w+\b', page_text.lower())
         word_counts = Counter(words)
@@ -94,8 +90,10 @@ def perform_seo_analysis(url):
         
         base_domain = urlparse(url).netloc
 
-        for a_tag in soup.find_all('a', href=True):
-            href = a_tag['href'].strip()
+        links_to_check = []
+
+        for href in features.links:
+            href = href.strip()
             full_url = urljoin(url, href)
             parsed_full_url = urlparse(full_url)
 
@@ -103,21 +101,29 @@ def perform_seo_analysis(url):
                 internal_links.add(full_url)
             elif parsed_full_url.netloc: # It's an external link
                 external_links.add(full_url)
-            
-            # Check for broken links (only for HTTP/HTTPS schemes)
-            if parsed_full_url.scheme in ['http', 'https']:
-                try:
-                    # Use stream=True and close to be more efficient with connections
-                    head_response = requests.head(full_url, timeout=5, allow_redirects=True)
-                    if head_response.status_code >= 400:
-                        broken_links.append(full_url)
-                except requests.exceptions.RequestException as e:
-                    # Consider network errors, timeouts, SSL errors as broken
-                    broken_links.append(f"{full_url} (Error: {e})")
-        
+
+            # Only HTTP/HTTPS links are checked; duplicates are checked once
+            normalized_url = normalize_url(href, url)
+            if normalized_url:
+                links_to_check.append(normalized_url)
+
+        rate_limited_links = []
+        for link, status in check_links(links_to_check).items():
+            if status["outcome"] == "rate_limited":
+                rate_limited_links.append(link) # Unknown: the site throttled the checker
+                continue
+            if not is_broken(status):
+                continue
+            if status["error"]:
+                # Network errors, timeouts and SSL errors count as broken
+                broken_links.append(f"{link} (Error: {status['error']})")
+            else:
+                broken_links.append(link)
+
         results["elements"]["internal_links_count"] = len(internal_links)
         results["elements"]["external_links_count"] = len(external_links)
         results["elements"]["broken_links"] = broken_links # Store actual broken URLs
+        results["elements"]["rate_limited_links"] = rate_limited_links
 
         if not broken_links:
             results["score"] += 15
@@ -125,13 +131,12 @@ def perform_seo_analysis(url):
             results["improvement_tips"].append(f"Fix {len(broken_links)} broken links found.")
 
         # 6. Image Alt Text
-        images = soup.find_all('img')
-        for img in images:
-            alt_text = img.get('alt', '').strip()
-            if not alt_text:
-                results["elements"]["image_alt_status"].append(f"Missing alt for image: {img.get('src', 'N/A')}")
+        for src, alt in features.images:
+            src = src if src is not None else 'N/A'
+            if not (alt or '').strip():
+                results["elements"]["image_alt_status"].append(f"Missing alt for image: {src}")
             else:
-                results["elements"]["image_alt_status"].append(f"Alt text present for image: {img.get('src', 'N/A')}")
+                results["elements"]["image_alt_status"].append(f"Alt text present for image: {src}")
         
         if not any("Missing" in s for s in results["elements"]["image_alt_status"]) and not any("Empty" in s for s in results["elements"]["image_alt_status"]):
             results["score"] += 10
@@ -178,11 +183,7 @@ def check_robots_txt(url):
     """
     parsed_url = urlparse(url)
     robots_url = f"{parsed_url.scheme}://{parsed_url.netloc}/robots.txt"
-    try:
-        response = requests.get(robots_url, timeout=5)
-        return response.status_code == 200
-    except requests.exceptions.RequestException:
-        return False
+    return fetch_page(robots_url, timeout=5, conditional=True).status_code == 200
 
 def check_sitemap_xml(url):
     """
@@ -191,9 +192,5 @@ def check_sitemap_xml(url):
     """
     parsed_url = urlparse(url)
     sitemap_url = f"{parsed_url.scheme}://{parsed_url.netloc}/sitemap.xml"
-    try:
-        response = requests.get(sitemap_url, timeout=5)
-        return response.status_code == 200
-    except requests.exceptions.RequestException:
-        return False
+    return fetch_page(sitemap_url, timeout=5, conditional=True).status_code == 200
 
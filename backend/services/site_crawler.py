@@ -0,0 +1,377 @@
+import gzip
+import hashlib
+import io
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+import requests
+from utils.page_fetcher import fetch_page
+from utils.link_checker import normalize_url
+
+CRAWL_MAX_PAGES = int(os.environ.get("CRAWL_MAX_PAGES", 500))
+CRAWL_CONCURRENCY = int(os.environ.get("CRAWL_CONCURRENCY", 4))
+# Upper bound on queued URLs; links discovered beyond it are counted but dropped
+CRAWL_MAX_FRONTIER = int(os.environ.get("CRAWL_MAX_FRONTIER", 50000))
+CRAWL_MAX_SITEMAPS = int(os.environ.get("CRAWL_MAX_SITEMAPS", 50))
+# Sitemaps larger than this are skipped (the sitemaps protocol allows 50MB uncompressed)
+CRAWL_SITEMAP_MAX_BYTES = int(os.environ.get("CRAWL_SITEMAP_MAX_BYTES", 50 * 1024 * 1024))
+# User agent token matched against robots.txt groups
+CRAWL_ROBOTS_AGENT = os.environ.get("CRAWL_ROBOTS_AGENT", "*")
+# Number of example URLs kept per rollup issue
+ROLLUP_SAMPLE_SIZE = 20
+
+# Links to these files are not pages and are never queued
+NON_PAGE_EXTENSIONS = (
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.svg', '.ico', '.bmp', '.avif',
+    '.css', '.js', '.json', '.xml', '.gz', '.zip', '.rar', '.7z', '.tar',
+    '.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx',
+    '.mp3', '.mp4', '.avi', '.mov', '.webm', '.woff', '.woff2', '.ttf', '.eot'
+)
+SITEMAP_NS = '{http://www.sitemaps.org/schemas/sitemap/0.9}'
+
+def site_root(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+def fetch_robots(url):
+    """
+    Downloads and parses the site's robots.txt, following the same rules as
+    RobotFileParser.read(): 401/403 disallow everything, other 4xx allow everything.
+    Network and server errors also allow everything, as the old presence check did.
+    """
+    robots = RobotFileParser(f"{site_root(url)}/robots.txt")
+    snapshot = fetch_page(robots.url, timeout=5, conditional=True)
+    if snapshot.status_code in (401, 403):
+        robots.disallow_all = True
+    elif snapshot.ok:
+        robots.parse(snapshot.text.splitlines())
+    else:
+        robots.allow_all = True
+    return robots
+
+class _CappedReader:
+    """File-like wrapper that refuses to read more than `limit` bytes, so a small .xml.gz cannot expand without bound."""
+    def __init__(self, stream, limit):
+        self._stream = stream
+        self._remaining = limit
+
+    def read(self, size=-1):
+        # Ask for one byte more than allowed, to tell "exactly at the limit" from "over it"
+        size = self._remaining + 1 if size is None or size < 0 else min(size, self._remaining + 1)
+        data = self._stream.read(size)
+        self._remaining -= len(data)
+        if self._remaining < 0:
+            raise ValueError(f"Sitemap exceeds {CRAWL_SITEMAP_MAX_BYTES} bytes uncompressed")
+        return data
+
+def _read_sitemap(sitemap_url):
+    """
+    Downloads a sitemap (conditionally, so an unchanged sitemap is served from the
+    validator store) and returns a readable stream of its XML. The download stops
+    at CRAWL_SITEMAP_MAX_BYTES, and gzip sitemaps are held to the same limit once
+    decompressed.
+    """
+    snapshot = fetch_page(sitemap_url, timeout=10, conditional=True, max_bytes=CRAWL_SITEMAP_MAX_BYTES)
+    snapshot.raise_for_status()
+    if snapshot.status_code != 200:
+        raise ValueError(f"Unexpected status {snapshot.status_code}")
+    body = snapshot.content
+    stream = io.BytesIO(body)
+    # .xml.gz sitemaps are usually served as application/octet-stream, so check the gzip magic number
+    if body[:2] == b'\x1f\x8b':
+        stream = _CappedReader(gzip.GzipFile(fileobj=stream), CRAWL_SITEMAP_MAX_BYTES)
+    return stream
+
+def iter_sitemap_urls(sitemap_urls, max_sitemaps=None):
+    """
+    Yields the page URLs listed in the given sitemaps, following sitemap indexes.
+    Each file is parsed incrementally and its elements are discarded as soon as
+    they are read, so a 50,000-URL sitemap never exists as a tree in memory.
+    """
+    max_sitemaps = max_sitemaps or CRAWL_MAX_SITEMAPS
+    pending = deque(sitemap_urls)
+    seen = set()
+    while pending and len(seen) < max_sitemaps:
+        sitemap_url = pending.popleft()
+        if sitemap_url in seen:
+            continue
+        seen.add(sitemap_url)
+        try:
+            stream = _read_sitemap(sitemap_url)
+            is_index = None
+            for event, element in ET.iterparse(stream, events=('start', 'end')):
+                if event == 'start':
+                    if is_index is None:
+                        is_index = element.tag.endswith('sitemapindex')
+                    continue
+                if element.tag in (f'{SITEMAP_NS}loc', 'loc') and element.text:
+                    loc = element.text.strip()
+                    if is_index:
+                        pending.append(loc)
+                    else:
+                        yield loc
+                elif element.tag in (f'{SITEMAP_NS}url', 'url', f'{SITEMAP_NS}sitemap', 'sitemap'):
+                    element.clear()
+        except (requests.exceptions.RequestException, ET.ParseError, OSError, ValueError) as e:
+            print(f"Error reading sitemap {sitemap_url}: {e}")
+
+class CrawlFrontier:
+    """
+    Deduplicated FIFO of URLs still to crawl. Seen URLs are remembered as 8-byte
+    digests rather than full strings, which keeps 10k+ page sites in bounded memory.
+    """
+    def __init__(self, max_size=None):
+        self.max_size = max_size or CRAWL_MAX_FRONTIER
+        self._queue = deque()
+        self._seen = set()
+        self.dropped = 0
+
+    def add(self, url):
+        digest = hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest()
+        if digest in self._seen:
+            return False
+        if len(self._queue) >= self.max_size:
+            self.dropped += 1
+            return False
+        self._seen.add(digest)
+        self._queue.append(url)
+        return True
+
+    def pop(self):
+        return self._queue.popleft() if self._queue else None
+
+    def __len__(self):
+        return len(self._queue)
+
+    @property
+    def seen_count(self):
+        return len(self._seen)
+
+class _Politeness:
+    """Spaces out request starts by the robots.txt crawl-delay, across all crawler threads."""
+    def __init__(self, delay):
+        self.delay = delay or 0
+        self._lock = threading.Lock()
+        self._next_at = 0.0
+
+    def wait(self):
+        if not self.delay:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start_at = max(now, self._next_at)
+            self._next_at = start_at + self.delay
+        if start_at > now:
+            time.sleep(start_at - now)
+
+def extract_page_summary(url, snapshot):
+    """
+    perform_seo_analysis-style extraction of one crawled page, without the link
+    checks. Returns (summary, internal links found on the page).
+    """
+    summary = {"url": url, "status_code": snapshot.status_code, "error": str(snapshot.error) if snapshot.error else None}
+    content_type = snapshot.headers.get('Content-Type', snapshot.headers.get('content-type', ''))
+    if not snapshot.ok or (content_type and 'html' not in content_type.lower()):
+        return summary, []
+
+    features = snapshot.features
+    meta_description = (features.meta.get('description') or '').strip()
+    text = features.body_text if features.body_text is not None else features.text
+    host = urlsplit(snapshot.final_url or url).netloc.lower()
+    internal_links = []
+    for href in features.links:
+        link = normalize_url(href, snapshot.final_url or url)
+        if link and urlsplit(link).netloc == host:
+            internal_links.append(link)
+
+    summary.update({
+        "title": features.title,
+        "meta_description": meta_description,
+        "h1_count": len(features.headings.get('h1', [])),
+        "word_count": len(text.split()),
+        "images_missing_alt": sum(1 for _, alt in features.images if not (alt or '').strip()),
+        "internal_links_count": len(internal_links),
+        "noindex": 'noindex' in (features.meta.get('robots') or '').lower()
+    })
+    return summary, internal_links
+
+class SiteRollup:
+    """
+    Site-wide SEO rollup updated one page at a time. Only counters, title and
+    description fingerprints and a few example URLs per issue are kept.
+    """
+    ISSUES = ("missing_title", "title_length", "missing_meta_description", "meta_description_length",
+              "missing_h1", "multiple_h1", "thin_content", "images_missing_alt", "noindex", "fetch_errors")
+
+    def __init__(self):
+        self.pages = 0
+        self.html_pages = 0
+        self.total_words = 0
+        self.images_missing_alt = 0
+        self.status_codes = Counter()
+        self.issue_counts = Counter()
+        self.issue_samples = {issue: [] for issue in self.ISSUES}
+        self._titles = Counter()
+        self._descriptions = Counter()
+
+    def _flag(self, issue, url):
+        self.issue_counts[issue] += 1
+        if len(self.issue_samples[issue]) < ROLLUP_SAMPLE_SIZE:
+            self.issue_samples[issue].append(url)
+
+    def add(self, page):
+        url = page["url"]
+        self.pages += 1
+        self.status_codes[str(page["status_code"] or "error")] += 1
+        if page["error"] or (page["status_code"] or 500) >= 400:
+            self._flag("fetch_errors", url)
+            return
+        if "title" not in page:
+            return # Not an HTML page
+        self.html_pages += 1
+        self.total_words += page["word_count"]
+
+        title = (page["title"] or "").strip()
+        if not title:
+            self._flag("missing_title", url)
+        else:
+            self._titles[hashlib.blake2b(title.encode('utf-8'), digest_size=8).digest()] += 1
+            if not 10 <= len(title) <= 70:
+                self._flag("title_length", url)
+        description = page["meta_description"]
+        if not description:
+            self._flag("missing_meta_description", url)
+        else:
+            self._descriptions[hashlib.blake2b(description.encode('utf-8'), digest_size=8).digest()] += 1
+            if not 120 <= len(description) <= 160:
+                self._flag("meta_description_length", url)
+        if page["h1_count"] == 0:
+            self._flag("missing_h1", url)
+        elif page["h1_count"] > 1:
+            self._flag("multiple_h1", url)
+        if page["word_count"] < 300:
+            self._flag("thin_content", url)
+        if page["images_missing_alt"]:
+            self.images_missing_alt += page["images_missing_alt"]
+            self._flag("images_missing_alt", url)
+        if page["noindex"]:
+            self._flag("noindex", url)
+
+    def to_dict(self):
+        return {
+            "pages_crawled": self.pages,
+            "html_pages": self.html_pages,
+            "status_codes": dict(self.status_codes),
+            "average_word_count": round(self.total_words / self.html_pages) if self.html_pages else 0,
+            "images_missing_alt": self.images_missing_alt,
+            "duplicate_titles": sum(count for count in self._titles.values() if count > 1),
+            "duplicate_meta_descriptions": sum(count for count in self._descriptions.values() if count > 1),
+            "issues": {issue: {"count": self.issue_counts[issue], "examples": self.issue_samples[issue]}
+                       for issue in self.ISSUES if self.issue_counts[issue]}
+        }
+
+def iter_site_crawl(url, max_pages=None, concurrency=None):
+    """
+    Crawls a site starting from its sitemaps and the given URL, obeying robots.txt
+    rules and crawl-delay. Yields ("page", summary) for each crawled page and
+    finally ("rollup", site-wide rollup).
+    """
+    max_pages = max_pages or CRAWL_MAX_PAGES
+    concurrency = concurrency or CRAWL_CONCURRENCY
+    start_url = normalize_url(url, url)
+    if not start_url:
+        raise ValueError(f"Cannot crawl URL: {url}")
+    host = urlsplit(start_url).netloc
+
+    robots = fetch_robots(start_url)
+    delay = robots.crawl_delay(CRAWL_ROBOTS_AGENT)
+    politeness = _Politeness(float(delay) if delay else 0)
+    if politeness.delay:
+        concurrency = 1 # Crawl-delay means one request at a time
+    blocked = 0
+
+    frontier = CrawlFrontier()
+
+    def enqueue(link):
+        nonlocal blocked
+        if not link or urlsplit(link).netloc != host or link.lower().endswith(NON_PAGE_EXTENSIONS):
+            return False
+        if not robots.can_fetch(CRAWL_ROBOTS_AGENT, link):
+            blocked += 1
+            return False
+        return frontier.add(link)
+
+    enqueue(start_url)
+    sitemaps = robots.site_maps() or [f"{site_root(start_url)}/sitemap.xml"]
+    sitemap_pages = 0
+    for loc in iter_sitemap_urls(sitemaps):
+        # Sitemaps seed the frontier only up to the crawl budget
+        if len(frontier) >= max_pages:
+            break
+        if enqueue(normalize_url(loc, start_url)):
+            sitemap_pages += 1
+
+    rollup = SiteRollup()
+    started_at = time.monotonic()
+
+    def crawl_one(page_url):
+        politeness.wait()
+        return extract_page_summary(page_url, fetch_page(page_url, conditional=True))
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    running = {}
+    scheduled = 0
+    try:
+        while True:
+            while len(running) < concurrency and scheduled < max_pages and len(frontier):
+                page_url = frontier.pop()
+                running[executor.submit(crawl_one, page_url)] = page_url
+                scheduled += 1
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                page_url = running.pop(future)
+                try:
+                    summary, links = future.result()
+                except Exception as e:
+                    summary, links = {"url": page_url, "status_code": None, "error": str(e)}, []
+                # Only links still within the budget are worth remembering
+                if scheduled + len(frontier) < max_pages:
+                    for link in links:
+                        enqueue(link)
+                rollup.add(summary)
+                yield "page", summary
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    result = rollup.to_dict()
+    result.update({
+        "url": start_url,
+        "sitemaps": sitemaps,
+        "sitemap_urls_seeded": sitemap_pages,
+        "blocked_by_robots": blocked,
+        "crawl_delay": politeness.delay,
+        "frontier_remaining": len(frontier),
+        "frontier_dropped": frontier.dropped,
+        "elapsed_seconds": round(time.monotonic() - started_at, 2)
+    })
+    yield "rollup", result
+
+def crawl_site(url, max_pages=None, concurrency=None, progress=None, progress_every=25):
+    """
+    Runs iter_site_crawl() to completion and returns the rollup. `progress`, if
+    given, is called as progress(pages_crawled) every `progress_every` pages.
+    """
+    pages = 0
+    for kind, data in iter_site_crawl(url, max_pages, concurrency):
+        if kind == "rollup":
+            return data
+        pages += 1
+        if progress and pages % progress_every == 0:
+            progress(pages)
@@ -1,10 +1,16 @@
 import requests
-from bs4 import BeautifulSoup
 import re
+from utils.page_fetcher import fetch_page
+from utils.html_parser import extract_page_features
 
-def analyze_user_experience(url): # Renamed function
+CONTACT_CLASS_PATTERN = re.compile(r'contact|feedback|form', re.IGNORECASE)
+CONTACT_HREF_PATTERN = re.compile(r'contact|feedback|mailto', re.IGNORECASE)
+NAVIGATION_CLASS_PATTERN = re.compile(r'nav|menu|sitemap', re.IGNORECASE)
+
+def analyze_user_experience(url, snapshot=None): # Renamed function
     """
     Performs a basic User Experience (UX) analysis of the given URL.
+    An already fetched PageSnapshot can be passed in to avoid downloading the page again.
     """
     results = {
         "issues": [],
@@ -12,28 +18,26 @@ def analyze_user_experience(url): # Renamed function
         "raw_html": "" # To store raw HTML for other checks like viewport
     }
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-        results["raw_html"] = response.text # Store raw HTML
+        if snapshot is None:
+            snapshot = fetch_page(url, conditional=True)
+        snapshot.raise_for_status()
+        features = snapshot.features
+        results["raw_html"] = snapshot.text # Store raw HTML
 
         # Basic readability checks (placeholder for more advanced analysis)
         results["suggestions"].append("Font sizes appear to be generally readable.")
         results["suggestions"].append("Clickable elements appear to be of adequate size for touch targets.")
 
         # Check for contact information/form
-        contact_forms = soup.find_all(['form', 'a'], class_=re.compile(r'contact|feedback|form', re.IGNORECASE))
-        contact_links = soup.find_all('a', href=re.compile(r'contact|feedback|mailto', re.IGNORECASE))
+        contact_forms = [tag for tag, css_class in features.tag_classes if tag in ('form', 'a') and CONTACT_CLASS_PATTERN.search(css_class)]
+        contact_links = [href for href in features.links if CONTACT_HREF_PATTERN.search(href)]
         if not contact_forms and not contact_links:
             results["issues"].append("Consider adding a clear contact form for user feedback or inquiries.")
         else:
             results["suggestions"].append("Contact information or form detected, improving user feedback channels.")
 
         # Check for navigation elements / sitemap link
-        nav_elements = soup.find_all(['nav', 'ul', 'ol', 'a'], class_=re.compile(r'nav|menu|sitemap', re.IGNORECASE))
+        nav_elements = [tag for tag, css_class in features.tag_classes if tag in ('nav', 'ul', 'ol', 'a') and NAVIGATION_CLASS_PATTERN.search(css_class)]
         if not nav_elements:
             results["issues"].append("Ensure clear navigation elements or a sitemap link are present for user orientation.")
         else:
@@ -57,6 +61,4 @@ def check_viewport_meta(html_content):
     """
     Checks if the HTML content contains a viewport meta tag for mobile responsiveness.
     """
-    soup = BeautifulSoup(html_content, 'html.parser')
-    viewport_meta = soup.find('meta', attrs={'name': 'viewport'})
-    return viewport_meta is not None
+    return extract_page_features(html_content).has_viewport_meta
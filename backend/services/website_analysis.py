@@ -1,65 +1,39 @@
 import requests
-from bs4 import BeautifulSoup
 import whois
 import dns.resolver
 import datetime
 import os
 import json
-from weasyprint import HTML
 import tempfile
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import time
+from urllib.parse import urlparse
+from utils.page_fetcher import fetch_page, PageSnapshot
+from services.performance_probe import get_performance_report
+from services.asset_analysis import analyze_assets
+from utils.html_parser import HEADING_TAGS
+from utils.link_checker import normalize_url, check_links, is_broken
+from utils.task_graph import TaskGraph
+from utils.llm_gateway import coalesced
+from utils.llm_cache import llm_cache_key, cached_generate
+from utils.gemini_client import generate_content, GeminiError
 
 # Function to call Gemini API (copied from article_analysis.py for consistency)
-def call_gemini_api(prompt, model_name="gemini-2.5-flash-preview-05-20"):
+@coalesced
+def call_gemini_api(prompt, model_name="gemini-2.5-flash-preview-05-20", use_cache=True):
     """
     Calls the Gemini API to generate text based on a given prompt.
-    Handles exponential backoff for retries.
+    Answers are served from the LLM response cache unless use_cache=False.
+    Retries and deadlines are handled by utils.gemini_client.
     """
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        print("Error: GEMINI_API_KEY environment variable not set.")
-        return None
-
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={api_key}"
-    headers = {
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "contents": [{"role": "user", "parts": [{"text": prompt}]}]
-    }
+    cache_key = llm_cache_key(model_name, prompt)
+    return cached_generate(cache_key, lambda: _generate_content(model_name, prompt), use_cache=use_cache)
 
-    retries = 0
-    max_retries = 5
-    base_delay = 1  # seconds
-
-    while retries < max_retries:
-        try:
-            response = requests.post(url, headers=headers, data=json.dumps(payload), timeout=60)
-            response.raise_for_status()  # Raise an HTTPError for bad responses (4xx or 5xx)
-            result = response.json()
-
-            if result and result.get("candidates") and len(result["candidates"]) > 0 and \
-               result["candidates"][0].get("content") and result["candidates"][0]["content"].get("parts") and \
-               len(result["candidates"][0]["content"]["parts"]) > 0:
-                return result["candidates"][0]["content"]["parts"][0]["text"]
-            else:
-                print(f"Gemini API returned an unexpected structure: {result}")
-                return None
-        except requests.exceptions.Timeout:
-            print(f"Request timed out. Retrying {retries + 1}/{max_retries}...")
-        except requests.exceptions.RequestException as e:
-            print(f"Request failed: {e}. Retrying {retries + 1}/{max_retries}...")
-        except json.JSONDecodeError:
-            print(f"Failed to decode JSON from response: {response.text}. Retrying {retries + 1}/{max_retries}...")
-
-        retries += 1
-        delay = base_delay * (2 ** retries)  # Exponential backoff
-        print(f"Waiting for {delay} seconds before retrying...")
-        time.sleep(delay)
-
-    print(f"Failed to get a successful response from Gemini API after {max_retries} retries.")
-    return None
+def _generate_content(model_name, prompt):
+    """Sends one generateContent request through the shared client. Returns the text or None."""
+    try:
+        return generate_content(model_name, prompt)
+    except GeminiError as e:
+        print(f"Failed to get a successful response from Gemini API: {e}")
+        return None
 
 def get_domain_authority(domain):
     """
@@ -127,85 +101,12 @@ def get_domain_authority(domain):
 
 def get_page_speed_insights(url, lang="en"):
     """
-    Retrieves simulated PageSpeed Insights data using LLM.
-    In a real application, this would integrate with Google PageSpeed Insights API.
-    """
-    prompt_en = f"""Analyze the potential PageSpeed Insights for the URL: {url}.
-    Provide a simulated Performance Score (0-100) and identify 3-5 common Core Web Vitals (LCP, FID, CLS) statuses (Good, Needs Improvement, Poor).
-    Also, list 3-5 common performance issues and their brief solutions.
-    Format the output as a JSON object with keys: "Performance Score", "Core Web Vitals", "Issues", "Pagespeed Report Link".
-    Example:
-    {{
-        "Performance Score": "75",
-        "Core Web Vitals": {{
-            "Largest Contentful Paint (LCP)": "Needs Improvement",
-            "First Input Delay (FID)": "Good",
-            "Cumulative Layout Shift (CLS)": "Poor"
-        }},
-        "Issues": [
-            "Optimize images (compress and lazy load)",
-            "Minify CSS and JavaScript",
-            "Reduce server response times"
-        ],
-        "Pagespeed Report Link": "https://developers.google.com/speed/pagespeed/insights/?url={url}"
-    }}
-    Ensure the JSON is valid and only contains the specified keys. If data is not available, use "N/A".
+    Measures the page's load performance locally (DNS, connect, TLS, TTFB and
+    download of the page and its render-blocking assets) and scores it.
+    See services.performance_probe; no LLM call is involved.
     """
-
-    prompt_ar = f"""حلل رؤى سرعة الصفحة المحتملة للرابط: {url}.
-    قدم درجة أداء محاكاة (0-100) وحدد حالة 3-5 من مقاييس Core Web Vitals الشائعة (LCP, FID, CLS) (جيد، يحتاج إلى تحسين، ضعيف).
-    أيضاً، اذكر 3-5 مشكلات أداء شائعة وحلولها الموجزة.
-    قم بتنسيق الناتج ككائن JSON بالمفاتيح التالية: "Performance Score", "Core Web Vitals", "Issues", "Pagespeed Report Link".
-    مثال:
-    {{
-        "Performance Score": "75",
-        "Core Web Vitals": {{
-            "Largest Contentful Paint (LCP)": "يحتاج إلى تحسين",
-            "First Input Delay (FID)": "جيد",
-            "Cumulative Layout Shift (CLS)": "ضعيف"
-        }},
-        "Issues": [
-            "تحسين الصور (ضغط وتحميل كسول)",
-            "تصغير ملفات CSS و JavaScript",
-            "تقليل أوقات استجابة الخادم"
-        ],
-        "Pagespeed Report Link": "https://developers.google.com/speed/pagespeed/insights/?url={url}"
-    }}
-    تأكد أن JSON صالح ويحتوي فقط على المفاتيح المحددة. إذا كانت البيانات غير متوفرة، استخدم "N/A".
-    """
-
-    selected_prompt = prompt_ar if lang == "ar" else prompt_en
-
     try:
-        # Call Gemini API to simulate PageSpeed Insights
-        response_text = call_gemini_api(selected_prompt)
-        if response_text:
-            # Clean the response to ensure it's valid JSON
-            # Sometimes LLMs add extra text like "```json" or "```"
-            response_text = response_text.replace('```json', '').replace('```', '').strip()
-            scores = json.loads(response_text)
-            scores["Pagespeed Report Link"] = f"https://developers.google.com/speed/pagespeed/insights/?url={url}"
-            return {
-                "scores": {"Performance Score": scores.get("Performance Score", "N/A")},
-                "core_web_vitals": scores.get("Core Web Vitals", {}),
-                "issues": scores.get("Issues", []),
-                "pagespeed_report_link": scores.get("Pagespeed Report Link", f"https://developers.google.com/speed/pagespeed/insights/?url={url}")
-            }
-        else:
-            return {
-                "scores": {"Performance Score": "N/A"},
-                "core_web_vitals": {},
-                "issues": ["Failed to get PageSpeed insights from AI."],
-                "pagespeed_report_link": f"https://developers.google.com/speed/pagespeed/insights/?url={url}"
-            }
-    except json.JSONDecodeError as e:
-        print(f"JSON decoding error for PageSpeed Insights: {e} - Response: {response_text}")
-        return {
-            "scores": {"Performance Score": "N/A"},
-            "core_web_vitals": {},
-            "issues": ["Failed to parse PageSpeed insights from AI (JSON Error)."],
-            "pagespeed_report_link": f"https://developers.google.com/speed/pagespeed/insights/?url={url}"
-        }
+        return get_performance_report(url, lang, timeout=SECTION_TIMEOUTS["snapshot"])
     except Exception as e:
         print(f"Error in get_page_speed_insights for {url}: {e}")
         return {
@@ -215,9 +116,10 @@ def get_page_speed_insights(url, lang="en"):
             "pagespeed_report_link": f"https://developers.google.com/speed/pagespeed/insights/?url={url}"
         }
 
-def get_seo_quality(url, lang="en"):
+def get_seo_quality(url, lang="en", snapshot=None):
     """
     Analyzes SEO quality of a webpage.
+    Reuses the given PageSnapshot instead of downloading the page again.
     """
     elements = {
         "title": "N/A",
@@ -237,59 +139,56 @@ def get_seo_quality(url, lang="en"):
     score = "N/A"
 
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
+        if snapshot is None:
+            snapshot = fetch_page(url, conditional=True)
+        snapshot.raise_for_status()
+        features = snapshot.features
 
         # Title and Meta Description
-        title_tag = soup.find('title')
-        elements["title"] = title_tag.get_text(strip=True) if title_tag else "N/A"
+        elements["title"] = features.title if features.title is not None else "N/A"
 
-        meta_description_tag = soup.find('meta', attrs={'name': 'description'})
-        elements["meta_description"] = meta_description_tag['content'].strip() if meta_description_tag else "N/A"
+        meta_description = features.meta.get('description')
+        elements["meta_description"] = meta_description.strip() if meta_description is not None else "N/A"
 
         # H Tags
-        for i in range(1, 7):
-            h_tags = [h.get_text(strip=True) for h in soup.find_all(f'h{i}') if h.get_text(strip=True)]
+        for tag in HEADING_TAGS:
+            h_tags = [text for text in features.headings.get(tag, []) if text]
             if h_tags:
-                elements["h_tags"][f"h{i}"] = h_tags
+                elements["h_tags"][tag] = h_tags
 
         # Links and Broken Links
-        all_links = soup.find_all('a', href=True)
+        all_links = features.links
         internal_links = 0
         external_links = 0
-        broken_links = []
-
-        # Use ThreadPoolExecutor for concurrent link checking
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            future_to_url = {executor.submit(check_link_status, link['href'], url): link['href'] for link in all_links}
-            for future in as_completed(future_to_url):
-                href = future_to_url[future]
-                try:
-                    is_internal, is_broken = future.result()
-                    if is_internal:
-                        internal_links += 1
-                    else:
-                        external_links += 1
-                    if is_broken:
-                        broken_links.append(href)
-                except Exception as e:
-                    print(f"Error checking link {href}: {e}")
-                    # Consider as broken if check fails
-                    broken_links.append(href)
+
+        base_host = urlparse(normalize_url(url, url) or url).netloc
+        links_to_check = []
+        for href in all_links:
+            normalized_url = normalize_url(href, url)
+            if not normalized_url:
+                continue # mailto:, tel:, javascript: and in-page anchors
+            if urlparse(normalized_url).netloc == base_host:
+                internal_links += 1
+            else:
+                external_links += 1
+            links_to_check.append(normalized_url)
+
+        # Each distinct URL is checked once, concurrently, over the shared connection pool
+        link_statuses = check_links(links_to_check)
+        broken_links = [link for link, status in link_statuses.items() if is_broken(status)]
 
         elements["internal_links_count"] = internal_links
         elements["external_links_count"] = external_links
         elements["broken_links"] = broken_links
+        elements["rate_limited_links"] = [link for link, status in link_statuses.items() if status["outcome"] == "rate_limited"]
 
         # Missing Alt Text
-        images_without_alt = [img for img in soup.find_all('img') if not img.get('alt')]
+        images_without_alt = [src for src, alt in features.images if not alt]
         elements["missing_alt_count"] = len(images_without_alt)
 
         # Content Length and Keyword Density
-        main_content = soup.find('body') # Or more specific content area
-        if main_content:
-            text_content = main_content.get_text(separator=' ', strip=True)
+        text_content = features.body_text # Or more specific content area
+        if text_content is not None:
             elements["extracted_text_sample"] = text_content[:1000] # Store first 1000 chars for AI
             words = text_content.split()
             elements["content_length"]["word_count"] = len(words)
@@ -309,18 +208,9 @@ def get_seo_quality(url, lang="en"):
             if total_words > 0:
                 elements["keyword_density"] = {word: round((count / total_words) * 100, 2) for word, count in word_counts.most_common(10)}
 
-        # Robots.txt and Sitemap.xml presence
-        try:
-            robots_response = requests.get(f"{url}/robots.txt", timeout=3)
-            elements["robots_txt_present"] = robots_response.status_code == 200
-        except requests.exceptions.RequestException:
-            elements["robots_txt_present"] = False
-
-        try:
-            sitemap_response = requests.get(f"{url}/sitemap.xml", timeout=3)
-            elements["sitemap_xml_present"] = sitemap_response.status_code == 200
-        except requests.exceptions.RequestException:
-            elements["sitemap_xml_present"] = False
+        # Robots.txt and Sitemap.xml presence (conditional requests: unchanged files are not downloaded again)
+        elements["robots_txt_present"] = fetch_page(f"{url}/robots.txt", timeout=3, conditional=True).status_code == 200
+        elements["sitemap_xml_present"] = fetch_page(f"{url}/sitemap.xml", timeout=3, conditional=True).status_code == 200
 
         # Generate SEO improvement tips using LLM
         prompt_en = f"""Based on the following SEO analysis data for {url}:
@@ -384,20 +274,6 @@ def get_seo_quality(url, lang="en"):
         "improvement_tips": improvement_tips
     }
 
-def check_link_status(href, base_url):
-    """Checks if a link is internal/external and its status."""
-    is_internal = href.startswith('/') or base_url in href
-    is_broken = False
-    try:
-        # Only check external links or internal links that are full URLs
-        if not is_internal or href.startswith('http'):
-            response = requests.head(href, timeout=5, allow_redirects=True)
-            if not (200 <= response.status_code < 400): # Success or redirect
-                is_broken = True
-    except requests.exceptions.RequestException:
-        is_broken = True
-    return is_internal, is_broken
-
 def calculate_seo_score(elements):
     """
     Calculates a simple SEO score based on collected elements.
@@ -445,9 +321,10 @@ def calculate_seo_score(elements):
     # Ensure score is within 0-100 range
     return max(0, min(100, score))
 
-def get_user_experience_insights(url, lang="en"):
+def get_user_experience_insights(url, lang="en", snapshot=None):
     """
     Retrieves user experience insights using LLM.
+    Reuses the given PageSnapshot instead of downloading the page again.
     """
     elements = {
         "viewport_meta_present": False,
@@ -456,13 +333,12 @@ def get_user_experience_insights(url, lang="en"):
     }
 
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
+        if snapshot is None:
+            snapshot = fetch_page(url, conditional=True)
+        snapshot.raise_for_status()
 
         # Check for viewport meta tag
-        viewport_meta = soup.find('meta', attrs={'name': 'viewport'})
-        elements["viewport_meta_present"] = viewport_meta is not None
+        elements["viewport_meta_present"] = snapshot.features.has_viewport_meta
 
         # Use LLM for broader UX assessment
         prompt_en = f"""Analyze the user experience (UX) of the webpage: {url}.
@@ -805,40 +681,55 @@ def ai_broken_link_suggestions(broken_links, lang="en"):
         print(f"Error in ai_broken_link_suggestions: {e}")
         return {"suggestions": lang_specific_message(lang, "failedToGetBrokenLinkSuggestions")}
 
-def get_website_analysis(url, lang="en"):
+# Per-section time budgets in seconds; a section that runs over is reported
+# with a partial result and the sections that depend on it still run.
+SECTION_TIMEOUTS = {
+    "snapshot": int(os.environ.get("ANALYSIS_FETCH_TIMEOUT", 20)),
+    "analyzer": int(os.environ.get("ANALYSIS_SECTION_TIMEOUT", 90)),
+    "ai": int(os.environ.get("ANALYSIS_AI_TIMEOUT", 60)),
+}
+
+def build_analysis_graph(url, lang="en"):
     """
-    Performs a comprehensive website analysis.
+    Declares every analysis section and the inputs it needs. Each section
+    starts as soon as its inputs are ready, so the total latency is that of
+    the slowest dependency chain rather than the sum of all stages.
     """
     domain = url.replace("http://", "").replace("https://", "").split("/")[0]
+    analyzer_timeout = SECTION_TIMEOUTS["analyzer"]
+    ai_timeout = SECTION_TIMEOUTS["ai"]
+
+    graph = TaskGraph()
+    graph.add("domain_authority", lambda: get_domain_authority(domain), timeout=analyzer_timeout)
+    graph.add("page_speed", lambda: get_page_speed_insights(url, lang), timeout=analyzer_timeout)
+    graph.add("adsense_readiness", lambda: get_adsense_readiness(url, lang), timeout=analyzer_timeout)
+    # Download and parse the page once, then share it between the page-based analyzers.
+    # A fetch that times out leaves a snapshot carrying the error.
+    graph.add("snapshot", lambda: fetch_page(url, conditional=True), timeout=SECTION_TIMEOUTS["snapshot"],
+              fallback=lambda error: PageSnapshot(url, error=error), emit=False)
+    graph.add("seo_quality", lambda snapshot: get_seo_quality(url, lang, snapshot), deps=["snapshot"], timeout=analyzer_timeout)
+    graph.add("user_experience", lambda snapshot: get_user_experience_insights(url, lang, snapshot), deps=["snapshot"], timeout=analyzer_timeout)
+    graph.add("asset_weight", lambda snapshot: analyze_assets(url, snapshot, lang), deps=["snapshot"], timeout=analyzer_timeout)
+    graph.add("extracted_text_sample", lambda seo: seo.get('elements', {}).get('extracted_text_sample', ''),
+              deps=["seo_quality"], fallback='')
+    graph.add("broken_link_suggestions", lambda seo: ai_broken_link_suggestions(seo.get('elements', {}).get('broken_links', []), lang),
+              deps=["seo_quality"], timeout=ai_timeout)
+    graph.add("ai_insights", lambda seo, speed, ux: get_ai_insights(url, seo, speed, ux, lang),
+              deps=["seo_quality", "page_speed", "user_experience"], timeout=ai_timeout)
+    return graph
+
+def iter_website_analysis(url, lang="en"):
+    """
+    Performs a comprehensive website analysis and yields (section, data) pairs
+    as each section finishes, fastest first.
+    """
+    return build_analysis_graph(url, lang).iter_results()
 
-    # Use ThreadPoolExecutor for concurrent API calls
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        future_domain_authority = executor.submit(get_domain_authority, domain)
-        future_page_speed = executor.submit(get_page_speed_insights, url, lang)
-        future_seo_quality = executor.submit(get_seo_quality, url, lang)
-        future_user_experience = executor.submit(get_user_experience_insights, url, lang)
-        future_adsense_readiness = executor.submit(get_adsense_readiness, url, lang)
-
-        domain_authority_data = future_domain_authority.result()
-        page_speed_data = future_page_speed.result()
-        seo_quality_data = future_seo_quality.result()
-        user_experience_data = future_user_experience.result()
-        adsense_readiness_data = future_adsense_readiness.result()
-
-    # Get AI insights based on collected data
-    ai_insights_data = get_ai_insights(url, seo_quality_data, page_speed_data, user_experience_data, lang)
-    broken_link_suggestions_data = ai_broken_link_suggestions(seo_quality_data.get('elements', {}).get('broken_links', []), lang)
-
-    return {
-        "domain_authority": domain_authority_data,
-        "page_speed": page_speed_data,
-        "seo_quality": seo_quality_data,
-        "user_experience": user_experience_data,
-        "adsense_readiness": adsense_readiness_data,
-        "ai_insights": ai_insights_data,
-        "broken_link_suggestions": broken_link_suggestions_data,
-        "extracted_text_sample": seo_quality_data.get('elements', {}).get('extracted_text_sample', '')
-    }
+def get_website_analysis(url, lang="en"):
+    """
+    Performs a comprehensive website analysis.
+    """
+    return build_analysis_graph(url, lang).run()
 
 def generate_pdf_report(url, lang="en"):
     """
@@ -1103,6 +994,9 @@ def generate_pdf_report(url, lang="en"):
     </html>
     """
     
+    # Imported here so the analysis itself does not require WeasyPrint's native libraries
+    from weasyprint import HTML
+
     # WeasyPrint requires a file-like object or a filename
     # Use a temporary file to save the HTML content
     with tempfile.NamedTemporaryFile(delete=True, suffix=".html") as tmp_html_file:
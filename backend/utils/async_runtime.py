@@ -0,0 +1,98 @@
+import asyncio
+import atexit
+import os
+import threading
+import aiohttp
+from utils.rate_limiter import priority_lane, current_lane
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
+
+# Connection pool limits for the shared aiohttp session
+HTTP_POOL_LIMIT = int(os.environ.get("HTTP_POOL_LIMIT", 100))
+HTTP_POOL_LIMIT_PER_HOST = int(os.environ.get("HTTP_POOL_LIMIT_PER_HOST", 8))
+HTTP_DNS_CACHE_TTL = int(os.environ.get("HTTP_DNS_CACHE_TTL", 300))
+HTTP_KEEPALIVE_TIMEOUT = int(os.environ.get("HTTP_KEEPALIVE_TIMEOUT", 30))
+
+_lock = threading.Lock()
+_loop = None
+_thread = None
+_owner_pid = None
+_session = None
+
+def get_event_loop():
+    """
+    Returns the long-lived event loop of this worker process, starting it on a
+    daemon thread the first time. A forked child gets its own loop.
+    """
+    global _loop, _thread, _owner_pid, _session
+    if _loop is not None and _owner_pid == os.getpid():
+        return _loop
+    with _lock:
+        if _loop is None or _owner_pid != os.getpid():
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(ready.set)
+                loop.run_forever()
+
+            _thread = threading.Thread(target=run, name="async-runtime", daemon=True)
+            _thread.start()
+            ready.wait()
+            _loop = loop
+            _owner_pid = os.getpid()
+            _session = None
+    return _loop
+
+async def _in_lane(coro, lane):
+    with priority_lane(lane):
+        return await coro
+
+def run_coroutine(coro, timeout=None):
+    """
+    Runs a coroutine on the background loop and blocks until it finishes.
+    Meant for sync code (Flask handlers, thread pools); must not be called
+    from the background loop itself. The coroutine runs in the caller's
+    priority lane, so rate-limited calls on the loop queue in the right lane.
+    """
+    loop = get_event_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        coro.close()
+        raise RuntimeError("run_coroutine() cannot be called from the background event loop; await the coroutine instead.")
+    return asyncio.run_coroutine_threadsafe(_in_lane(coro, current_lane()), loop).result(timeout)
+
+async def get_http_session():
+    """
+    Returns the pooled aiohttp session (keep-alive, DNS cache, per-host limits).
+    Must be awaited on the background loop; the session is created on first use.
+    """
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT
+        )
+        _session = aiohttp.ClientSession(connector=connector, headers={'User-Agent': USER_AGENT})
+    return _session
+
+async def _close_session():
+    if _session is not None and not _session.closed:
+        await _session.close()
+
+def _shutdown():
+    if _loop is None or _owner_pid != os.getpid() or not _loop.is_running():
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(_close_session(), _loop).result(5)
+    except Exception as e:
+        print(f"Error closing HTTP session: {e}")
+    _loop.call_soon_threadsafe(_loop.stop)
+
+atexit.register(_shutdown)
@@ -0,0 +1,481 @@
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Sentinel: use the TTL configured for the namespace
+NAMESPACE_TTL = object()
+# Sentinel returned by backends on a miss (None is a valid cached value for some callers)
+MISSING = object()
+# SQLite hits are served by a plain read; their LRU/LFU bookkeeping is buffered per
+# process and written in one transaction once this many keys or seconds accumulate
+SQLITE_ACCESS_FLUSH_KEYS = int(os.environ.get("SQLITE_ACCESS_FLUSH_KEYS", 256))
+SQLITE_ACCESS_FLUSH_SECONDS = float(os.environ.get("SQLITE_ACCESS_FLUSH_SECONDS", 5))
+
+def hash_key(namespace, key):
+    """
+    Builds a fixed-size cache key. Raw keys (full article bodies, URL pairs) are
+    hashed so the cache never holds a second copy of large request payloads.
+    """
+    raw = key if isinstance(key, str) else json.dumps(key, sort_keys=True, default=str)
+    return f"{namespace}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+
+def encode_value(value):
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+def estimate_size(value):
+    """Approximate size of a cached value in bytes (its JSON encoding)."""
+    return len(encode_value(value).encode('utf-8'))
+
+# --- Storage backends ---
+# Each backend stores already-hashed keys and implements get/set/delete/clear/stats.
+# get() returns MISSING on a miss; set() receives both the value and its JSON payload.
+
+class _Entry:
+    __slots__ = ('value', 'size', 'expires_at', 'frequency')
+
+    def __init__(self, value, size, expires_at):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+        self.frequency = 1
+
+class MemoryBackend:
+    """Per-process store bounded by total size in bytes, with LRU or LFU eviction."""
+    def __init__(self, max_bytes=64 * 1024 * 1024, policy="lru"):
+        if policy not in ("lru", "lfu"):
+            raise ValueError(f"Unknown cache eviction policy: {policy}")
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self._entries = OrderedDict() # LRU order, oldest first
+        self._buckets = {}            # LFU: frequency -> OrderedDict of keys, oldest first
+        self._min_frequency = 0
+        self._bytes = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._lock = threading.Lock()
+
+    def get(self, cache_key):
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is None:
+                return MISSING
+            if entry.expires_at is not None and entry.expires_at <= time.time():
+                self._remove(cache_key)
+                self._expirations += 1
+                return MISSING
+            self._touch(cache_key, entry)
+            return entry.value
+
+    def set(self, cache_key, value, payload, ttl):
+        size = len(payload.encode('utf-8'))
+        if size > self.max_bytes:
+            return False
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            if cache_key in self._entries:
+                self._remove(cache_key)
+            if self._bytes + size > self.max_bytes:
+                self._purge_expired()
+            while self._bytes + size > self.max_bytes and self._entries:
+                self._evict_one()
+            self._entries[cache_key] = _Entry(value, size, expires_at)
+            self._buckets.setdefault(1, OrderedDict())[cache_key] = None
+            self._min_frequency = 1
+            self._bytes += size
+        return True
+
+    def delete(self, cache_key):
+        with self._lock:
+            if cache_key in self._entries:
+                self._remove(cache_key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            self._min_frequency = 0
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "memory",
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "policy": self.policy,
+                "evictions": self._evictions,
+                "expirations": self._expirations
+            }
+
+    # --- Internal helpers (caller holds the lock) ---
+
+    def _touch(self, cache_key, entry):
+        self._entries.move_to_end(cache_key)
+        bucket = self._buckets[entry.frequency]
+        del bucket[cache_key]
+        if not bucket:
+            del self._buckets[entry.frequency]
+            if self._min_frequency == entry.frequency:
+                self._min_frequency = entry.frequency + 1
+        entry.frequency += 1
+        self._buckets.setdefault(entry.frequency, OrderedDict())[cache_key] = None
+
+    def _remove(self, cache_key):
+        entry = self._entries.pop(cache_key)
+        bucket = self._buckets[entry.frequency]
+        del bucket[cache_key]
+        if not bucket:
+            del self._buckets[entry.frequency]
+            if self._min_frequency == entry.frequency:
+                self._min_frequency = min(self._buckets) if self._buckets else 0
+        self._bytes -= entry.size
+
+    def _evict_one(self):
+        if self.policy == "lfu":
+            cache_key = next(iter(self._buckets[self._min_frequency]))
+        else:
+            cache_key = next(iter(self._entries))
+        self._remove(cache_key)
+        self._evictions += 1
+
+    def _purge_expired(self):
+        now = time.time()
+        expired = [k for k, e in self._entries.items() if e.expires_at is not None and e.expires_at <= now]
+        for cache_key in expired:
+            self._remove(cache_key)
+        self._expirations += len(expired)
+
+class SQLiteBackend:
+    """
+    Store shared by every process on the host, kept in one SQLite file in WAL mode
+    so readers never block the writer. With mmap_bytes > 0 SQLite reads the file
+    through a memory map, which makes hits close to in-memory speed.
+    Size limits, LRU/LFU eviction and counters are enforced across processes.
+    Hits never take the write lock: access times and hit counts are batched
+    (see SQLITE_ACCESS_FLUSH_KEYS) and expired rows are deleted with the batch.
+    """
+    def __init__(self, path, table="cache", max_bytes=256 * 1024 * 1024, policy="lru", mmap_bytes=0):
+        if policy not in ("lru", "lfu"):
+            raise ValueError(f"Unknown cache eviction policy: {policy}")
+        if not table.isidentifier():
+            raise ValueError(f"Invalid cache table name: {table}")
+        self.path = path
+        self.table = table
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.mmap_bytes = mmap_bytes
+        self._local = threading.local()
+        self._access_lock = threading.Lock()
+        self._accessed = {}   # key -> [hits, last access] not yet written
+        self._expired = set() # Expired keys seen by get(), deleted on the next flush
+        self._last_flush = time.monotonic()
+        with self._transaction() as conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, expires_at REAL, last_access REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_lru ON {table} (last_access)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_lfu ON {table} (hits, last_access)")
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table}_counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            for name in ("bytes", "evictions", "expirations"):
+                conn.execute(f"INSERT OR IGNORE INTO {table}_counters (name, value) VALUES (?, 0)", (name,))
+
+    def _connection(self):
+        # One connection per thread and per process (connections must not cross a fork)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            if self.mmap_bytes:
+                conn.execute(f"PRAGMA mmap_size={int(self.mmap_bytes)}")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _add_counter(self, conn, name, delta):
+        if delta:
+            conn.execute(f"UPDATE {self.table}_counters SET value = value + ? WHERE name = ?", (delta, name))
+
+    def get(self, cache_key):
+        now = time.time()
+        row = self._connection().execute(f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (cache_key,)).fetchone()
+        if row is None:
+            return MISSING
+        value, expires_at = row
+        expired = expires_at is not None and expires_at <= now
+        with self._access_lock:
+            if expired:
+                self._expired.add(cache_key)
+            else:
+                access = self._accessed.setdefault(cache_key, [0, now])
+                access[0] += 1
+                access[1] = now
+            due = len(self._accessed) + len(self._expired) >= SQLITE_ACCESS_FLUSH_KEYS or \
+                time.monotonic() - self._last_flush >= SQLITE_ACCESS_FLUSH_SECONDS
+        if due:
+            self._try_flush_access()
+        return MISSING if expired else json.loads(value)
+
+    def _try_flush_access(self):
+        """Flushes the buffered bookkeeping only if the write lock is free right now; otherwise it stays buffered."""
+        conn = self._connection()
+        conn.execute("PRAGMA busy_timeout=0")
+        try:
+            with self._transaction() as conn:
+                self._flush_access(conn)
+        except sqlite3.OperationalError:
+            pass # Locked by a writer; the next hit or set() flushes instead
+        finally:
+            conn.execute("PRAGMA busy_timeout=10000")
+
+    def _flush_access(self, conn):
+        """Writes the buffered hits and deletes the expired rows seen since the last flush (inside a transaction)."""
+        with self._access_lock:
+            accessed, self._accessed = self._accessed, {}
+            expired, self._expired = self._expired, set()
+            self._last_flush = time.monotonic()
+        if accessed:
+            conn.executemany(
+                f"UPDATE {self.table} SET last_access = MAX(last_access, ?), hits = hits + ? WHERE key = ?",
+                [(last_access, hits, key) for key, (hits, last_access) in accessed.items()]
+            )
+        now = time.time()
+        for key in expired:
+            # Re-check: another process may have stored a fresh value meanwhile
+            row = conn.execute(f"SELECT size FROM {self.table} WHERE key = ? AND expires_at <= ?", (key, now)).fetchone()
+            if row is not None:
+                conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self._add_counter(conn, "bytes", -row[0])
+                self._add_counter(conn, "expirations", 1)
+
+    def set(self, cache_key, value, payload, ttl):
+        size = len(payload.encode('utf-8'))
+        if size > self.max_bytes:
+            return False
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        with self._transaction() as conn:
+            # Already holding the write lock: apply the buffered hits so eviction sees them
+            self._flush_access(conn)
+            old = conn.execute(f"SELECT size FROM {self.table} WHERE key = ?", (cache_key,)).fetchone()
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, size, expires_at, last_access, hits) VALUES (?, ?, ?, ?, ?, 0)",
+                (cache_key, payload, size, expires_at, now)
+            )
+            self._add_counter(conn, "bytes", size - (old[0] if old else 0))
+            total = conn.execute(f"SELECT value FROM {self.table}_counters WHERE name = 'bytes'").fetchone()[0]
+            if total > self.max_bytes:
+                total = self._evict(conn, cache_key, total, now)
+        return True
+
+    def _evict(self, conn, keep_key, total, now):
+        expired = conn.execute(f"SELECT key, size FROM {self.table} WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,)).fetchall()
+        for key, size in expired:
+            conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            total -= size
+        self._add_counter(conn, "expirations", len(expired))
+        self._add_counter(conn, "bytes", -sum(size for _, size in expired))
+
+        order = "hits, last_access" if self.policy == "lfu" else "last_access"
+        evicted = 0
+        while total > self.max_bytes:
+            victims = conn.execute(f"SELECT key, size FROM {self.table} WHERE key != ? ORDER BY {order} LIMIT 64", (keep_key,)).fetchall()
+            if not victims:
+                break
+            freed = 0
+            for key, size in victims:
+                if total - freed <= self.max_bytes:
+                    break
+                conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                freed += size
+                evicted += 1
+            total -= freed
+            self._add_counter(conn, "bytes", -freed)
+        self._add_counter(conn, "evictions", evicted)
+        return total
+
+    def delete(self, cache_key):
+        with self._transaction() as conn:
+            row = conn.execute(f"SELECT size FROM {self.table} WHERE key = ?", (cache_key,)).fetchone()
+            if row is not None:
+                conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (cache_key,))
+                self._add_counter(conn, "bytes", -row[0])
+
+    def clear(self):
+        with self._transaction() as conn:
+            conn.execute(f"DELETE FROM {self.table}")
+            conn.execute(f"UPDATE {self.table}_counters SET value = 0 WHERE name = 'bytes'")
+
+    def stats(self):
+        conn = self._connection()
+        counters = dict(conn.execute(f"SELECT name, value FROM {self.table}_counters").fetchall())
+        entries = conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "entries": entries,
+            "bytes": counters.get("bytes", 0),
+            "max_bytes": self.max_bytes,
+            "policy": self.policy,
+            "mmap_bytes": self.mmap_bytes,
+            "evictions": counters.get("evictions", 0),
+            "expirations": counters.get("expirations", 0)
+        }
+
+class RedisBackend:
+    """
+    Store shared through any server speaking the Redis protocol (Redis, KeyDB,
+    Dragonfly, or an in-process stand-in such as fakeredis passed as `client`).
+    Expiry uses native key TTLs; the size limit and LRU/LFU eviction are the
+    server's maxmemory / maxmemory-policy settings.
+    """
+    def __init__(self, url="redis://localhost:6379/0", prefix="cache", client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError as e:
+                raise RuntimeError("The redis cache backend requires the 'redis' package.") from e
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, cache_key):
+        return f"{self.prefix}:{cache_key}"
+
+    def get(self, cache_key):
+        payload = self.client.get(self._key(cache_key))
+        if payload is None:
+            return MISSING
+        return json.loads(payload)
+
+    def set(self, cache_key, value, payload, ttl):
+        if ttl is not None:
+            self.client.set(self._key(cache_key), payload, px=max(1, int(ttl * 1000)))
+        else:
+            self.client.set(self._key(cache_key), payload)
+        return True
+
+    def delete(self, cache_key):
+        self.client.delete(self._key(cache_key))
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=f"{self.prefix}:*", count=500))
+        for i in range(0, len(keys), 500):
+            self.client.delete(*keys[i:i + 500])
+
+    def stats(self):
+        stats = {"backend": "redis", "prefix": self.prefix}
+        try:
+            info = self.client.info()
+            stats.update({
+                "bytes": info.get("used_memory"),
+                "max_bytes": info.get("maxmemory"),
+                "policy": info.get("maxmemory_policy"),
+                "evictions": info.get("evicted_keys"),
+                "expirations": info.get("expired_keys")
+            })
+        except Exception as e:
+            stats["error"] = str(e)
+        return stats
+
+# --- Cache front end ---
+
+class ResultCache:
+    """
+    Result cache used by the API routes. Keys are namespaced and hashed, each
+    namespace has its own TTL (None means the entry never expires), and hits and
+    misses are counted per namespace. Storage is delegated to a backend; by default
+    a per-process MemoryBackend bounded by max_bytes.
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024, policy="lru", ttls=None, default_ttl=None, backend=None):
+        self.backend = backend or MemoryBackend(max_bytes=max_bytes, policy=policy)
+        self.ttls = dict(ttls or {})
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+        self._namespace_stats = {}
+
+    def get(self, namespace, key):
+        """Returns the cached value, or None on a miss."""
+        try:
+            value = self.backend.get(hash_key(namespace, key))
+        except Exception as e:
+            print(f"Cache read failed for namespace '{namespace}': {e}")
+            value = MISSING
+        self._count(namespace, "misses" if value is MISSING else "hits")
+        return None if value is MISSING else value
+
+    def set(self, namespace, key, value, ttl=NAMESPACE_TTL):
+        """Stores a value. Values larger than the whole cache are not stored."""
+        if ttl is NAMESPACE_TTL:
+            ttl = self.ttls.get(namespace, self.default_ttl)
+        try:
+            return self.backend.set(hash_key(namespace, key), value, encode_value(value), ttl)
+        except Exception as e:
+            print(f"Cache write failed for namespace '{namespace}': {e}")
+            return False
+
+    def delete(self, namespace, key):
+        self.backend.delete(hash_key(namespace, key))
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        """Returns hit/miss counters (this process) and backend usage and eviction counters."""
+        with self._lock:
+            stats = dict(self._stats, namespaces={name: dict(counts) for name, counts in self._namespace_stats.items()})
+        stats.update(self.backend.stats())
+        return stats
+
+    def _count(self, namespace, counter):
+        with self._lock:
+            self._stats[counter] += 1
+            counts = self._namespace_stats.setdefault(namespace, {"hits": 0, "misses": 0})
+            counts[counter] += 1
+
+def create_cache(prefix, ttls=None, default_ttl=None, max_bytes=64 * 1024 * 1024, policy="lru", backend="memory"):
+    """
+    Builds a ResultCache whose backend is chosen by environment variables named
+    after `prefix` (e.g. RESULTS_CACHE_BACKEND, RESULTS_CACHE_MAX_BYTES):
+      {prefix}_BACKEND     memory | sqlite | mmap | redis
+      {prefix}_MAX_BYTES   size limit for memory and sqlite/mmap backends
+      {prefix}_POLICY      lru | lfu
+      {prefix}_PATH        SQLite file (default: in the system temp directory)
+      {prefix}_MMAP_BYTES  memory-map size for the sqlite backend ('mmap' defaults it to max_bytes)
+      {prefix}_REDIS_URL   Redis-protocol server URL (falls back to REDIS_URL)
+    """
+    backend_name = os.environ.get(f"{prefix}_BACKEND", backend).strip().lower()
+    max_bytes = int(os.environ.get(f"{prefix}_MAX_BYTES", max_bytes))
+    policy = os.environ.get(f"{prefix}_POLICY", policy).strip().lower()
+
+    if backend_name in ("sqlite", "mmap"):
+        path = os.environ.get(f"{prefix}_PATH", os.path.join(tempfile.gettempdir(), "seo_analyzer_cache.sqlite3"))
+        mmap_bytes = int(os.environ.get(f"{prefix}_MMAP_BYTES", max_bytes if backend_name == "mmap" else 0))
+        storage = SQLiteBackend(path, table=prefix.lower(), max_bytes=max_bytes, policy=policy, mmap_bytes=mmap_bytes)
+    elif backend_name == "redis":
+        url = os.environ.get(f"{prefix}_REDIS_URL", os.environ.get("REDIS_URL", "redis://localhost:6379/0"))
+        storage = RedisBackend(url=url, prefix=prefix.lower())
+    else:
+        if backend_name != "memory":
+            print(f"Warning: Unknown cache backend '{backend_name}' for {prefix}. Using in-memory cache.")
+        storage = MemoryBackend(max_bytes=max_bytes, policy=policy)
+
+    return ResultCache(ttls=ttls, default_ttl=default_ttl, backend=storage)
@@ -0,0 +1,257 @@
+import asyncio
+import email.utils
+import json
+import os
+import random
+import threading
+import time
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from utils.async_runtime import get_http_session
+from utils.rate_limiter import get_limiter, estimate_tokens, RateLimitTimeout
+
+GEMINI_API_BASE = os.environ.get("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta")
+
+# Deadlines, in seconds. A hung upstream call gives up well before the gunicorn worker timeout.
+GEMINI_CONNECT_TIMEOUT = float(os.environ.get("GEMINI_CONNECT_TIMEOUT", 5))
+GEMINI_READ_TIMEOUT = float(os.environ.get("GEMINI_READ_TIMEOUT", 60))
+GEMINI_DEADLINE = float(os.environ.get("GEMINI_DEADLINE", 120)) # whole call, retries included
+
+# Retries: capped exponential backoff with full jitter; Retry-After wins when the server sends it
+GEMINI_MAX_RETRIES = int(os.environ.get("GEMINI_MAX_RETRIES", 3))
+GEMINI_BACKOFF_BASE = float(os.environ.get("GEMINI_BACKOFF_BASE", 0.5))
+GEMINI_BACKOFF_MAX = float(os.environ.get("GEMINI_BACKOFF_MAX", 8))
+GEMINI_POOL_SIZE = int(os.environ.get("GEMINI_POOL_SIZE", 16))
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+class GeminiError(Exception):
+    """A Gemini request that failed for good (after retries, or with a non-retryable status)."""
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+class _RetryableError(Exception):
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+_session_lock = threading.Lock()
+_session = None
+_session_pid = None
+
+def get_session():
+    """Returns the pooled requests.Session of this worker process (re-created after a fork)."""
+    global _session, _session_pid
+    if _session is not None and _session_pid == os.getpid():
+        return _session
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=GEMINI_POOL_SIZE, max_retries=0)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({"Content-Type": "application/json"})
+            _session = session
+            _session_pid = os.getpid()
+    return _session
+
+def get_api_key(api_key=None):
+    api_key = api_key or os.environ.get("GEMINI_API_KEY")
+    if not api_key:
+        raise GeminiError("GEMINI_API_KEY environment variable not set.")
+    return api_key
+
+def build_payload(prompt, generation_config=None):
+    payload = {"contents": [{"role": "user", "parts": [{"text": prompt}]}]}
+    if generation_config:
+        payload["generationConfig"] = generation_config
+    return payload
+
+def model_url(model, method="generateContent"):
+    return f"{GEMINI_API_BASE}/models/{model}:{method}"
+
+def extract_text(result):
+    """Text of the first candidate, or None when the response has none (blocked, empty...)."""
+    try:
+        parts = result["candidates"][0]["content"]["parts"]
+    except (KeyError, IndexError, TypeError):
+        return None
+    text = "".join(part.get("text", "") for part in parts if isinstance(part, dict))
+    return text or None
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+def backoff_delay(attempt, retry_after=None):
+    """Full-jitter exponential backoff, capped at GEMINI_BACKOFF_MAX; at least Retry-After."""
+    delay = random.uniform(0, min(GEMINI_BACKOFF_MAX, GEMINI_BACKOFF_BASE * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+def _check_status(status, headers, body):
+    if status == 200:
+        return
+    message = f"Gemini API returned HTTP {status}: {body[:300]}"
+    if status in RETRYABLE_STATUS:
+        raise _RetryableError(message, status, parse_retry_after(headers.get("Retry-After")))
+    raise GeminiError(message, status)
+
+def _next_delay(error, attempt, deadline, limiter):
+    """Delay before the next attempt, or None when retries or the deadline are used up."""
+    if error.status == 429:
+        # Out of quota: hold every caller of this key and model, not just this one
+        limiter.pause(error.retry_after if error.retry_after is not None else backoff_delay(attempt))
+    if attempt >= GEMINI_MAX_RETRIES:
+        return None
+    delay = backoff_delay(attempt, error.retry_after)
+    if time.monotonic() + delay >= deadline:
+        return None
+    return delay
+
+def _timeouts(deadline):
+    remaining = max(0.1, deadline - time.monotonic())
+    return min(GEMINI_CONNECT_TIMEOUT, remaining), min(GEMINI_READ_TIMEOUT, remaining)
+
+def generate_content(model, prompt, generation_config=None, api_key=None):
+    """
+    Sends a generateContent request over the pooled session and returns the
+    response text (None when the model returned no text).
+    Raises GeminiError once retries or the GEMINI_DEADLINE budget are exhausted.
+    """
+    url = model_url(model)
+    params = {"key": get_api_key(api_key)}
+    body = json.dumps(build_payload(prompt, generation_config))
+    limiter = get_limiter("gemini", params["key"], model)
+    deadline = time.monotonic() + GEMINI_DEADLINE
+    attempt = 0
+    while True:
+        try:
+            limiter.acquire(estimate_tokens(prompt), timeout=max(0.0, deadline - time.monotonic()))
+        except RateLimitTimeout as e:
+            raise GeminiError(str(e), 429)
+        try:
+            response = get_session().post(url, params=params, data=body, timeout=_timeouts(deadline))
+            _check_status(response.status_code, response.headers, response.text)
+            return extract_text(response.json())
+        except requests.exceptions.Timeout as e:
+            error = _RetryableError(f"Gemini API request timed out: {e}")
+        except requests.exceptions.RequestException as e:
+            error = _RetryableError(f"Gemini API request failed: {e}")
+        except ValueError as e:
+            error = _RetryableError(f"Gemini API returned invalid JSON: {e}")
+        except _RetryableError as e:
+            error = e
+        delay = _next_delay(error, attempt, deadline, limiter)
+        if delay is None:
+            raise GeminiError(str(error), error.status)
+        attempt += 1
+        print(f"{error}. Retrying {attempt}/{GEMINI_MAX_RETRIES} in {delay:.1f}s...")
+        time.sleep(delay)
+
+async def generate_content_async(model, prompt, generation_config=None, api_key=None):
+    """
+    Async version of generate_content() over the pooled aiohttp session.
+    Must be awaited on the async runtime's loop (see utils.async_runtime.run_coroutine).
+    """
+    url = model_url(model)
+    params = {"key": get_api_key(api_key)}
+    body = json.dumps(build_payload(prompt, generation_config))
+    limiter = get_limiter("gemini", params["key"], model)
+    deadline = time.monotonic() + GEMINI_DEADLINE
+    attempt = 0
+    while True:
+        try:
+            await limiter.acquire_async(estimate_tokens(prompt), timeout=max(0.0, deadline - time.monotonic()))
+        except RateLimitTimeout as e:
+            raise GeminiError(str(e), 429)
+        connect_timeout, read_timeout = _timeouts(deadline)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout)
+        try:
+            session = await get_http_session()
+            async with session.post(url, params=params, data=body, timeout=timeout,
+                                    headers={"Content-Type": "application/json"}) as response:
+                text = await response.text()
+                _check_status(response.status, response.headers, text)
+                return extract_text(json.loads(text))
+        except asyncio.TimeoutError as e:
+            error = _RetryableError(f"Gemini API request timed out: {e}")
+        except aiohttp.ClientError as e:
+            error = _RetryableError(f"Gemini API request failed: {e}")
+        except ValueError as e:
+            error = _RetryableError(f"Gemini API returned invalid JSON: {e}")
+        except _RetryableError as e:
+            error = e
+        delay = _next_delay(error, attempt, deadline, limiter)
+        if delay is None:
+            raise GeminiError(str(error), error.status)
+        attempt += 1
+        print(f"{error}. Retrying {attempt}/{GEMINI_MAX_RETRIES} in {delay:.1f}s...")
+        await asyncio.sleep(delay)
+
+def stream_generate_content(model, prompt, generation_config=None, api_key=None):
+    """
+    Yields the response text chunk by chunk as the model generates it
+    (streamGenerateContent with alt=sse). Failures before the first chunk are
+    retried like generate_content(); once text has been yielded a failure
+    raises GeminiError, since the partial answer cannot be taken back.
+    """
+    url = model_url(model, "streamGenerateContent")
+    params = {"key": get_api_key(api_key), "alt": "sse"}
+    body = json.dumps(build_payload(prompt, generation_config))
+    limiter = get_limiter("gemini", params["key"], model)
+    deadline = time.monotonic() + GEMINI_DEADLINE
+    attempt = 0
+    started = False
+    while True:
+        try:
+            limiter.acquire(estimate_tokens(prompt), timeout=max(0.0, deadline - time.monotonic()))
+        except RateLimitTimeout as e:
+            raise GeminiError(str(e), 429)
+        try:
+            # The read timeout applies between chunks, so a long answer is not cut off while it flows
+            response = get_session().post(url, params=params, data=body, timeout=_timeouts(deadline), stream=True)
+            try:
+                _check_status(response.status_code, response.headers, "" if response.status_code == 200 else response.text)
+                for line in response.iter_lines():
+                    # SSE is UTF-8; don't let requests guess a charset from the content type
+                    line = line.decode('utf-8')
+                    if not line.startswith("data:"):
+                        continue
+                    text = extract_text(json.loads(line[5:]))
+                    if text:
+                        started = True
+                        yield text
+                return
+            finally:
+                response.close()
+        except requests.exceptions.Timeout as e:
+            error = _RetryableError(f"Gemini API request timed out: {e}")
+        except requests.exceptions.RequestException as e:
+            error = _RetryableError(f"Gemini API request failed: {e}")
+        except ValueError as e:
+            error = _RetryableError(f"Gemini API returned invalid JSON: {e}")
+        except _RetryableError as e:
+            error = e
+        delay = None if started else _next_delay(error, attempt, deadline, limiter)
+        if delay is None:
+            raise GeminiError(str(error), error.status)
+        attempt += 1
+        print(f"{error}. Retrying {attempt}/{GEMINI_MAX_RETRIES} in {delay:.1f}s...")
+        time.sleep(delay)
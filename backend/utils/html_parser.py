@@ -1 +1,324 @@
+import html
+import os
+import sys
+from html.parser import HTMLParser
 
+HEADING_TAGS = ('h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+# Text inside these tags is not visible page text (BeautifulSoup's get_text() skips it too)
+NON_TEXT_TAGS = ('script', 'style', 'template', 'rt', 'rp')
+# Tags whose class attribute is kept for the UX navigation/contact checks
+CLASS_TRACKED_TAGS = ('a', 'form', 'nav', 'ul', 'ol')
+# Tags that may appear before the body without starting it; any other tag, or visible
+# text, implies <body> the way libxml2 does, so body-less pages get the same body text
+HEAD_TAGS = ('html', 'head', 'body', 'title', 'meta', 'link', 'style', 'script', 'base', 'noscript', 'template',
+             'frameset', 'frame', 'noframes')
+# Elements whose content is text, not markup; entities are decoded in the first two only
+RCDATA_TAGS = ('title', 'textarea')
+RAW_TEXT_TAGS = RCDATA_TAGS + ('xmp', 'iframe', 'noembed', 'noframes')
+# Tokenizer backends in order of preference; the first importable one is used
+# unless HTML_PARSER_BACKEND names a specific backend. Both give the same features
+# on the parity corpus (python -m utils.html_parser).
+PARSER_BACKENDS = ('lxml', 'html.parser')
+# Fields compared by the parity check; these are the ones that feed scores
+PARITY_FIELDS = ('title', 'meta', 'headings', 'links', 'images', 'tag_classes', 'text', 'body_text', 'scripts', 'stylesheets')
+
+class PageFeatures:
+    """Compact record of everything the analyzers need from a page's HTML."""
+    __slots__ = ('title', 'meta', 'headings', 'links', 'images', 'tag_classes', 'text', 'body_text', 'scripts', 'stylesheets')
+
+    def __init__(self):
+        self.title = None       # Text of the first <title>, or None
+        self.meta = {}          # <meta name=...> -> content (first occurrence wins)
+        self.headings = {}      # 'h1'..'h6' -> list of heading texts, in document order
+        self.links = []         # href of every <a href>, as written
+        self.images = []        # (src, alt) of every <img>; None when the attribute is absent
+        self.tag_classes = []   # (tag, class attribute) for tags in CLASS_TRACKED_TAGS
+        self.text = ""          # Visible text of the whole document
+        self.body_text = None   # Visible text inside <body>, or None when there is no <body>
+        self.scripts = []       # (src, render_blocking) of every <script src>
+        self.stylesheets = []   # (href, render_blocking) of every <link rel=stylesheet>
+
+    @property
+    def has_viewport_meta(self):
+        return 'viewport' in self.meta
+
+    def to_dict(self):
+        """JSON-serializable form, used to store an extraction for later reuse."""
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        features = cls()
+        for field in cls.__slots__:
+            if field in data:
+                setattr(features, field, data[field])
+        # JSON turns tuples into lists
+        features.images = [tuple(image) for image in features.images]
+        features.tag_classes = [tuple(item) for item in features.tag_classes]
+        features.scripts = [tuple(item) for item in features.scripts]
+        features.stylesheets = [tuple(item) for item in features.stylesheets]
+        return features
+
+class _FeatureCollector:
+    """
+    Turns a stream of start/end/data events into a PageFeatures record.
+    Text handling mirrors BeautifulSoup's get_text(separator=' ', strip=True) for
+    whole-document and body text, and get_text(strip=True) for titles and headings.
+    """
+    def __init__(self):
+        self.features = PageFeatures()
+        self._open = {}          # tag -> number of currently open elements
+        self._pending = []       # Text chunks of the current text node
+        self._text_parts = []
+        self._body_parts = None
+        self._title_parts = None
+        self._open_headings = [] # Stack of (tag, parts)
+
+    def start(self, tag, attrs):
+        self._flush()
+        if self._body_parts is None and tag not in HEAD_TAGS:
+            self._start_body()
+        self._open[tag] = self._open.get(tag, 0) + 1
+        if tag == 'body' and self._body_parts is None:
+            self._body_parts = []
+        elif tag == 'title' and self.features.title is None and self._title_parts is None:
+            self._title_parts = []
+        elif tag in HEADING_TAGS:
+            self._open_headings.append((tag, []))
+        elif tag == 'meta':
+            name = attrs.get('name')
+            if name is not None and name not in self.features.meta:
+                self.features.meta[name] = attrs.get('content')
+        elif tag == 'img':
+            self.features.images.append((attrs.get('src'), attrs.get('alt')))
+        elif tag == 'script' and attrs.get('src'):
+            # A classic script before the body without async/defer blocks rendering (modules are deferred)
+            blocking = self._body_parts is None and \
+                'async' not in attrs and 'defer' not in attrs and attrs.get('type', '').lower() != 'module'
+            self.features.scripts.append((attrs['src'], blocking))
+        elif tag == 'link' and attrs.get('href') and 'stylesheet' in attrs.get('rel', '').lower().split():
+            # Stylesheets block rendering unless their media query excludes the screen
+            media = attrs.get('media', '').strip().lower()
+            self.features.stylesheets.append((attrs['href'], media in ('', 'all', 'screen')))
+
+        if tag == 'a' and 'href' in attrs:
+            self.features.links.append(attrs['href'] or '')
+        if tag in CLASS_TRACKED_TAGS and attrs.get('class'):
+            self.features.tag_classes.append((tag, attrs['class']))
+
+    def end(self, tag):
+        self._flush()
+        if not self._open.get(tag):
+            return # Stray end tag
+        self._open[tag] -= 1
+        if tag == 'title' and self._title_parts is not None:
+            self.features.title = ''.join(self._title_parts)
+            self._title_parts = None
+        elif tag in HEADING_TAGS:
+            for i in range(len(self._open_headings) - 1, -1, -1):
+                if self._open_headings[i][0] == tag:
+                    self._close_heading(self._open_headings.pop(i))
+                    break
+
+    def data(self, data):
+        self._pending.append(data)
+
+    def close(self):
+        self._flush()
+        if self._title_parts is not None:
+            self.features.title = ''.join(self._title_parts)
+        while self._open_headings:
+            self._close_heading(self._open_headings.pop(0))
+        self.features.text = ' '.join(self._text_parts)
+        if self._body_parts is not None:
+            self.features.body_text = ' '.join(self._body_parts)
+        return self.features
+
+    def _start_body(self):
+        """Opens the <body> that a body-only tag or visible text implies."""
+        self._body_parts = []
+        self._open['body'] = self._open.get('body', 0) + 1
+
+    def _close_heading(self, heading):
+        tag, parts = heading
+        self.features.headings.setdefault(tag, []).append(''.join(parts))
+
+    def _flush(self):
+        if not self._pending:
+            return
+        text = ''.join(self._pending).strip()
+        self._pending = []
+        if not text or any(self._open.get(tag) for tag in NON_TEXT_TAGS):
+            return
+        if self._body_parts is None and self._title_parts is None:
+            self._start_body()
+        self._text_parts.append(text)
+        if self._body_parts is not None and self._open.get('body'):
+            self._body_parts.append(text)
+        if self._title_parts is not None:
+            self._title_parts.append(text)
+        for _, parts in self._open_headings:
+            parts.append(text)
+
+class PageFeatureExtractor(HTMLParser):
+    """
+    Streaming, single-pass extractor built on the standard library tokenizer.
+    Feed it HTML in one or more chunks, then call close() to get the PageFeatures.
+    No document tree is built.
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._collector = _FeatureCollector()
+        self._raw_tag = None   # Raw-text element being read, as libxml2 reads it
+        self._raw_parts = []
+
+    def handle_starttag(self, tag, attrs):
+        self._collector.start(tag, {name: (value if value is not None else '') for name, value in attrs})
+        if tag in RAW_TEXT_TAGS and self._raw_tag is None:
+            self.set_cdata_mode(tag)
+            self._raw_tag = tag
+
+    def handle_endtag(self, tag):
+        if tag == self._raw_tag:
+            self._end_raw_text()
+        self._collector.end(tag)
+
+    def handle_data(self, data):
+        if self._raw_tag is not None:
+            self._raw_parts.append(data)
+        else:
+            self._collector.data(data)
+
+    def _end_raw_text(self):
+        text = ''.join(self._raw_parts)
+        # Newer Pythons decode entities in <title>/<textarea> themselves
+        if self._raw_tag in RCDATA_TAGS and self._raw_tag not in getattr(HTMLParser, 'RCDATA_CONTENT_ELEMENTS', ()):
+            text = html.unescape(text)
+        self._raw_tag = None
+        self._raw_parts = []
+        self._collector.data(text)
+
+    def close(self):
+        if self._raw_tag is not None:
+            # An unclosed raw-text element runs to the end of the document
+            self.feed(f'</{self._raw_tag}>')
+        super().close()
+        return self._collector.close()
+
+class _LxmlTarget(_FeatureCollector):
+    """Parser target for lxml: libxml2 tokenizes in C and calls start/end/data directly."""
+    def start(self, tag, attrib):
+        super().start(tag, {name: (value if value is not None else '') for name, value in attrib.items()})
+
+class LxmlFeatureExtractor:
+    """Same interface as PageFeatureExtractor, backed by lxml's event (target) parser."""
+    def __init__(self):
+        from lxml import etree
+        self._parser = etree.HTMLParser(target=_LxmlTarget(), recover=True)
+
+    def feed(self, data):
+        self._parser.feed(data)
+
+    def close(self):
+        return self._parser.close()
+
+_EXTRACTORS = {
+    'lxml': LxmlFeatureExtractor,
+    'html.parser': PageFeatureExtractor,
+}
+
+def is_backend_available(backend):
+    """Checks whether the given tokenizer backend can be used in this environment."""
+    if backend == 'html.parser':
+        return True
+    if backend == 'lxml':
+        try:
+            import lxml.etree # noqa: F401
+            return True
+        except ImportError:
+            return False
+    return False
+
+_selected_backend = None
+
+def get_parser_backend():
+    """
+    Returns the tokenizer backend to use. HTML_PARSER_BACKEND=lxml|html.parser forces a
+    backend (falling back to html.parser if it is not installed); the default 'auto'
+    picks the fastest available one (lxml when it can be imported).
+    """
+    global _selected_backend
+    if _selected_backend is None:
+        requested = os.environ.get("HTML_PARSER_BACKEND", "auto").strip().lower()
+        if requested in _EXTRACTORS and is_backend_available(requested):
+            _selected_backend = requested
+        else:
+            if requested not in ("auto", ""):
+                print(f"Warning: HTML parser backend '{requested}' is not available. Falling back to automatic selection.")
+            _selected_backend = next(backend for backend in PARSER_BACKENDS if is_backend_available(backend))
+    return _selected_backend
+
+def extract_page_features(html, chunk_size=65536, backend=None):
+    """
+    Extracts title, meta tags, headings, links, images and visible text from HTML
+    in a single pass. Accepts a string or an iterable of string chunks.
+    """
+    extractor = _EXTRACTORS[backend or get_parser_backend()]()
+    if isinstance(html, str):
+        for i in range(0, len(html), chunk_size):
+            extractor.feed(html[i:i + chunk_size])
+    else:
+        for chunk in html:
+            extractor.feed(chunk)
+    return extractor.close()
+
+def compare_parser_backends(html, backends=None):
+    """
+    Extracts the same document with every available backend and returns the fields
+    whose values differ from html.parser, as {backend: {field: (expected, actual)}}.
+    An empty dict means the backends are interchangeable for this document.
+    """
+    backends = [b for b in (backends or PARSER_BACKENDS) if is_backend_available(b)]
+    reference = extract_page_features(html, backend='html.parser')
+    differences = {}
+    for backend in backends:
+        if backend == 'html.parser':
+            continue
+        features = extract_page_features(html, backend=backend)
+        diff = {}
+        for field in PARITY_FIELDS:
+            expected, actual = getattr(reference, field), getattr(features, field)
+            if expected != actual:
+                diff[field] = (expected, actual)
+        if diff:
+            differences[backend] = diff
+    return differences
+
+def check_parser_parity(corpus_dir=None):
+    """
+    Runs compare_parser_backends over every .html file of the parity corpus.
+    Returns {file name: differences} for the documents that do not match.
+    """
+    corpus_dir = corpus_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'parser_corpus')
+    mismatches = {}
+    for name in sorted(os.listdir(corpus_dir)):
+        if not name.endswith('.html'):
+            continue
+        with open(os.path.join(corpus_dir, name), encoding='utf-8') as f:
+            differences = compare_parser_backends(f.read())
+        if differences:
+            mismatches[name] = differences
+    return mismatches
+
+if __name__ == '__main__':
+    # Usage: python -m utils.html_parser [corpus_dir]
+    # Run before switching HTML_PARSER_BACKEND in production; exits non-zero on any mismatch.
+    available = [b for b in PARSER_BACKENDS if is_backend_available(b)]
+    print(f"Available backends: {', '.join(available)}")
+    mismatches = check_parser_parity(sys.argv[1] if len(sys.argv) > 1 else None)
+    for name, differences in mismatches.items():
+        for backend, diff in differences.items():
+            for field, (expected, actual) in diff.items():
+                print(f"{name} [{backend}] {field}: expected {expected!r}, got {actual!r}")
+    print("Parity OK" if not mismatches else f"{len(mismatches)} document(s) differ")
+    sys.exit(1 if mismatches else 0)
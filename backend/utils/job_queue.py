@@ -0,0 +1,268 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+JOB_QUEUE_PATH = os.environ.get("JOB_QUEUE_PATH", os.path.join(tempfile.gettempdir(), "seo_analyzer_jobs.sqlite3"))
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+# Queued + running jobs accepted before submit() starts refusing work (backpressure)
+JOB_QUEUE_MAX_PENDING = int(os.environ.get("JOB_QUEUE_MAX_PENDING", 100))
+# A running job whose lease expires (worker crashed or was restarted) is picked up again
+JOB_LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", 600))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 2))
+# Finished and failed jobs are kept this long for polling, in seconds
+JOB_RETENTION_SECONDS = int(os.environ.get("JOB_RETENTION_SECONDS", 24 * 3600))
+
+JOB_STATUSES = ("queued", "running", "done", "failed")
+
+class QueueFullError(Exception):
+    """Raised by submit() when the queue already holds max_pending unfinished jobs."""
+
+class LeaseLostError(Exception):
+    """Raised inside a handler's report() once its job was reclaimed by another worker."""
+
+class JobQueue:
+    """
+    Persistent job queue stored in SQLite, so submitted work survives restarts.
+    Jobs are claimed with a lease inside a BEGIN IMMEDIATE transaction, which makes
+    claiming safe across threads and across gunicorn worker processes sharing the file.
+
+    Handlers are registered per job kind and called as handler(payload, report),
+    where report(section, data) records a partial result while the job runs.
+    """
+    def __init__(self, path=JOB_QUEUE_PATH, workers=JOB_WORKERS, max_pending=JOB_QUEUE_MAX_PENDING,
+                 lease_seconds=JOB_LEASE_SECONDS, max_attempts=JOB_MAX_ATTEMPTS, retention_seconds=JOB_RETENTION_SECONDS):
+        self.path = path
+        self.workers = workers
+        self.max_pending = max_pending
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        self._handlers = {}
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._start_lock = threading.Lock()
+        self._threads = []
+        self._owner_pid = None
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, "
+                "status TEXT NOT NULL, partial TEXT, result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+                "created_at REAL NOT NULL, started_at REAL, finished_at REAL, lease_expires_at REAL, worker TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    def _connection(self):
+        # One connection per thread and per process (connections must not cross a fork)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def register(self, kind, handler):
+        """Registers the function that processes jobs of the given kind."""
+        self._handlers[kind] = handler
+
+    def _running(self):
+        return self._owner_pid == os.getpid() and len(self._threads) == self.workers and \
+            all(thread.is_alive() for thread in self._threads)
+
+    def start(self):
+        """Starts the worker threads of this process (again after a fork, or after a worker died)."""
+        if self.workers <= 0 or self._running():
+            return
+        with self._start_lock:
+            if self._running():
+                return
+            if self._owner_pid != os.getpid():
+                self._owner_pid = os.getpid()
+                self._threads = [None] * self.workers
+            for i, thread in enumerate(self._threads):
+                if thread is not None and thread.is_alive():
+                    continue
+                if thread is not None:
+                    print(f"Job worker {i} died; restarting it.")
+                thread = threading.Thread(target=self._work, args=(f"{os.getpid()}-{i}",), name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads[i] = thread
+
+    def submit(self, kind, payload):
+        """Queues a job and returns its id. Raises QueueFullError when the queue is at capacity."""
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        self.start()
+        job_id = uuid.uuid4().hex
+        with self._transaction() as conn:
+            pending = conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+            if pending >= self.max_pending:
+                raise QueueFullError(f"The job queue is full ({pending} pending jobs). Please retry later.")
+            conn.execute(
+                "INSERT INTO jobs (id, kind, payload, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+                (job_id, kind, json.dumps(payload, ensure_ascii=False), time.time())
+            )
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        """Returns the job's status, partial and final results, or None if it does not exist."""
+        self.start()
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT id, kind, status, partial, result, error, attempts, created_at, started_at, finished_at FROM jobs WHERE id = ?",
+            (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        job_id, kind, status, partial, result, error, attempts, created_at, started_at, finished_at = row
+        job = {
+            "id": job_id,
+            "kind": kind,
+            "status": status,
+            "attempts": attempts,
+            "created_at": created_at,
+            "started_at": started_at,
+            "finished_at": finished_at,
+            "partial": json.loads(partial) if partial else {},
+            "result": json.loads(result) if result else None,
+            "error": error
+        }
+        if status == "queued":
+            job["position"] = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at < ?", (created_at,)
+            ).fetchone()[0] + 1
+        return job
+
+    def stats(self):
+        """Returns the number of jobs per status and the configured limits."""
+        counts = dict(self._connection().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {
+            "jobs": {status: counts.get(status, 0) for status in JOB_STATUSES},
+            "max_pending": self.max_pending,
+            "workers": self.workers
+        }
+
+    def _claim(self, worker):
+        """
+        Atomically takes the oldest queued job, or a running one whose lease expired.
+        Returns (job_id, kind, payload, lease); the lease is (worker, attempt), which
+        identifies this claim and no later one.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Job was interrupted too many times.', finished_at = ? "
+                "WHERE status = 'running' AND lease_expires_at < ? AND attempts >= ?",
+                (now, now, self.max_attempts)
+            )
+            row = conn.execute(
+                "SELECT id, kind, payload, attempts FROM jobs WHERE status = 'queued' OR (status = 'running' AND lease_expires_at < ?) "
+                "ORDER BY created_at LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, lease_expires_at = ?, worker = ? WHERE id = ?",
+                (now, now + self.lease_seconds, worker, row[0])
+            )
+        return row[0], row[1], json.loads(row[2]), (worker, row[3] + 1)
+
+    def _report(self, job_id, lease, section, data):
+        # Every progress report also renews the lease of the running job, as long as this claim still owns it
+        worker, attempt = lease
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT partial FROM jobs WHERE id = ? AND status = 'running' AND worker = ? AND attempts = ?",
+                (job_id, worker, attempt)
+            ).fetchone()
+            if row is None:
+                raise LeaseLostError(f"Job {job_id} was reclaimed by another worker.")
+            partial = json.loads(row[0]) if row[0] else {}
+            partial[section] = data
+            conn.execute(
+                "UPDATE jobs SET partial = ?, lease_expires_at = ? WHERE id = ?",
+                (json.dumps(partial, ensure_ascii=False, default=str), time.time() + self.lease_seconds, job_id)
+            )
+
+    def _finish(self, job_id, lease, result=None, error=None):
+        """
+        Stores the outcome, unless the lease expired and the job now belongs to another claim.
+        A database error is logged, not raised: the lease then expires and the job is retried.
+        """
+        status = "failed" if error is not None else "done"
+        worker, attempt = lease
+        try:
+            self._store_outcome(job_id, worker, attempt, status, result, error)
+        except sqlite3.Error as e:
+            print(f"Job queue error while finishing job {job_id}: {e}")
+
+    def _store_outcome(self, job_id, worker, attempt, status, result, error):
+        with self._transaction() as conn:
+            updated = conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, lease_expires_at = NULL "
+                "WHERE id = ? AND status = 'running' AND worker = ? AND attempts = ?",
+                (status, json.dumps(result, ensure_ascii=False, default=str) if error is None else None, error, time.time(),
+                 job_id, worker, attempt)
+            ).rowcount
+        if not updated:
+            print(f"Job {job_id} was reclaimed by another worker; dropping this worker's outcome.")
+
+    def _purge(self):
+        with self._transaction() as conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                (time.time() - self.retention_seconds,)
+            )
+
+    def _work(self, worker):
+        last_purge = 0
+        while True:
+            try:
+                if time.time() - last_purge > 3600:
+                    self._purge()
+                    last_purge = time.time()
+                claimed = self._claim(worker)
+            except sqlite3.Error as e:
+                print(f"Job queue error: {e}")
+                claimed = None
+            if claimed is None:
+                # Woken up early by submit() in this process; other processes are seen on the next poll
+                self._wakeup.wait(timeout=2)
+                self._wakeup.clear()
+                continue
+
+            job_id, kind, payload, lease = claimed
+            handler = self._handlers.get(kind)
+            try:
+                if handler is None:
+                    raise ValueError(f"No handler registered for job kind '{kind}'.")
+                result = handler(payload, lambda section, data: self._report(job_id, lease, section, data))
+            except LeaseLostError as e:
+                print(f"Job {job_id} ({kind}) abandoned: {e}")
+                continue
+            except Exception as e:
+                # Includes a report() that hit a database error: the job fails instead of the worker
+                print(f"Job {job_id} ({kind}) failed: {e}")
+                self._finish(job_id, lease, error=str(e))
+                continue
+            self._finish(job_id, lease, result=result)
@@ -0,0 +1,146 @@
+import asyncio
+import os
+from urllib.parse import urljoin, urlsplit, urlunsplit
+import aiohttp
+from utils.async_runtime import run_coroutine, get_http_session
+from utils.cache import create_cache
+
+LINK_CHECK_CONCURRENCY = int(os.environ.get("LINK_CHECK_CONCURRENCY", 32))
+LINK_CHECK_PER_HOST = int(os.environ.get("LINK_CHECK_PER_HOST", 4))
+LINK_CHECK_TIMEOUT = float(os.environ.get("LINK_CHECK_TIMEOUT", 5))
+
+# How long each outcome is trusted. Broken links and network failures are cached
+# too (negative caching), but for less time so a recovered site is re-checked soon.
+LINK_CACHE_TTLS = {
+    "ok": int(os.environ.get("LINK_CACHE_OK_TTL", 6 * 3600)),
+    "broken": int(os.environ.get("LINK_CACHE_BROKEN_TTL", 3600)),
+    "timeout": int(os.environ.get("LINK_CACHE_TIMEOUT_TTL", 300)),
+    "error": int(os.environ.get("LINK_CACHE_ERROR_TTL", 300)),
+    # The site throttled the checker; says nothing about the link, so retry soon
+    "rate_limited": int(os.environ.get("LINK_CACHE_RATE_LIMITED_TTL", 60)),
+}
+
+# Shared by every analyzer in the process (or across workers with LINK_CACHE_BACKEND=sqlite|redis)
+link_cache = create_cache("LINK_CACHE", default_ttl=LINK_CACHE_TTLS["ok"], max_bytes=8 * 1024 * 1024)
+
+# HEAD answers that do not prove a link is broken; confirm them with a ranged GET
+HEAD_FALLBACK_STATUSES = (403, 404, 405, 429, 500, 501, 503)
+
+def normalize_url(href, base_url):
+    """
+    Resolves href against base_url and normalizes it for deduplication:
+    lower-case scheme and host, default ports and fragments dropped.
+    Returns None for empty, fragment-only and non-HTTP(S) links (mailto:, tel:, javascript:).
+    """
+    href = (href or '').strip()
+    if not href or href.startswith('#'):
+        return None
+    parts = urlsplit(urljoin(base_url, href))
+    scheme = parts.scheme.lower()
+    if scheme not in ('http', 'https') or not parts.hostname:
+        return None
+    try:
+        port = parts.port
+    except ValueError:
+        return None
+    host = parts.hostname.lower()
+    if ':' in host:
+        host = f"[{host}]" # IPv6 literal
+    if port and port != (443 if scheme == 'https' else 80):
+        host = f"{host}:{port}"
+    return urlunsplit((scheme, host, parts.path or '/', parts.query, ''))
+
+def link_result(url, status=None, outcome="ok", error=None):
+    """Builds the per-link status record returned by check_links()."""
+    return {"url": url, "status": status, "ok": outcome == "ok", "outcome": outcome, "error": error}
+
+def is_broken(result):
+    """True for links that failed; rate-limited links are unknown, not broken."""
+    return result["outcome"] not in ("ok", "rate_limited")
+
+def _status_outcome(status, retry_after):
+    if status < 400:
+        return "ok"
+    # 429, or 503 with Retry-After: the server is throttling us, not reporting a dead link
+    if status == 429 or (status == 503 and retry_after):
+        return "rate_limited"
+    return "broken"
+
+async def _request_status(session, method, url, headers=None):
+    timeout = aiohttp.ClientTimeout(total=LINK_CHECK_TIMEOUT)
+    async with session.request(method, url, headers=headers, allow_redirects=True, timeout=timeout) as response:
+        return response.status, response.headers.get('Retry-After')
+
+async def check_link(session, url):
+    """
+    Checks one normalized URL: HEAD first, then a one-byte ranged GET when the
+    HEAD fails or is refused, since many servers mishandle HEAD.
+    """
+    status = retry_after = None
+    try:
+        status, retry_after = await _request_status(session, 'HEAD', url)
+        if status < 400:
+            return link_result(url, status)
+    except asyncio.TimeoutError:
+        return link_result(url, outcome="timeout", error="Timed out")
+    except aiohttp.ClientError:
+        pass # Retry with GET below
+
+    if status is not None and status not in HEAD_FALLBACK_STATUSES:
+        return link_result(url, status, outcome=_status_outcome(status, retry_after))
+    try:
+        status, retry_after = await _request_status(session, 'GET', url, headers={'Range': 'bytes=0-0'})
+        return link_result(url, status, outcome=_status_outcome(status, retry_after))
+    except asyncio.TimeoutError:
+        return link_result(url, outcome="timeout", error="Timed out")
+    except aiohttp.ClientError as e:
+        return link_result(url, outcome="error", error=str(e) or e.__class__.__name__)
+
+async def check_links_async(urls, concurrency=None, per_host=None, use_cache=True):
+    """
+    Checks a list of normalized URLs over the shared connection pool.
+    Duplicates are checked once and recent results are served from link_cache;
+    at most `concurrency` requests run at a time and at most `per_host` against
+    any single host. Returns {url: status record}.
+    """
+    urls = list(dict.fromkeys(urls))
+    cached = {}
+    if use_cache:
+        # On a worker thread: a SQLite/Redis link_cache must not block the shared event loop
+        cached = await asyncio.to_thread(_cached_statuses, urls)
+        urls = [url for url in urls if url not in cached]
+    if not urls:
+        return cached
+    session = await get_http_session()
+    global_limit = asyncio.Semaphore(concurrency or LINK_CHECK_CONCURRENCY)
+    host_limits = {}
+
+    async def run(url):
+        host = urlsplit(url).netloc
+        host_limit = host_limits.setdefault(host, asyncio.Semaphore(per_host or LINK_CHECK_PER_HOST))
+        async with host_limit, global_limit:
+            try:
+                return await check_link(session, url)
+            except Exception as e:
+                return link_result(url, outcome="error", error=str(e) or e.__class__.__name__)
+
+    results = await asyncio.gather(*(run(url) for url in urls))
+    await asyncio.to_thread(_cache_statuses, results)
+    cached.update((result["url"], result) for result in results)
+    return cached
+
+def _cached_statuses(urls):
+    statuses = {}
+    for url in urls:
+        result = link_cache.get("link_status", url)
+        if result is not None:
+            statuses[url] = result
+    return statuses
+
+def _cache_statuses(results):
+    for result in results:
+        link_cache.set("link_status", result["url"], result, ttl=LINK_CACHE_TTLS.get(result["outcome"], LINK_CACHE_TTLS["error"]))
+
+def check_links(urls, concurrency=None, per_host=None, use_cache=True):
+    """Sync wrapper around check_links_async() for thread-based analyzers."""
+    return run_coroutine(check_links_async(urls, concurrency, per_host, use_cache))
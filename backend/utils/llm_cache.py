@@ -0,0 +1,73 @@
+import asyncio
+import os
+from utils.cache import create_cache
+
+LLM_CACHE_TTL = int(os.environ.get("LLM_CACHE_TTL", 7 * 24 * 3600))
+
+# Persisted on disk by default (SQLite, size-bounded LRU) so answers survive restarts
+# and are shared by all workers; LLM_CACHE_BACKEND / LLM_CACHE_MAX_BYTES / LLM_CACHE_PATH override it.
+llm_cache = create_cache("LLM_CACHE", default_ttl=LLM_CACHE_TTL, max_bytes=256 * 1024 * 1024, backend="sqlite")
+
+def llm_cache_key(model, prompt, generation_config=None, response_schema=None, lang=None):
+    """
+    Content address of an LLM request: the same model, generation settings, output
+    schema, language and prompt always map to the same key (hashed by the cache).
+    """
+    return {
+        "model": model,
+        "generation_config": generation_config or {},
+        "response_schema": response_schema,
+        "lang": lang,
+        "prompt": prompt
+    }
+
+def _is_cacheable(response):
+    return response is not None
+
+def cached_generate(key, generate, use_cache=True, should_cache=_is_cacheable):
+    """
+    Returns the cached response for `key`, or calls generate() and caches its
+    result when should_cache(result) is true. use_cache=False bypasses the cache.
+    """
+    if use_cache:
+        cached = llm_cache.get("llm", key)
+        if cached is not None:
+            return cached
+    response = generate()
+    if use_cache and should_cache(response):
+        llm_cache.set("llm", key, response)
+    return response
+
+async def cached_generate_async(key, generate, use_cache=True, should_cache=_is_cacheable):
+    """
+    Async version of cached_generate(); generate() returns an awaitable.
+    The cache is read and written on a worker thread: a SQLite lookup waiting on
+    a lock must not stall the other coroutines of the shared event loop.
+    """
+    if use_cache:
+        cached = await asyncio.to_thread(llm_cache.get, "llm", key)
+        if cached is not None:
+            return cached
+    response = await generate()
+    if use_cache and should_cache(response):
+        await asyncio.to_thread(llm_cache.set, "llm", key, response)
+    return response
+
+def cached_stream(key, stream, use_cache=True):
+    """
+    Streaming version of cached_generate(): yields the text chunks of stream(),
+    then caches the assembled text once the stream completed. A cached answer is
+    yielded as a single chunk. An interrupted or empty stream is not cached.
+    """
+    if use_cache:
+        cached = llm_cache.get("llm", key)
+        if cached is not None:
+            yield cached
+            return
+    chunks = []
+    for chunk in stream():
+        chunks.append(chunk)
+        yield chunk
+    text = "".join(chunks)
+    if use_cache and text:
+        llm_cache.set("llm", key, text)
@@ -0,0 +1,131 @@
+import asyncio
+import contextvars
+import functools
+import hashlib
+import json
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# --- Coalescing of identical in-flight requests ---
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+_inflight_async = {}
+
+def request_key(*parts):
+    """Stable hash of a request's parts (function, prompt, model, schema...)."""
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+def coalesce(key, func):
+    """
+    Runs func() once per key at a time: callers arriving while an identical
+    request is in flight wait for it and share its result (or its exception).
+    """
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = _inflight[key] = Future()
+    if not leader:
+        return future.result()
+    try:
+        result = func()
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+async def coalesce_async(key, coro_func):
+    """Async version of coalesce(); callers must share one event loop (the async runtime's)."""
+    task = _inflight_async.get(key)
+    if task is None:
+        task = asyncio.ensure_future(coro_func())
+        _inflight_async[key] = task
+        task.add_done_callback(lambda _: _inflight_async.pop(key, None))
+    # shield: a cancelled caller must not cancel the request the others are waiting for
+    return await asyncio.shield(task)
+
+def coalesced(func):
+    """Decorator: identical concurrent calls of a sync LLM wrapper share one upstream request."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return coalesce(request_key(func.__module__, func.__qualname__, args, kwargs), lambda: func(*args, **kwargs))
+    return wrapper
+
+def coalesced_async(func):
+    """Decorator: identical concurrent calls of an async LLM wrapper share one upstream request."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await coalesce_async(request_key(func.__module__, func.__qualname__, args, kwargs), lambda: func(*args, **kwargs))
+    return wrapper
+
+# --- Parallel and merged requests ---
+
+def run_parallel(calls, max_workers=None):
+    """
+    Runs independent zero-argument calls concurrently and returns their results
+    in order. A failed call's slot holds the exception instead of a result.
+    """
+    calls = list(calls)
+    if not calls:
+        return []
+    with ThreadPoolExecutor(max_workers=max_workers or len(calls)) as executor:
+        # Each call runs in a copy of the caller's context (priority lane, ...)
+        futures = [executor.submit(contextvars.copy_context().run, call) for call in calls]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            results.append(e)
+    return results
+
+def build_merged_prompt(tasks, context="", preamble=""):
+    """
+    Builds one prompt answering several related tasks over a shared context,
+    so the context (an article, the analysis data) is sent once instead of per task.
+    """
+    lines = [preamble.strip()] if preamble else []
+    lines.append("Complete each of the following tasks and return a single JSON object with one key per task:")
+    for name, task in tasks.items():
+        lines.append(f'- "{name}": {task["instruction"].strip()}')
+    if context:
+        lines.append("")
+        lines.append(context.strip())
+    return "\n".join(lines)
+
+def build_merged_schema(tasks):
+    """Structured-output schema with one property per task."""
+    return {
+        "type": "OBJECT",
+        "properties": {name: task.get("schema", {"type": "STRING"}) for name, task in tasks.items()},
+        "required": list(tasks)
+    }
+
+def merged_request(tasks, call_json, call_single=None, context="", preamble=""):
+    """
+    Answers related tasks with one structured-output request.
+    tasks:       {name: {"instruction": str, "schema": field schema (default STRING)}}
+    call_json:   call_json(prompt, schema) -> dict, a single JSON-mode LLM call
+    call_single: call_single(name) -> value, used in parallel for the tasks the
+                 merged answer is missing (or for all of them if it failed)
+    Returns {name: value}; tasks that still failed hold their exception.
+    """
+    results = {}
+    try:
+        answer = call_json(build_merged_prompt(tasks, context, preamble), build_merged_schema(tasks))
+        if isinstance(answer, dict):
+            results = {name: answer[name] for name in tasks if answer.get(name) not in (None, "")}
+    except Exception as e:
+        print(f"Merged LLM request failed, falling back to separate requests: {e}")
+
+    missing = [name for name in tasks if name not in results]
+    if missing and call_single is not None:
+        for name, value in zip(missing, run_parallel(functools.partial(call_single, name) for name in missing)):
+            results[name] = value
+    return results
@@ -0,0 +1,224 @@
+import codecs
+import re
+import sqlite3
+import threading
+import requests
+from utils.html_parser import extract_page_features, PageFeatures
+from utils.validator_store import get_validator_store, content_hash
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+# <meta charset="..."> or <meta http-equiv="Content-Type" content="text/html; charset=...">,
+# searched in the first bytes of the page like a browser's prescan
+META_CHARSET_RE = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([a-zA-Z0-9_:.-]+)', re.IGNORECASE)
+CHARSET_SNIFF_BYTES = 4096
+BOMS = ((codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16'))
+
+def _known_encoding(name):
+    try:
+        return codecs.lookup(name).name
+    except (LookupError, TypeError):
+        return None
+
+def detect_encoding(headers, content, fallback=None):
+    """
+    Encoding of an HTML body: the Content-Type charset, else a BOM or <meta charset>,
+    else UTF-8 when the body is valid UTF-8, else `fallback` (e.g. requests'
+    apparent_encoding). requests itself assumes ISO-8859-1 for text/html without
+    a charset, which garbles UTF-8 pages such as Arabic sites.
+    """
+    # Snapshot headers are a plain dict, so match the header name case-insensitively
+    content_type = next((value for name, value in (headers or {}).items() if name.lower() == 'content-type'), None) or ''
+    match = re.search(r'charset\s*=\s*["\']?([^"\';\s]+)', content_type, re.IGNORECASE)
+    if match and _known_encoding(match.group(1)):
+        return _known_encoding(match.group(1))
+    for bom, encoding in BOMS:
+        if content.startswith(bom):
+            return encoding
+    match = META_CHARSET_RE.search(content[:CHARSET_SNIFF_BYTES])
+    if match and _known_encoding(match.group(1).decode('ascii')):
+        return _known_encoding(match.group(1).decode('ascii'))
+    try:
+        content.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    fallback = fallback() if callable(fallback) else fallback
+    return _known_encoding(fallback) or 'utf-8'
+
+class PageSnapshot:
+    """
+    A single downloaded copy of a page, shared by every analyzer in one run.
+    The text is decoded and the page features extracted lazily, at most once.
+    """
+    def __init__(self, url, response=None, error=None):
+        self.url = url
+        self.error = error
+        self._response = response
+        self.final_url = response.url if response is not None else url
+        self.status_code = response.status_code if response is not None else None
+        self.headers = dict(response.headers) if response is not None else {}
+        self.content = response.content if response is not None else b""
+        self.not_modified = False # The server answered 304; content comes from the validator store
+        self.reused = False       # The stored extraction was reused instead of parsing again
+        self._encoding = None
+        self._text = None
+        self._features = None
+        self._store = None
+        self._content_hash = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_stored(cls, url, record):
+        """Rebuilds a snapshot from a ValidatorStore record (after a 304 Not Modified)."""
+        snapshot = cls(url)
+        snapshot.final_url = record["final_url"] or url
+        snapshot.status_code = 200
+        snapshot.headers = record["headers"]
+        snapshot.content = record["content"]
+        snapshot._encoding = detect_encoding(snapshot.headers, snapshot.content, record["encoding"])
+        return snapshot
+
+    @property
+    def ok(self):
+        return self.error is None and self.status_code is not None and self.status_code < 400
+
+    def raise_for_status(self):
+        """Re-raises the fetch error or the HTTP error, like requests.Response.raise_for_status()."""
+        if self.error is not None:
+            raise self.error
+        if self._response is not None:
+            self._response.raise_for_status()
+
+    @property
+    def encoding(self):
+        """Encoding the text is decoded with (see detect_encoding)."""
+        if self._encoding is None:
+            fallback = (lambda: self._response.apparent_encoding) if self._response is not None else None
+            self._encoding = detect_encoding(self.headers, self.content, fallback)
+        return self._encoding
+
+    @property
+    def text(self):
+        if self._text is None:
+            with self._lock:
+                if self._text is None:
+                    self._text = self.content.decode(self.encoding, errors='replace')
+        return self._text
+
+    @property
+    def features(self):
+        """Single-pass extraction of the page (see utils.html_parser.PageFeatures)."""
+        if self._features is None:
+            text = self.text
+            with self._lock:
+                if self._features is None:
+                    self._features = extract_page_features(text)
+                    if self._store is not None:
+                        try:
+                            self._store.save_features(self.url, self._content_hash, self._features)
+                        except sqlite3.Error as e:
+                            print(f"Error storing extraction of {self.url}: {e}")
+        return self._features
+
+    def _use_stored_features(self, record):
+        # An extraction stored before PageFeatures gained fields is parsed again
+        if record.get("features") is not None and all(field in record["features"] for field in PageFeatures.__slots__):
+            self._features = PageFeatures.from_dict(record["features"])
+            self.reused = True
+
+class BodyTooLarge(ValueError):
+    """The response body is larger than the max_bytes given to fetch_page()."""
+
+def _read_capped(response, max_bytes):
+    """Reads a streamed response body, aborting the download once it exceeds max_bytes."""
+    body = bytearray()
+    try:
+        for chunk in response.iter_content(chunk_size=65536):
+            body.extend(chunk)
+            if len(body) > max_bytes:
+                raise BodyTooLarge(f"Response body of {response.url} exceeds {max_bytes} bytes")
+    finally:
+        response.close()
+    # Hand the body back to the response, so .content and .text work as for a normal download
+    response._content = bytes(body)
+
+def fetch_page(url, timeout=10, headers=None, conditional=False, max_bytes=None):
+    """
+    Downloads a page once and wraps it in a PageSnapshot.
+    Network errors are stored on the snapshot instead of being raised, so each
+    analyzer can report them through its usual error handling.
+
+    With conditional=True the ETag / Last-Modified of the previous download are
+    sent; on 304 Not Modified, or when the new body hashes the same, the stored
+    body and extraction are reused instead of parsing the page again.
+
+    With max_bytes the body is streamed and the download aborted as soon as it
+    grows past the limit; the snapshot then carries a BodyTooLarge error and
+    nothing is stored.
+    """
+    store = stored = None
+    request_headers = dict(headers or DEFAULT_HEADERS)
+    if conditional:
+        try:
+            store = get_validator_store()
+            stored = store.get(url)
+        except sqlite3.Error as e:
+            print(f"Error reading validators of {url}: {e}")
+            store = stored = None
+    if stored:
+        if stored["etag"]:
+            request_headers['If-None-Match'] = stored["etag"]
+        if stored["last_modified"]:
+            request_headers['If-Modified-Since'] = stored["last_modified"]
+
+    try:
+        response = requests.get(url, headers=request_headers, timeout=timeout, stream=max_bytes is not None)
+        if max_bytes is not None:
+            _read_capped(response, max_bytes)
+    except BodyTooLarge as e:
+        print(f"Error fetching {url}: {e}")
+        return PageSnapshot(url, error=e)
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching {url}: {e}")
+        return PageSnapshot(url, error=e)
+
+    if store is None:
+        return PageSnapshot(url, response=response)
+
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    try:
+        if stored and response.status_code == 304:
+            store.touch(url, etag, last_modified)
+            snapshot = PageSnapshot.from_stored(url, stored)
+            snapshot.not_modified = True
+            snapshot._use_stored_features(stored)
+            if snapshot._features is None:
+                snapshot._store = store
+                snapshot._content_hash = stored["content_hash"]
+            return snapshot
+
+        snapshot = PageSnapshot(url, response=response)
+        if response.status_code != 200:
+            return snapshot
+        digest = content_hash(response.content)
+        if stored and digest == stored["content_hash"]:
+            # Same bytes without validator support (or with changed validators): skip the parse
+            store.touch(url, etag, last_modified)
+            snapshot._use_stored_features(stored)
+        else:
+            digest = store.save(
+                url, response.content, etag=etag, last_modified=last_modified,
+                encoding=snapshot.encoding,
+                final_url=response.url, headers=dict(response.headers)
+            )
+        if digest is not None and snapshot._features is None:
+            snapshot._store = store
+            snapshot._content_hash = digest
+        return snapshot
+    except sqlite3.Error as e:
+        print(f"Error updating validators of {url}: {e}")
+        return PageSnapshot(url, response=response)
@@ -0,0 +1,234 @@
+import asyncio
+import contextvars
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Priority lanes, highest first: requests from the UI go ahead of bulk runs and background jobs
+LANES = ("interactive", "bulk")
+_current_lane = contextvars.ContextVar("rate_limit_lane", default="interactive")
+
+# Longest a call may wait in line before giving up (seconds)
+RATE_LIMIT_MAX_WAIT = float(os.environ.get("RATE_LIMIT_MAX_WAIT", 120))
+
+# Default quotas per API key and model; override per API ({API}_RPM / {API}_TPM)
+# or per model ({API}_RPM_{MODEL}, e.g. GEMINI_RPM_GEMINI_2_0_FLASH=2000).
+DEFAULT_QUOTAS = {
+    "gemini": {"rpm": 60, "tpm": 1000000},
+    "pagespeed": {"rpm": 240, "tpm": None},
+}
+
+class RateLimitTimeout(Exception):
+    """Raised when a call waited longer than its limit for a quota slot."""
+
+@contextmanager
+def priority_lane(lane):
+    """Runs the enclosed calls in the given lane ("interactive" or "bulk")."""
+    if lane not in LANES:
+        raise ValueError(f"Unknown priority lane: {lane}")
+    token = _current_lane.set(lane)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+def current_lane():
+    return _current_lane.get()
+
+def estimate_tokens(text):
+    """Rough token count of a prompt (about 4 characters per token)."""
+    return len(text or "") // 4 + 1
+
+class _Bucket:
+    """Token bucket refilled continuously at `per_minute` / 60 per second, holding at most a minute's worth."""
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, amount):
+        """Seconds until `amount` is available (0 when it already is)."""
+        missing = min(amount, self.capacity) - self.level
+        return 0.0 if missing <= 0 else missing / self.rate
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute buckets for one API key and model.
+    Calls over the quota queue up instead of failing: each lane is served in
+    arrival order, and a lane only proceeds when every higher lane is empty.
+    """
+    def __init__(self, name, rpm, tpm=None):
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = _Bucket(rpm)
+        self._tokens = _Bucket(tpm) if tpm else None
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+        self._queues = {lane: deque() for lane in LANES}
+        self._stats = {lane: {"acquired": 0, "timeouts": 0, "wait_total": 0.0, "wait_max": 0.0} for lane in LANES}
+
+    def _head(self):
+        for lane in LANES:
+            if self._queues[lane]:
+                return self._queues[lane][0]
+        return None
+
+    def _try_acquire(self, ticket, tokens):
+        """Takes the quota if `ticket` is first in line; returns 0, or the seconds to wait. Caller holds the lock."""
+        if self._head() is not ticket:
+            return None
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        self._requests.refill(now)
+        delay = self._requests.wait_for(1)
+        if self._tokens is not None:
+            self._tokens.refill(now)
+            delay = max(delay, self._tokens.wait_for(tokens))
+        if delay > 0:
+            return delay
+        self._requests.take(1)
+        if self._tokens is not None:
+            self._tokens.take(tokens)
+        return 0.0
+
+    def _enqueue(self, lane):
+        ticket = object()
+        with self._cond:
+            self._queues[lane].append(ticket)
+        return ticket
+
+    def _leave(self, ticket, lane, started_at, acquired):
+        waited = time.monotonic() - started_at
+        with self._cond:
+            self._queues[lane].remove(ticket)
+            stats = self._stats[lane]
+            if acquired:
+                stats["acquired"] += 1
+                stats["wait_total"] += waited
+                stats["wait_max"] = max(stats["wait_max"], waited)
+            else:
+                stats["timeouts"] += 1
+            self._cond.notify_all()
+        return waited
+
+    def acquire(self, tokens=1, lane=None, timeout=None):
+        """
+        Blocks until a request (and `tokens` tokens) fit in the quota.
+        Returns the seconds waited; raises RateLimitTimeout after `timeout`
+        (default RATE_LIMIT_MAX_WAIT).
+        """
+        lane = lane or current_lane()
+        timeout = RATE_LIMIT_MAX_WAIT if timeout is None else timeout
+        started_at = time.monotonic()
+        ticket = self._enqueue(lane)
+        acquired = False
+        try:
+            with self._cond:
+                while True:
+                    delay = self._try_acquire(ticket, tokens)
+                    if delay == 0:
+                        acquired = True
+                        break
+                    remaining = started_at + timeout - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    # Not first in line: sleep until notified by the waiter ahead
+                    self._cond.wait(remaining if delay is None else min(delay, remaining))
+        finally:
+            waited = self._leave(ticket, lane, started_at, acquired)
+        if not acquired:
+            raise RateLimitTimeout(f"Waited {waited:.1f}s for a {self.name} quota slot")
+        return waited
+
+    async def acquire_async(self, tokens=1, lane=None, timeout=None):
+        """Async version of acquire(); waits with asyncio.sleep instead of blocking the loop."""
+        lane = lane or current_lane()
+        timeout = RATE_LIMIT_MAX_WAIT if timeout is None else timeout
+        started_at = time.monotonic()
+        ticket = self._enqueue(lane)
+        acquired = False
+        try:
+            while True:
+                with self._cond:
+                    delay = self._try_acquire(ticket, tokens)
+                if delay == 0:
+                    acquired = True
+                    break
+                remaining = started_at + timeout - time.monotonic()
+                if remaining <= 0:
+                    break
+                # Async waiters are not notified; poll at least every 250ms while queued behind others
+                await asyncio.sleep(min(0.25 if delay is None else delay, remaining))
+        finally:
+            waited = self._leave(ticket, lane, started_at, acquired)
+        if not acquired:
+            raise RateLimitTimeout(f"Waited {waited:.1f}s for a {self.name} quota slot")
+        return waited
+
+    def pause(self, seconds):
+        """Holds every caller for `seconds`, e.g. after the server answered 429 with Retry-After."""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def stats(self):
+        with self._cond:
+            lanes = {}
+            for lane in LANES:
+                stats = self._stats[lane]
+                lanes[lane] = {
+                    "queued": len(self._queues[lane]),
+                    "acquired": stats["acquired"],
+                    "timeouts": stats["timeouts"],
+                    "avg_wait_seconds": round(stats["wait_total"] / stats["acquired"], 3) if stats["acquired"] else 0.0,
+                    "max_wait_seconds": round(stats["wait_max"], 3)
+                }
+            return {
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "queue_depth": sum(len(queue) for queue in self._queues.values()),
+                "paused_seconds": round(max(0.0, self._paused_until - time.monotonic()), 3),
+                "lanes": lanes
+            }
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def _quota(api, model, name):
+    default = DEFAULT_QUOTAS.get(api, {}).get(name)
+    value = os.environ.get(f"{api.upper()}_{name.upper()}", default)
+    if model:
+        model_suffix = re.sub(r'[^A-Z0-9]+', '_', model.upper()).strip('_')
+        value = os.environ.get(f"{api.upper()}_{name.upper()}_{model_suffix}", value)
+    return int(value) if value not in (None, "", "0") else None
+
+def get_limiter(api, api_key, model=None):
+    """Shared limiter of one API key (and model) in this process, created from the configured quotas."""
+    key_id = hashlib.sha256((api_key or "").encode('utf-8')).hexdigest()[:8]
+    name = ":".join(part for part in (api, model, key_id) if part)
+    limiter = _limiters.get(name)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(name)
+            if limiter is None:
+                limiter = _limiters[name] = RateLimiter(name, _quota(api, model, "rpm") or 60, _quota(api, model, "tpm"))
+    return limiter
+
+def limiter_stats():
+    """Queue depth and wait times of every limiter, for sizing quotas."""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {name: limiter.stats() for name, limiter in limiters.items()}
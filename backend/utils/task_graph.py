@@ -0,0 +1,130 @@
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+def error_fallback(error):
+    """Default partial result of a node that failed or timed out."""
+    return {"error": str(error)}
+
+class NodeTimeout(Exception):
+    """Raised into a node's fallback when the node ran longer than its timeout."""
+
+class _Node:
+    __slots__ = ('name', 'func', 'deps', 'timeout', 'fallback', 'emit')
+
+    def __init__(self, name, func, deps, timeout, fallback, emit):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.timeout = timeout
+        self.fallback = fallback
+        self.emit = emit
+
+class TaskGraph:
+    """
+    A small dependency-aware scheduler. Each node declares the nodes it needs;
+    it starts on the thread pool as soon as all of them have a result and is
+    called with those results as positional arguments, in the order of `deps`.
+
+    A node that raises or exceeds its timeout gets the value of its fallback
+    (a callable receiving the exception, or a plain value) and its dependents
+    still run with that partial result. A timed-out thread cannot be killed;
+    it is abandoned and its late result is ignored.
+    """
+    def __init__(self, max_workers=None, default_timeout=None):
+        self.max_workers = max_workers
+        self.default_timeout = default_timeout
+        self._nodes = {}
+
+    def add(self, name, func, deps=(), timeout=None, fallback=error_fallback, emit=True):
+        """
+        Adds a node. `emit=False` hides intermediate values (e.g. the page snapshot)
+        from iter_results(); they are still passed to dependents.
+        """
+        if name in self._nodes:
+            raise ValueError(f"Task '{name}' is already defined.")
+        self._nodes[name] = _Node(name, func, deps, timeout if timeout is not None else self.default_timeout, fallback, emit)
+        return self
+
+    def _validate(self):
+        for node in self._nodes.values():
+            for dep in node.deps:
+                if dep not in self._nodes:
+                    raise ValueError(f"Task '{node.name}' depends on unknown task '{dep}'.")
+        # Kahn's algorithm: every node must become ready at some point
+        remaining = {name: set(node.deps) for name, node in self._nodes.items()}
+        while remaining:
+            ready = [name for name, deps in remaining.items() if not deps]
+            if not ready:
+                raise ValueError(f"Task graph has a dependency cycle among: {', '.join(sorted(remaining))}")
+            for name in ready:
+                del remaining[name]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+
+    def _resolve_fallback(self, node, error):
+        print(f"Task '{node.name}' did not complete: {error}")
+        if callable(node.fallback):
+            try:
+                return node.fallback(error)
+            except Exception as e:
+                print(f"Fallback of task '{node.name}' failed: {e}")
+                return error_fallback(error)
+        return node.fallback
+
+    def iter_results(self):
+        """
+        Runs the graph and yields (name, result) for each emitted node as it
+        completes. Closing the generator early cancels the work not yet started.
+        """
+        self._validate()
+        results = {}
+        waiting = dict(self._nodes)
+        running = {}  # future -> (node, deadline)
+        executor = ThreadPoolExecutor(max_workers=self.max_workers or max(len(self._nodes), 1))
+
+        def start_ready_nodes():
+            for name, node in list(waiting.items()):
+                if all(dep in results for dep in node.deps):
+                    del waiting[name]
+                    args = [results[dep] for dep in node.deps]
+                    # Each node runs in a copy of the caller's context (request-scoped context variables)
+                    future = executor.submit(contextvars.copy_context().run, node.func, *args)
+                    deadline = time.monotonic() + node.timeout if node.timeout else None
+                    running[future] = (node, deadline)
+
+        try:
+            start_ready_nodes()
+            while running:
+                deadlines = [deadline for _, deadline in running.values() if deadline is not None]
+                timeout = max(min(deadlines) - time.monotonic(), 0) if deadlines else None
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+
+                finished = []
+                for future in done:
+                    node, _ = running.pop(future)
+                    try:
+                        value = future.result()
+                    except Exception as e:
+                        value = self._resolve_fallback(node, e)
+                    finished.append((node, value))
+
+                now = time.monotonic()
+                for future, (node, deadline) in list(running.items()):
+                    if deadline is not None and deadline <= now:
+                        del running[future]
+                        future.cancel()
+                        finished.append((node, self._resolve_fallback(node, NodeTimeout(f"timed out after {node.timeout}s"))))
+
+                for node, value in finished:
+                    results[node.name] = value
+                start_ready_nodes()
+                for node, value in finished:
+                    if node.emit:
+                        yield node.name, value
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def run(self):
+        """Runs the graph to completion and returns {name: result} of the emitted nodes."""
+        return dict(self.iter_results())
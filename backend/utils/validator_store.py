@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+
+VALIDATOR_STORE_PATH = os.environ.get("VALIDATOR_STORE_PATH", os.path.join(tempfile.gettempdir(), "seo_analyzer_validators.sqlite3"))
+# Bodies larger than this are not stored, so those URLs are always downloaded in full
+VALIDATOR_MAX_BODY_BYTES = int(os.environ.get("VALIDATOR_MAX_BODY_BYTES", 10 * 1024 * 1024))
+# Stored pages not seen for this long are deleted, in seconds
+VALIDATOR_MAX_AGE = int(os.environ.get("VALIDATOR_MAX_AGE", 30 * 24 * 3600))
+
+def content_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+class ValidatorStore:
+    """
+    Per-URL record of the last successful download: the ETag and Last-Modified
+    validators, a hash of the body, the body itself (zlib-compressed) and the
+    serialized page extraction. Used to send conditional GETs on re-analysis and
+    to reuse the stored extraction when the page did not change.
+    """
+    def __init__(self, path=VALIDATOR_STORE_PATH, max_body_bytes=VALIDATOR_MAX_BODY_BYTES, max_age=VALIDATOR_MAX_AGE):
+        self.path = path
+        self.max_body_bytes = max_body_bytes
+        self.max_age = max_age
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS page_validators (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, "
+            "content_hash TEXT NOT NULL, body BLOB NOT NULL, encoding TEXT, final_url TEXT, headers TEXT, "
+            "features TEXT, checked_at REAL NOT NULL)"
+        )
+
+    def _connection(self):
+        # One connection per thread and per process (connections must not cross a fork)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, url):
+        """Returns the stored record of a URL, or None."""
+        row = self._connection().execute(
+            "SELECT etag, last_modified, content_hash, body, encoding, final_url, headers, features FROM page_validators WHERE url = ?",
+            (url,)
+        ).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, stored_hash, body, encoding, final_url, headers, features = row
+        return {
+            "etag": etag,
+            "last_modified": last_modified,
+            "content_hash": stored_hash,
+            "content": zlib.decompress(body),
+            "encoding": encoding,
+            "final_url": final_url,
+            "headers": json.loads(headers) if headers else {},
+            "features": json.loads(features) if features else None
+        }
+
+    def save(self, url, content, etag=None, last_modified=None, encoding=None, final_url=None, headers=None):
+        """Stores a fresh download; the extraction is added later by save_features()."""
+        if len(content) > self.max_body_bytes:
+            self.delete(url)
+            return None
+        digest = content_hash(content)
+        self._connection().execute(
+            "INSERT OR REPLACE INTO page_validators (url, etag, last_modified, content_hash, body, encoding, final_url, headers, features, checked_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, NULL, ?)",
+            (url, etag, last_modified, digest, zlib.compress(content), encoding, final_url, json.dumps(headers or {}), time.time())
+        )
+        self._after_write()
+        return digest
+
+    def touch(self, url, etag=None, last_modified=None):
+        """Marks a stored page as still current, keeping any validators the server did not resend."""
+        self._connection().execute(
+            "UPDATE page_validators SET etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified), checked_at = ? WHERE url = ?",
+            (etag, last_modified, time.time(), url)
+        )
+
+    def save_features(self, url, digest, features):
+        """Attaches the extraction to the stored body it was computed from."""
+        self._connection().execute(
+            "UPDATE page_validators SET features = ? WHERE url = ? AND content_hash = ?",
+            (json.dumps(features.to_dict(), ensure_ascii=False), url, digest)
+        )
+
+    def delete(self, url):
+        self._connection().execute("DELETE FROM page_validators WHERE url = ?", (url,))
+
+    def _after_write(self):
+        self._writes += 1
+        if self._writes % 500 == 0:
+            self._connection().execute("DELETE FROM page_validators WHERE checked_at < ?", (time.time() - self.max_age,))
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_validator_store():
+    """Returns the process-wide ValidatorStore, created on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ValidatorStore()
+    return _store